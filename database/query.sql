@@ -10,3 +10,8 @@ SELECT * FROM waypoint;
 SELECT * FROM operator;
 SELECT * FROM affected_operator;
 SELECT * FROM service;
+SELECT * FROM extract_retry;
+SELECT * FROM api_quota;
+SELECT * FROM quarantine;
+SELECT * FROM loaded_payload;
+SELECT * FROM anomaly;
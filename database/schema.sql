@@ -1,7 +1,7 @@
 -- Creates the schema for the database
 
 
-DROP TABLE IF EXISTS subscriber, incident, operator, affected_operator, service, station, waypoint, performance_archive, cancel_code, cancellation CASCADE;
+DROP TABLE IF EXISTS subscriber, incident, operator, affected_operator, service, station, waypoint, performance_archive, cancel_code, cancellation, extract_retry, api_quota, quarantine, loaded_payload, anomaly CASCADE;
 
 
 CREATE TABLE subscriber(
@@ -55,7 +55,8 @@ CREATE TABLE waypoint(
     actual_departure TIMESTAMP(0),
     service_id SMALLINT NOT NULL REFERENCES service(service_id),
     station_id SMALLINT NOT NULL REFERENCES station(station_id),
-    CHECK (actual_arrival IS NOT NULL OR actual_departure IS NOT NULL)
+    CHECK (actual_arrival IS NOT NULL OR actual_departure IS NOT NULL),
+    UNIQUE (service_id, station_id, run_date)
 );
 
 CREATE TABLE performance_archive(
@@ -75,7 +76,52 @@ CREATE TABLE cancel_code(
 CREATE TABLE cancellation(
     cancellation_id SMALLINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
     cancel_code_id SMALLINT NOT NULL REFERENCES cancel_code(cancel_code_id),
-    waypoint_id BIGINT NOT NULL REFERENCES waypoint(waypoint_id)
+    waypoint_id BIGINT NOT NULL REFERENCES waypoint(waypoint_id),
+    UNIQUE (cancel_code_id, waypoint_id)
+);
+
+CREATE TABLE extract_retry(
+    extract_retry_id INT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    station_crs CHAR(3) NOT NULL,
+    run_date DATE NOT NULL,
+    attempts SMALLINT NOT NULL DEFAULT 1,
+    next_attempt TIMESTAMP(0) NOT NULL,
+    created_at TIMESTAMP(0) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (station_crs, run_date)
+);
+
+CREATE TABLE api_quota(
+    quota_date DATE PRIMARY KEY,
+    calls INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE quarantine(
+    quarantine_id BIGINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    station_crs CHAR(3) NOT NULL,
+    service_uid TEXT,
+    run_date TEXT,
+    reasons TEXT[] NOT NULL,
+    record JSONB NOT NULL,
+    quarantined_at TIMESTAMP(0) NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE loaded_payload(
+    station_crs CHAR(3) NOT NULL,
+    payload_hash CHAR(32) NOT NULL,
+    loaded_at TIMESTAMP(0) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (station_crs, payload_hash)
+);
+
+CREATE TABLE anomaly(
+    anomaly_id BIGINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    station_crs CHAR(3) NOT NULL,
+    service_uid TEXT NOT NULL,
+    run_date DATE NOT NULL,
+    reasons TEXT[] NOT NULL,
+    arrival_delay REAL,
+    departure_delay REAL,
+    excluded BOOLEAN NOT NULL,
+    detected_at TIMESTAMP(0) NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 INSERT INTO operator(operator_code, operator_name)
@@ -0,0 +1,173 @@
+'''Detects implausible times and delays in a batch of services before load, using fixed
+limits and each station's median and median absolute deviation of delays'''
+
+from os import environ as ENV
+import logging
+
+import numpy as np
+from psycopg2.extensions import connection as DBConnection
+
+from times_real import resolve_columns
+from transform_real import NormalisedBatch, ServiceRecord
+from validate_real import get_reason_counts
+
+MAX_DWELL_ERROR_MINUTES = 30
+MAX_EARLY_MINUTES = 120
+NEXT_DAY_ERROR_MINUTES = 720
+OUTLIER_SCORE = 10.0
+MIN_OUTLIER_MINUTES = 180
+MIN_STATION_SERVICES = 20
+MAD_SCALE = 1.4826
+IMPOSSIBLE_REASONS = ["departure_before_arrival", "early_by_hours", "next_day_error"]
+OUTLIER_REASONS = ["arrival_delay_outlier", "departure_delay_outlier"]
+ANOMALY_MODE = "exclude"
+
+
+def get_anomaly_mode() -> str:
+    '''Returns how anomalies are handled, set with ANOMALY_MODE: "flag" records them all,
+    "exclude" also leaves out impossible times, and "strict" leaves out outliers too'''
+    return ENV.get("ANOMALY_MODE", ANOMALY_MODE)
+
+
+def get_excluded_reasons(mode: str | None = None) -> set[str]:
+    '''Returns the reasons that keep a service from being loaded in a mode'''
+    mode = mode or get_anomaly_mode()
+    if mode == "flag":
+        return set()
+    if mode == "strict":
+        return set(IMPOSSIBLE_REASONS + OUTLIER_REASONS)
+    return set(IMPOSSIBLE_REASONS)
+
+
+def group_medians(values: np.ndarray, groups: np.ndarray, group_count: int) -> np.ndarray:
+    '''Returns the median of the values in each group, ignoring NaN, with NaN for groups
+    that have no values. Every group is found in one sort.'''
+    present = ~np.isnan(values)
+    values, groups = values[present], groups[present]
+    order = np.lexsort((values, groups))
+    values = values[order]
+
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_values = counts > 0
+    lower = (starts + (counts - 1) // 2)[has_values]
+    upper = (starts + counts // 2)[has_values]
+
+    medians = np.full(group_count, np.nan)
+    medians[has_values] = (values[lower] + values[upper]) / 2
+    return medians
+
+
+def get_outliers(delays: np.ndarray, groups: np.ndarray, group_count: int) -> np.ndarray:
+    '''Returns a mask of delays far from their station's median, measured in median
+    absolute deviations. Stations with too few delays are not judged.'''
+    medians = group_medians(delays, groups, group_count)
+    deviations = np.abs(delays - medians[groups])
+    spreads = np.maximum(group_medians(deviations, groups, group_count) * MAD_SCALE, 1.0)
+    sizes = np.bincount(groups[~np.isnan(delays)], minlength=group_count)
+
+    with np.errstate(invalid="ignore"):
+        return ((deviations / spreads[groups] > OUTLIER_SCORE) &
+                (deviations > MIN_OUTLIER_MINUTES) &
+                (sizes[groups] >= MIN_STATION_SERVICES))
+
+
+def find_anomalies(services: list[ServiceRecord],
+                   groups: np.ndarray) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    '''Checks every service at once, grouping them by station with an array of indexes.
+    Returns a mask of the services failing each check and the resolved delay columns.'''
+    columns = resolve_columns(services)
+    arrival, departure = columns["arrival_delay"], columns["departure_delay"]
+    group_count = int(groups.max()) + 1
+    dwell = columns["actual_departure"] - columns["actual_arrival"]
+
+    with np.errstate(invalid="ignore"):
+        checks = {
+            "departure_before_arrival":
+                dwell < np.timedelta64(-MAX_DWELL_ERROR_MINUTES, "m"),
+            "early_by_hours":
+                (arrival < -MAX_EARLY_MINUTES) | (departure < -MAX_EARLY_MINUTES),
+            "next_day_error":
+                (np.abs(arrival) >= NEXT_DAY_ERROR_MINUTES) |
+                (np.abs(departure) >= NEXT_DAY_ERROR_MINUTES),
+            "arrival_delay_outlier": get_outliers(arrival, groups, group_count),
+            "departure_delay_outlier": get_outliers(departure, groups, group_count)
+        }
+    return checks, columns
+
+
+def split_anomalies(services: list[ServiceRecord], groups: np.ndarray,
+                    crs: list[str]) -> tuple[list[int], list[dict]]:
+    '''Returns the indexes of the services to load, and an entry for each anomaly
+    recording its reasons and whether it was excluded'''
+    if not services:
+        return [], []
+
+    checks, columns = find_anomalies(services, groups)
+    failures = np.array(list(checks.values()), dtype=bool)
+    excluded_reasons = get_excluded_reasons()
+    excluded = np.array([reason in excluded_reasons for reason in checks], dtype=bool)
+    kept = np.flatnonzero(~failures[excluded].any(axis=0)).tolist()
+
+    entries = []
+    for index in np.flatnonzero(failures.any(axis=0)).tolist():
+        service = services[index]
+        entries.append({
+            "station_crs": crs[groups[index]],
+            "service_uid": service.service_uid,
+            "run_date": service.run_date,
+            "reasons": [reason for reason, failed in zip(checks, failures[:, index])
+                        if failed],
+            "arrival_delay": float(columns["arrival_delay"][index]),
+            "departure_delay": float(columns["departure_delay"][index]),
+            "excluded": bool(failures[excluded, index].any())
+        })
+    return kept, entries
+
+
+def detect_station_anomalies(station: dict) -> tuple[dict, list[dict]]:
+    '''Returns the station without its excluded services, and an entry for each anomaly'''
+    services = station["services"]
+    kept, entries = split_anomalies(services, np.zeros(len(services), dtype=np.int64),
+                                    [station["location"]["crs"]])
+    return {**station, "services": [services[index] for index in kept]}, entries
+
+
+def detect_batch_anomalies(batch: NormalisedBatch) -> tuple[NormalisedBatch, list[dict]]:
+    '''Checks a whole normalised batch at once, comparing each service with the others
+    at its station. Returns the batch without its excluded facts, and the anomalies.
+    The dimension tables are kept as they are, since they were already validated.'''
+    crs, groups = np.unique([fact.station_crs for fact in batch.facts], return_inverse=True)
+    kept, entries = split_anomalies([fact.service for fact in batch.facts],
+                                    groups.astype(np.int64), crs.tolist())
+    if len(kept) == len(batch.facts):
+        return batch, entries
+    return batch._replace(facts=[batch.facts[index] for index in kept]), entries
+
+
+def record_anomalies(conn: DBConnection, entries: list[dict]) -> None:
+    '''Stores anomalies, their reasons and delays in the anomaly table'''
+    if not entries:
+        return
+
+    query = '''
+        INSERT INTO anomaly (station_crs, service_uid, run_date, reasons,
+            arrival_delay, departure_delay, excluded)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    '''
+    try:
+        with conn.cursor() as cur:
+            for entry in entries:
+                cur.execute(query, (
+                    entry["station_crs"], entry["service_uid"], entry["run_date"],
+                    entry["reasons"],
+                    None if np.isnan(entry["arrival_delay"]) else entry["arrival_delay"],
+                    None if np.isnan(entry["departure_delay"]) else entry["departure_delay"],
+                    entry["excluded"]))
+        conn.commit()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        conn.rollback()
+        logging.error("Anomaly: Error occurred recording %s anomalies: %s", len(entries), e)
+    logging.warning("Anomaly: Found %s anomalies, %s excluded: %s", len(entries),
+                    sum(entry["excluded"] for entry in entries),
+                    dict(get_reason_counts(entries)))
@@ -0,0 +1,140 @@
+'''Daily ledger of RealTime Trains API calls, and prioritisation of stations
+when the remaining allowance cannot cover them all'''
+
+from os import environ as ENV
+import logging
+
+from psycopg2.extensions import connection as DBConnection
+
+from rate_limiter import AdaptiveLimiter
+from load_real import get_connection, get_cursor
+
+QUOTA_RESERVE = 50
+ACTIVITY_DAYS = 7
+DELAY_THRESHOLD_MINUTES = 5
+
+
+def get_daily_quota() -> int | None:
+    '''Returns the daily API call allowance set with RTT_DAILY_QUOTA, if there is one'''
+    quota = ENV.get("RTT_DAILY_QUOTA")
+    return int(quota) if quota else None
+
+
+def get_calls_today(conn: DBConnection) -> int:
+    '''Returns how many API calls have been recorded today'''
+    with get_cursor(conn) as cur:
+        cur.execute("SELECT calls FROM api_quota WHERE quota_date = CURRENT_DATE")
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def record_calls(conn: DBConnection, calls: int) -> None:
+    '''Adds a run's API calls to today's total'''
+    if not calls:
+        return
+    query = '''
+        INSERT INTO api_quota (quota_date, calls) VALUES (CURRENT_DATE, %s)
+        ON CONFLICT (quota_date) DO UPDATE SET calls = api_quota.calls + EXCLUDED.calls
+    '''
+    with get_cursor(conn) as cur:
+        cur.execute(query, (calls,))
+    conn.commit()
+
+
+def get_remaining_calls(conn: DBConnection, reserve: bool = True) -> int | None:
+    '''Returns the calls left today, or None when there is no daily quota. Unless reserve
+    is False, as it is for the retry queue, RTT_QUOTA_RESERVE calls are kept back.'''
+    quota = get_daily_quota()
+    if quota is None:
+        return None
+    reserved = int(ENV.get("RTT_QUOTA_RESERVE", QUOTA_RESERVE)) if reserve else 0
+    return max(0, quota - reserved - get_calls_today(conn))
+
+
+def get_station_weights() -> dict[str, float]:
+    '''Returns the weights set with STATION_WEIGHTS, such as "KGX:5,EDB:2".
+    Stations without a weight have a weight of 1.'''
+    weights = {}
+    for entry in ENV.get("STATION_WEIGHTS", "").split(","):
+        if ":" in entry:
+            crs, weight = entry.split(":", 1)
+            weights[crs.strip().upper()] = float(weight)
+    return weights
+
+
+def get_delay_activity(conn: DBConnection, days: int = ACTIVITY_DAYS) -> dict[str, int]:
+    '''Returns the number of delayed arrivals or departures at each station
+    over the last few days, keyed by CRS'''
+    query = '''
+        SELECT s.station_crs, COUNT(*) FROM waypoint AS w
+        JOIN station AS s ON s.station_id = w.station_id
+        WHERE w.run_date >= CURRENT_DATE - %s
+        AND (w.actual_arrival > w.booked_arrival + make_interval(mins => %s)
+            OR w.actual_departure > w.booked_departure + make_interval(mins => %s))
+        GROUP BY s.station_crs
+    '''
+    with get_cursor(conn) as cur:
+        cur.execute(query, (days, DELAY_THRESHOLD_MINUTES, DELAY_THRESHOLD_MINUTES))
+        return dict(cur.fetchall())
+
+
+def prioritise_stations(list_of_crs: list[str],
+                        weights: dict[str, float],
+                        activity: dict[str, int]) -> list[str]:
+    '''Orders stations by weight, then by recent delays.
+    Stations that tie keep their original order.'''
+    return sorted(list_of_crs,
+                  key=lambda crs: (-weights.get(crs, 1), -activity.get(crs, 0)))
+
+
+def plan_stations(conn: DBConnection,
+                  list_of_crs: list[str]) -> tuple[list[str], list[str], int | None]:
+    '''Splits stations into those to extract within today's remaining calls and those
+    to skip, highest priority first. Also returns the remaining calls.'''
+    remaining = get_remaining_calls(conn)
+    if remaining is None or len(list_of_crs) <= remaining:
+        return list_of_crs, [], remaining
+
+    ordered = prioritise_stations(list_of_crs, get_station_weights(),
+                                  get_delay_activity(conn))
+    logging.warning("Quota: %s calls left today for %s stations, skipping the %s "
+                    "lowest priority stations.", remaining, len(list_of_crs),
+                    len(list_of_crs) - remaining)
+    return ordered[:remaining], ordered[remaining:], remaining
+
+
+def get_remaining_quota() -> int | None:
+    '''Returns the calls left today, opening its own connection'''
+    if get_daily_quota() is None:
+        return None
+    conn = get_connection()
+    try:
+        return get_remaining_calls(conn)
+    finally:
+        conn.close()
+
+
+def plan_api_stations(list_of_crs: list[str]) -> tuple[list[str], list[str], int | None]:
+    '''Plans the stations of a run, opening its own connection'''
+    if get_daily_quota() is None:
+        return list_of_crs, [], None
+    conn = get_connection()
+    try:
+        return plan_stations(conn, list_of_crs)
+    finally:
+        conn.close()
+
+
+def record_limiter_calls(limiter: AdaptiveLimiter) -> None:
+    '''Records every request a limiter made, including retries, in the ledger'''
+    calls = limiter.report()["requests"]
+    if not calls:
+        return
+    conn = get_connection()
+    try:
+        record_calls(conn, calls)
+        logging.info("Quota: Recorded %s API calls.", calls)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logging.error("Quota: Failed to record %s API calls: %s", calls, e)
+    finally:
+        conn.close()
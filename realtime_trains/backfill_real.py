@@ -0,0 +1,184 @@
+'''Backfills RealTime Trains data for a range of dates across a process pool'''
+
+from os import environ as ENV, path
+from argparse import ArgumentParser
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from itertools import product
+from time import perf_counter
+from typing import TextIO
+import atexit
+import logging
+
+from dotenv import load_dotenv
+
+from extract_real import (get_all_stations_crs, get_session, fetch_station)
+from rate_limiter import AdaptiveLimiter, REQUESTS_PER_SECOND
+from load_real import get_connection, get_cursor, import_payload
+from api_quota import get_remaining_quota, record_calls
+
+BACKFILL_WORKERS = 4
+CHECKPOINT_FILE = "backfill_checkpoint.csv"
+PROGRESS_INTERVAL = 50
+
+WORKER = {}
+
+
+def get_date_range(start: str, end: str) -> list[str]:
+    '''Returns every date from start to end inclusive as YYYY-MM-DD'''
+    start_date = date.fromisoformat(start)
+    end_date = date.fromisoformat(end)
+    if end_date < start_date:
+        raise ValueError(f"Backfill: End date {end} is before start date {start}")
+    return [(start_date + timedelta(days=day)).isoformat()
+            for day in range((end_date - start_date).days + 1)]
+
+
+def get_units(stations: list[str], run_dates: list[str]) -> list[tuple[str, str]]:
+    '''Returns a (station, date) work unit for every station on every date'''
+    return list(product(stations, run_dates))
+
+
+def read_checkpoint(checkpoint_path: str) -> set[tuple[str, str]]:
+    '''Returns the units already completed by earlier runs of the backfill'''
+    if not path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, encoding="utf-8") as file:
+        return {tuple(line.strip().split(",")) for line in file if line.strip()}
+
+
+def init_worker(rate: float, max_requests: int | None = None) -> None:
+    '''Opens the session, rate limiter and database connection used by one worker process.
+    The limiter is capped at the worker's share of the rate and of today's remaining API
+    calls, and has no time budget, since a backfill runs for as long as its units take.'''
+    load_dotenv()
+    WORKER["session"] = get_session(ENV.get("REALTIME_USERNAME"),
+                                    ENV.get("REALTIME_PASSWORD"),
+                                    pool_size=1)
+    WORKER["limiter"] = AdaptiveLimiter(rate=rate, max_concurrency=1, time_budget=None,
+                                        max_requests=max_requests, max_rate=rate)
+    WORKER["conn"] = get_connection()
+    WORKER["cur"] = get_cursor(WORKER["conn"])
+    atexit.register(WORKER["conn"].close)
+
+
+def record_worker_calls(before: int) -> None:
+    '''Records the API calls a worker has made since its limiter had made before calls'''
+    calls = WORKER["limiter"].report()["requests"] - before
+    try:
+        record_calls(WORKER["conn"], calls)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        WORKER["conn"].rollback()
+        logging.error("Backfill: Failed to record %s API calls: %s", calls, e)
+
+
+def backfill_unit(unit: tuple[str, str]) -> tuple[tuple[str, str], bool]:
+    '''Extracts, transforms and loads one station for one date inside a worker process.
+    Returns the unit and whether it completed, which it has not if any of its rows
+    failed to load. The API calls it made are recorded in the quota ledger.'''
+    crs, run_date = unit
+    before = WORKER["limiter"].report()["requests"]
+    try:
+        station_data = fetch_station(crs, WORKER["session"],
+                                     WORKER["limiter"], run_date)["data"]
+        if not station_data:
+            return unit, False
+        return unit, import_payload(station_data, WORKER["conn"], WORKER["cur"]) != "failed"
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logging.error("Backfill: Error occurred for %s on %s: %s",
+                      crs, run_date, e)
+        return unit, False
+    finally:
+        record_worker_calls(before)
+
+
+def log_progress(completed: int, pending: int, elapsed: float) -> None:
+    '''Logs throughput in units per minute and the estimated time remaining'''
+    per_minute = completed / elapsed * 60 if elapsed else 0
+    remaining = (pending - completed) / per_minute if per_minute else 0
+    logging.info("Backfill: %s/%s units in %.1fs (%.1f units/min, ~%.1f min remaining).",
+                 completed, pending, elapsed, per_minute, remaining)
+
+
+def collect_units(futures: list[Future], checkpoint: TextIO, start: float) -> dict:
+    '''Appends each unit to the checkpoint as it loads, logging progress as it goes.
+    Returns how many units loaded and failed.'''
+    stats = {"loaded": 0, "failed": 0}
+    for completed, future in enumerate(as_completed(futures), start=1):
+        (crs, run_date), loaded = future.result()
+        if loaded:
+            checkpoint.write(f"{crs},{run_date}\n")
+            checkpoint.flush()
+            stats["loaded"] += 1
+        else:
+            stats["failed"] += 1
+        if completed % PROGRESS_INTERVAL == 0:
+            log_progress(completed, len(futures), perf_counter() - start)
+    return stats
+
+
+def run_backfill(stations: list[str],
+                 run_dates: list[str],
+                 workers: int = BACKFILL_WORKERS,
+                 checkpoint_path: str = CHECKPOINT_FILE) -> dict:
+    '''Backfills every (station, date) unit not already in the checkpoint file.
+    Each completed unit is appended to the checkpoint, so an interrupted backfill resumes
+    where it stopped. The API rate allowance and today's remaining API calls are split
+    evenly across the workers. Units left when the calls run out fail, and are run again
+    by the next backfill.'''
+    units = get_units(stations, run_dates)
+    done = read_checkpoint(checkpoint_path)
+    pending = [unit for unit in units if unit not in done]
+    logging.info("Backfill: %s units, %s already done, %s to run on %s workers.",
+                 len(units), len(units) - len(pending), len(pending), workers)
+
+    rate = float(ENV.get("RTT_REQUESTS_PER_SECOND",
+                 REQUESTS_PER_SECOND)) / workers
+    remaining = get_remaining_quota()
+    if remaining is not None and remaining < len(pending):
+        logging.warning("Backfill: %s API calls left today for %s units.",
+                        remaining, len(pending))
+    max_requests = None if remaining is None else remaining // workers
+    start = perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(rate, max_requests)) as executor, \
+            open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        stats = collect_units([executor.submit(backfill_unit, unit) for unit in pending],
+                              checkpoint, start)
+
+    elapsed = perf_counter() - start
+    stats["elapsed"] = elapsed
+    stats["units_per_minute"] = len(pending) / elapsed * 60 if elapsed else 0
+    log_progress(len(pending), len(pending), elapsed)
+    if stats["failed"]:
+        logging.warning(
+            "Backfill: %s units failed and will be retried on the next run.", stats["failed"])
+    return stats
+
+
+def get_parser() -> ArgumentParser:
+    '''Returns the command line parser for the backfill'''
+    parser = ArgumentParser(
+        description="Backfill RealTime Trains data for a range of dates.")
+    parser.add_argument("start", help="First date to backfill (YYYY-MM-DD)")
+    parser.add_argument("end", help="Last date to backfill (YYYY-MM-DD)")
+    parser.add_argument("--stations", nargs="+",
+                        help="CRS codes to backfill, all stations by default")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS,
+                        help="Number of worker processes")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help="File recording completed units")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    load_dotenv()
+    args = get_parser().parse_args()
+    run_backfill(args.stations or get_all_stations_crs(),
+                 get_date_range(args.start, args.end),
+                 args.workers,
+                 args.checkpoint)
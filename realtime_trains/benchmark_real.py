@@ -0,0 +1,235 @@
+'''Benchmarks the Realtime Trains transform on synthetic days of RTT station responses'''
+
+from argparse import ArgumentParser
+from datetime import date
+from os import cpu_count
+from time import perf_counter
+import random
+
+from stream_real import measure
+from transform_real import ServiceRecord, process_station, process_all_stations
+from times_real import resolve_times
+from load_real import get_waypoint_times
+from columnar_real import stations_to_batch
+
+OPERATORS = [("GW", "Great Western Railway"), ("VT", "Avanti West Coast"),
+             ("XC", "CrossCountry"), ("NT", "Northern"), ("SW", "South Western Railway")]
+# The keys the transform removed before services were projected onto records
+SERVICE_REMOVE_KEYS = {"trainIdentity", "runningIdentity", "isPassenger"}
+SERVICE_LOC_DETAILS_REMOVE_KEYS = {"realtimeActivated", "origin", "destination", "isCall",
+                                   "isPublicCall", "platform", "platformConfirmed",
+                                   "platformChanged"}
+
+
+def get_hhmm(minutes: int) -> str:
+    '''Formats minutes after midnight as an HHMM time'''
+    return f"{minutes // 60 % 24:02}{minutes % 60:02}"
+
+
+def make_synthetic_service(index: int, run_date: str, rng: random.Random) -> dict:
+    '''Creates a service in the shape returned by the RTT location search'''
+    atoc_code, atoc_name = rng.choice(OPERATORS)
+    booked = rng.randrange(300, 1440)
+    delay = max(0, int(rng.gauss(2, 5)))
+    location_detail = {
+        "realtimeActivated": True,
+        "tiploc": "BATHSPA",
+        "crs": "BTH",
+        "description": "Bath Spa",
+        "gbttBookedArrival": get_hhmm(booked),
+        "gbttBookedDeparture": get_hhmm(booked + 2),
+        "origin": [{"tiploc": "PADTON", "description": "London Paddington",
+                    "workingTime": "083000", "publicTime": "0830"}],
+        "destination": [{"tiploc": "BRSTLTM", "description": "Bristol Temple Meads",
+                         "workingTime": "101500", "publicTime": "1015"}],
+        "isCall": True,
+        "isPublicCall": True,
+        "realtimeArrival": get_hhmm(booked + delay),
+        "realtimeArrivalActual": True,
+        "realtimeDeparture": get_hhmm(booked + delay + 2),
+        "realtimeDepartureActual": True,
+        "platform": str(rng.randrange(1, 4)),
+        "platformConfirmed": True,
+        "platformChanged": False,
+        "displayAs": "CALL"
+    }
+    if booked + delay >= 1440:
+        location_detail["realtimeArrivalNextDay"] = True
+    if booked + delay + 2 >= 1440:
+        location_detail["realtimeDepartureNextDay"] = True
+    if index % 50 == 0:
+        location_detail["cancelReasonCode"] = "M8"
+        location_detail["cancelReasonLongText"] = "a fault on this train"
+
+    return {
+        "locationDetail": location_detail,
+        "serviceUid": f"S{index:05}",
+        "runDate": run_date,
+        "trainIdentity": f"1A{index % 100:02}",
+        "runningIdentity": f"1A{index % 100:02}",
+        "atocCode": atoc_code,
+        "atocName": atoc_name,
+        "serviceType": "bus" if index % 40 == 0 else "train",
+        "isPassenger": True
+    }
+
+
+def make_synthetic_station(crs: str, services: int, run_date: str | None = None,
+                           seed: int = 0) -> dict:
+    '''Creates a station response with the given number of services'''
+    run_date = run_date or date.today().isoformat()
+    rng = random.Random(f"{seed}:{crs}")
+    return {
+        "location": {"name": f"{crs} Station", "crs": crs, "tiploc": crs,
+                     "country": "gb", "system": "nr"},
+        "filter": None,
+        "services": [make_synthetic_service(index, run_date, rng)
+                     for index in range(services)]
+    }
+
+
+def get_synthetic_crs(index: int) -> str:
+    '''Returns a unique three letter code for the station at an index'''
+    letters = []
+    for _ in range(3):
+        index, letter = divmod(index, 26)
+        letters.append(chr(ord("A") + letter))
+    return "".join(reversed(letters))
+
+
+def make_synthetic_day(stations: int, services: int, run_date: str | None = None) -> list[dict]:
+    '''Creates a day of station responses, each with the given number of services'''
+    return [make_synthetic_station(get_synthetic_crs(index), services, run_date, index)
+            for index in range(stations)]
+
+
+def remove_keys(service: dict) -> dict:
+    '''Copies an RTT service without the keys the transform removed before services
+    were projected onto records, leaving every other field in place'''
+    service = {key: value for key, value in service.items()
+               if key not in SERVICE_REMOVE_KEYS}
+    service["locationDetail"] = {key: value for key, value in service["locationDetail"].items()
+                                 if key not in SERVICE_LOC_DETAILS_REMOVE_KEYS}
+    return service
+
+
+def compare_service_memory(services: int) -> dict:
+    '''Compares the memory held by transformed services as the nested dictionaries left
+    by removing unused keys and as records'''
+    station = make_synthetic_station("BTH", services)
+
+    def as_dicts() -> list[dict]:
+        return [remove_keys(service)
+                for service in station["services"] if service["serviceType"] == "train"]
+
+    def as_records() -> list[ServiceRecord]:
+        return process_station(station, resolve=False)["services"]
+
+    dicts, _, dict_peak = measure(as_dicts)
+    records, _, record_peak = measure(as_records)
+    return {
+        "services": len(records),
+        "matches": [ServiceRecord.from_rtt(service) for service in dicts] == records,
+        "dict_bytes": dict_peak,
+        "record_bytes": record_peak
+    }
+
+
+def compare_time_resolution(services: int) -> dict:
+    '''Compares resolving timestamps row by row in the loader against resolving the
+    whole batch at once'''
+    station = process_station(make_synthetic_station("BTH", services), resolve=False)
+    records = station["services"]
+
+    start = perf_counter()
+    row_times = [get_waypoint_times(service) for service in records]
+    row_seconds = perf_counter() - start
+
+    start = perf_counter()
+    resolve_times(records)
+    batch_seconds = perf_counter() - start
+
+    return {
+        "services": len(records),
+        "matches": [get_waypoint_times(service) for service in records] == row_times,
+        "row_seconds": row_seconds,
+        "batch_seconds": batch_seconds
+    }
+
+
+def compare_columnar_memory(stations: int, services: int) -> dict:
+    '''Compares the memory held by a transformed day as stations of records
+    and as a columnar batch'''
+    day = make_synthetic_day(stations, services)
+
+    records, _, record_peak = measure(process_all_stations, day)
+    batch, _, batch_peak = measure(stations_to_batch, records)
+    return {
+        "services": len(batch),
+        "record_bytes": record_peak,
+        "batch_bytes": batch.nbytes,
+        "batch_peak_bytes": batch_peak
+    }
+
+
+def compare_parallel_transform(stations: int, services: int, workers: int) -> dict:
+    '''Compares transforming a synthetic day serially against across a process pool'''
+    day = make_synthetic_day(stations, services)
+
+    start = perf_counter()
+    serial = process_all_stations(day, workers=1)
+    serial_seconds = perf_counter() - start
+
+    start = perf_counter()
+    parallel = process_all_stations(day, workers=workers)
+    parallel_seconds = perf_counter() - start
+
+    return {
+        "stations": stations,
+        "workers": workers,
+        "matches": parallel == serial,
+        "serial_seconds": serial_seconds,
+        "parallel_seconds": parallel_seconds
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the Realtime Trains transform.")
+    parser.add_argument("--services", type=int, default=100_000,
+                        help="Services to transform when measuring memory")
+    parser.add_argument("--time-rows", type=int, default=1_000_000,
+                        help="Services whose timestamps are resolved when timing")
+    parser.add_argument("--stations", type=int, default=1000,
+                        help="Stations in the synthetic day for the parallel transform")
+    parser.add_argument("--station-services", type=int, default=300,
+                        help="Services at each station of the synthetic day")
+    parser.add_argument("--workers", type=int, default=cpu_count(),
+                        help="Processes for the parallel transform")
+    args = parser.parse_args()
+
+    memory = compare_service_memory(args.services)
+    print(f"Memory for {memory['services']} services: "
+          f"dicts {memory['dict_bytes'] / 1e6:.1f}MB, "
+          f"records {memory['record_bytes'] / 1e6:.1f}MB "
+          f"({memory['dict_bytes'] / memory['record_bytes']:.1f}x smaller), "
+          f"matching: {memory['matches']}")
+
+    timing = compare_time_resolution(args.time_rows)
+    print(f"Timestamps for {timing['services']} services: "
+          f"row by row {timing['row_seconds']:.2f}s, "
+          f"batch {timing['batch_seconds']:.2f}s "
+          f"({timing['row_seconds'] / timing['batch_seconds']:.1f}x faster), "
+          f"matching: {timing['matches']}")
+
+    columnar = compare_columnar_memory(args.stations, args.station_services)
+    print(f"Day of {columnar['services']} services: "
+          f"records {columnar['record_bytes'] / 1e6:.1f}MB, "
+          f"columnar batch {columnar['batch_bytes'] / 1e6:.1f}MB "
+          f"({columnar['batch_peak_bytes'] / 1e6:.1f}MB peak while converting)")
+
+    transform = compare_parallel_transform(args.stations, args.station_services, args.workers)
+    print(f"Transform of {transform['stations']} stations: "
+          f"serial {transform['serial_seconds']:.2f}s, "
+          f"{transform['workers']} processes {transform['parallel_seconds']:.2f}s "
+          f"({transform['serial_seconds'] / transform['parallel_seconds']:.1f}x faster), "
+          f"matching: {transform['matches']}")
@@ -0,0 +1,124 @@
+'''Loads a day of waypoints in bulk, copying them into a temporary staging table and
+resolving their stations, operators, services and cancel codes with set-based SQL'''
+
+from time import perf_counter
+import logging
+
+import numpy as np
+from psycopg2.extensions import connection as DBConnection
+
+from columnar_real import copy_batch
+
+STAGING_TABLE = "waypoint_staging"
+STAGING_COLUMNS = ["station_crs", "station_name", "service_uid", "atoc_code", "atoc_name",
+                   "run_date", "booked_arrival", "actual_arrival", "booked_departure",
+                   "actual_departure", "cancel_code", "cancel_reason"]
+WAYPOINT_CONFLICT = '''ON CONFLICT (service_id, station_id, run_date) DO UPDATE
+        SET booked_arrival = EXCLUDED.booked_arrival,
+            actual_arrival = EXCLUDED.actual_arrival,
+            booked_departure = EXCLUDED.booked_departure,
+            actual_departure = EXCLUDED.actual_departure'''
+
+CREATE_STAGING = f'''
+    CREATE TEMPORARY TABLE {STAGING_TABLE} (
+        station_crs CHAR(3),
+        station_name TEXT,
+        service_uid TEXT,
+        atoc_code CHAR(2),
+        atoc_name TEXT,
+        run_date DATE,
+        booked_arrival TIMESTAMP(0),
+        actual_arrival TIMESTAMP(0),
+        booked_departure TIMESTAMP(0),
+        actual_departure TIMESTAMP(0),
+        cancel_code CHAR(2),
+        cancel_reason TEXT
+    ) ON COMMIT DROP
+'''
+
+MERGE_QUERIES = {
+    "station": f'''
+        INSERT INTO station (station_crs, station_name)
+        SELECT DISTINCT ON (station_crs) station_crs, station_name FROM {STAGING_TABLE}
+        WHERE station_name IS NOT NULL
+        ORDER BY station_crs
+        ON CONFLICT (station_crs) DO NOTHING
+    ''',
+    "operator": f'''
+        INSERT INTO operator (operator_code, operator_name)
+        SELECT DISTINCT ON (atoc_code) atoc_code, atoc_name FROM {STAGING_TABLE}
+        WHERE atoc_code IS NOT NULL AND atoc_name IS NOT NULL
+        ORDER BY atoc_code
+        ON CONFLICT (operator_code) DO NOTHING
+    ''',
+    "service": f'''
+        INSERT INTO service (service_uid, operator_id)
+        SELECT DISTINCT ON (s.service_uid) s.service_uid, o.operator_id
+        FROM {STAGING_TABLE} AS s
+        LEFT JOIN operator AS o ON o.operator_code = s.atoc_code
+        ORDER BY s.service_uid
+        ON CONFLICT (service_uid) DO NOTHING
+    ''',
+    "cancel_code": f'''
+        INSERT INTO cancel_code (cancel_code, cause)
+        SELECT DISTINCT ON (cancel_code) cancel_code, cancel_reason FROM {STAGING_TABLE}
+        WHERE cancel_code IS NOT NULL AND cancel_reason IS NOT NULL
+        ORDER BY cancel_code
+        ON CONFLICT (cancel_code) DO NOTHING
+    ''',
+    "resolved": f'''
+        CREATE TEMPORARY TABLE waypoint_resolved ON COMMIT DROP AS
+        SELECT DISTINCT s.run_date, s.booked_arrival, s.actual_arrival,
+            s.booked_departure, s.actual_departure,
+            sv.service_id, st.station_id, s.cancel_code
+        FROM {STAGING_TABLE} AS s
+        JOIN station AS st ON st.station_crs = s.station_crs
+        JOIN service AS sv ON sv.service_uid = s.service_uid
+    ''',
+    "waypoint": f'''
+        INSERT INTO waypoint (run_date, booked_arrival, actual_arrival,
+            booked_departure, actual_departure, service_id, station_id)
+        SELECT DISTINCT ON (r.service_id, r.station_id, r.run_date)
+            r.run_date, r.booked_arrival, r.actual_arrival,
+            r.booked_departure, r.actual_departure, r.service_id, r.station_id
+        FROM waypoint_resolved AS r
+        WHERE r.actual_arrival IS NOT NULL OR r.actual_departure IS NOT NULL
+        ORDER BY r.service_id, r.station_id, r.run_date
+        {WAYPOINT_CONFLICT}
+    ''',
+    "cancellation": '''
+        INSERT INTO cancellation (cancel_code_id, waypoint_id)
+        SELECT DISTINCT c.cancel_code_id, w.waypoint_id
+        FROM waypoint_resolved AS r
+        JOIN cancel_code AS c ON c.cancel_code = r.cancel_code
+        JOIN waypoint AS w ON w.service_id = r.service_id
+            AND w.station_id = r.station_id AND w.run_date = r.run_date
+        WHERE NOT EXISTS (
+            SELECT 1 FROM cancellation AS x
+            WHERE x.cancel_code_id = c.cancel_code_id AND x.waypoint_id = w.waypoint_id
+        )
+    '''
+}
+
+
+def bulk_load(batch: np.ndarray, conn: DBConnection) -> dict:
+    '''Copies a columnar batch into the staging table and merges it into the dimension
+    and fact tables in a single transaction. Returns the rows copied, the rows each query
+    wrote and the seconds taken. Nothing is loaded if any query fails.'''
+    start = perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_STAGING)
+            rows = copy_batch(batch, cur, STAGING_TABLE, STAGING_COLUMNS)
+            inserted = {}
+            for table, query in MERGE_QUERIES.items():
+                cur.execute(query)
+                inserted[table] = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds = perf_counter() - start
+    logging.info("Bulk: Merged %s staged rows: %s", rows, inserted)
+    return {"rows": rows, "inserted": inserted, "seconds": seconds}
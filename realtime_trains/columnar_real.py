@@ -0,0 +1,168 @@
+'''Holds a day of transformed waypoints as a NumPy structured array, one column per field,
+with converters to and from transformed stations and writers for COPY and files'''
+
+from io import StringIO
+from operator import attrgetter
+from typing import TextIO
+
+import numpy as np
+from psycopg2.extensions import cursor as DBCursor
+
+from times_real import MINUTES_PER_DAY, WaypointTimes, resolve_columns, to_python
+from transform_real import NormalisedBatch, ServiceRecord
+
+COPY_NULL = r"\N"
+COPY_ESCAPES = [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]
+TEXT_COLUMNS = ["service_uid", "atoc_code", "atoc_name", "cancel_code", "cancel_reason"]
+FLAG_COLUMNS = ["realtime_arrival_actual", "realtime_departure_actual"]
+TIME_COLUMNS = {
+    "booked_arrival": "booked_arrival",
+    "actual_arrival": "realtime_arrival",
+    "booked_departure": "booked_departure",
+    "actual_departure": "realtime_departure"
+}
+
+
+def get_text_column(values: list[str | None]) -> np.ndarray:
+    '''Returns a fixed width string column, with empty strings for missing values'''
+    return np.array([value or "" for value in values], dtype=str)
+
+
+def stations_to_batch(stations: list[dict]) -> np.ndarray:
+    '''Converts transformed stations into a structured array with a row per service.
+    Services with a malformed time are left out, as the loader would reject them.
+    Missing times are NaT, missing delays NaN and missing text empty.'''
+    services = [service for station in stations for service in station["services"]]
+    counts = [len(station["services"]) for station in stations]
+    resolved = resolve_columns(services) if services else {
+        "invalid": np.zeros(0, dtype=bool), "run_date": np.zeros(0, dtype="datetime64[D]"),
+        **{column: np.zeros(0, dtype="datetime64[m]") for column in TIME_COLUMNS},
+        "arrival_delay": np.zeros(0), "departure_delay": np.zeros(0)}
+
+    columns = {
+        "station_crs": np.repeat(get_text_column(
+            [station["location"]["crs"] for station in stations]), counts),
+        "station_name": np.repeat(get_text_column(
+            [station["location"]["name"] for station in stations]), counts),
+        "run_date": resolved["run_date"],
+        **{column: resolved[column] for column in TIME_COLUMNS},
+        "arrival_delay": resolved["arrival_delay"],
+        "departure_delay": resolved["departure_delay"],
+        **{column: get_text_column(list(map(attrgetter(column), services)))
+           for column in TEXT_COLUMNS},
+        **{column: np.array(list(map(attrgetter(column), services)), dtype=bool)
+           for column in FLAG_COLUMNS}
+    }
+
+    batch = np.empty(len(services), dtype=[(name, column.dtype)
+                                           for name, column in columns.items()])
+    for name, column in columns.items():
+        batch[name] = column
+    return batch[~resolved["invalid"]]
+
+
+def facts_to_batch(batch: NormalisedBatch) -> np.ndarray:
+    '''Converts the facts of a normalised batch into a structured array, grouping them
+    back into stations by CRS'''
+    stations = {}
+    for fact in batch.facts:
+        stations.setdefault(fact.station_crs, []).append(fact.service)
+    return stations_to_batch([{"location": batch.stations[crs], "services": services}
+                              for crs, services in stations.items()])
+
+
+def get_hhmm_columns(times: np.ndarray,
+                     run_dates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Returns the HHMM strings of a timestamp column and whether each falls on the day
+    after the run date, with None for missing times'''
+    minutes = (times - run_dates.astype("datetime64[m]")).astype(np.int64)
+    day_minutes = minutes % MINUTES_PER_DAY
+    text = np.char.add(np.char.zfill((day_minutes // 60).astype(str), 2),
+                       np.char.zfill((day_minutes % 60).astype(str), 2)).astype(object)
+    next_day = np.where(minutes >= MINUTES_PER_DAY, True, None)
+    missing = np.isnat(times)
+    text[missing] = None
+    next_day[missing] = None
+    return text, next_day
+
+
+def batch_to_records(batch: np.ndarray) -> list[ServiceRecord]:
+    '''Converts the rows of a structured array back into records with resolved times'''
+    if batch.size == 0:
+        return []
+    fields = {"run_date": np.datetime_as_string(batch["run_date"]).tolist()}
+    for column, field in TIME_COLUMNS.items():
+        text, next_day = get_hhmm_columns(batch[column], batch["run_date"])
+        fields[field] = text.tolist()
+        fields[f"{field}_next_day"] = next_day.tolist()
+    for column in TEXT_COLUMNS:
+        fields[column] = [value or None for value in batch[column].tolist()]
+    for column in FLAG_COLUMNS:
+        fields[column] = np.where(batch[column], True, None).tolist()
+
+    times = map(WaypointTimes._make, zip(
+        to_python(batch["run_date"].astype("datetime64[m]")),
+        *(to_python(batch[column]) for column in WaypointTimes._fields[1:])))
+    return [ServiceRecord(times=service_times, **dict(zip(fields, values)))
+            for service_times, values in zip(times, zip(*fields.values()))]
+
+
+def batch_to_stations(batch: np.ndarray) -> list[dict]:
+    '''Converts a structured array back into transformed stations, in the shape
+    process_all_stations returns. Stations without services are not kept in a batch.'''
+    records = batch_to_records(batch)
+    crs = batch["station_crs"]
+    starts = [0, *(np.flatnonzero(crs[1:] != crs[:-1]) + 1).tolist()]
+    ends = [*starts[1:], len(batch)]
+    return [{"location": {"name": str(batch["station_name"][start]),
+                          "crs": str(crs[start])},
+             "services": records[start:end]}
+            for start, end in zip(starts, ends) if start < end]
+
+
+def format_column(column: np.ndarray) -> np.ndarray:
+    '''Formats a column as text in PostgreSQL's COPY format, with \\N for missing values'''
+    if np.issubdtype(column.dtype, np.datetime64):
+        return np.where(np.isnat(column), COPY_NULL, np.datetime_as_string(column))
+    if np.issubdtype(column.dtype, np.bool_):
+        return np.where(column, "t", "f")
+    if np.issubdtype(column.dtype, np.floating):
+        return np.where(np.isnan(column), COPY_NULL, column.astype(str))
+
+    text = column.astype(str)
+    for character, escaped in COPY_ESCAPES:
+        text = np.char.replace(text, character, escaped)
+    return np.where(text == "", COPY_NULL, text)
+
+
+def write_copy(batch: np.ndarray, file: TextIO, columns: list[str] | None = None) -> int:
+    '''Writes the rows of a batch as tab separated COPY text, returning the rows written'''
+    columns = columns or list(batch.dtype.names)
+    lines = format_column(batch[columns[0]])
+    for column in columns[1:]:
+        lines = np.char.add(np.char.add(lines, "\t"), format_column(batch[column]))
+    if len(lines):
+        file.write("\n".join(lines.tolist()))
+        file.write("\n")
+    return len(lines)
+
+
+def copy_batch(batch: np.ndarray, cur: DBCursor, table: str,
+               columns: list[str] | None = None) -> int:
+    '''Copies the rows of a batch into a table with the matching columns'''
+    columns = columns or list(batch.dtype.names)
+    buffer = StringIO()
+    rows = write_copy(batch, buffer, columns)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+    return rows
+
+
+def save_batch(batch: np.ndarray, filename: str) -> None:
+    '''Saves a batch to a .npy file'''
+    np.save(filename, batch, allow_pickle=False)
+
+
+def load_batch(filename: str) -> np.ndarray:
+    '''Loads a batch saved with save_batch'''
+    return np.load(filename, allow_pickle=False)
@@ -0,0 +1,89 @@
+'''In-process caches of the operator, cancel code and service ids used by the loader,
+loaded in bulk once per run and updated as the loader inserts new rows'''
+
+from threading import Lock
+import logging
+
+from psycopg2.extensions import connection as DBConnection
+
+from station_registry import refresh
+
+DIMENSIONS = {
+    "operator": "operator_code",
+    "cancel_code": "cancel_code",
+    "service": "service_uid"
+}
+SEED_DIMENSIONS = ["operator", "cancel_code"]
+
+CACHE = {
+    "ids": {table: {} for table in DIMENSIONS},
+    "seeded": False,
+    "hits": 0,
+    "misses": 0
+}
+CACHE_LOCK = Lock()
+
+
+def load_dimension(conn: DBConnection, table: str, keys: list[str] | None = None) -> None:
+    '''Adds the ids of a dimension's rows to the cache, either every row or only
+    the rows with the given keys'''
+    column = DIMENSIONS[table]
+    query = f"SELECT {table}_id, {column} FROM {table}"
+    with conn.cursor() as cur:
+        if keys is None:
+            cur.execute(query)
+        else:
+            cur.execute(f"{query} WHERE {column} = ANY(%s)", (keys,))
+        rows = cur.fetchall()
+
+    for table_id, key in rows:
+        cache_id(table, key.strip(), table_id)
+
+
+def preload_dimensions(conn: DBConnection, service_uids: list[str] | None = None) -> None:
+    '''Loads the stations, operators and cancel codes on first use, and the ids of the
+    given services that are not cached yet, each in a single query'''
+    refresh(conn)
+    with CACHE_LOCK:
+        if not CACHE["seeded"]:
+            for table in SEED_DIMENSIONS:
+                load_dimension(conn, table)
+            CACHE["seeded"] = True
+            logging.info("Cache: Loaded %s operators and %s cancel codes.",
+                         len(CACHE["ids"]["operator"]), len(CACHE["ids"]["cancel_code"]))
+
+        missing = sorted({uid for uid in service_uids or []
+                          if uid is not None and uid not in CACHE["ids"]["service"]})
+        if missing:
+            load_dimension(conn, "service", missing)
+
+
+def get_cached_id(table: str, key: str | None) -> int | None:
+    '''Returns the cached id of a dimension row, counting the hit or miss'''
+    table_id = CACHE["ids"][table].get(key)
+    if table_id is None:
+        CACHE["misses"] += 1
+    else:
+        CACHE["hits"] += 1
+    return table_id
+
+
+def cache_id(table: str, key: str, table_id: int) -> None:
+    '''Adds the id of a dimension row to the cache, such as one just inserted'''
+    CACHE["ids"][table][key] = table_id
+
+
+def log_cache_stats() -> None:
+    '''Logs how many lookups the cache answered without the database'''
+    lookups = CACHE["hits"] + CACHE["misses"]
+    logging.info("Cache: %s hits and %s misses (%.1f%% hit rate).", CACHE["hits"],
+                 CACHE["misses"], 100 * CACHE["hits"] / lookups if lookups else 0)
+
+
+def clear_cache() -> None:
+    '''Empties the cache, so the next preload reloads it'''
+    with CACHE_LOCK:
+        CACHE["ids"] = {table: {} for table in DIMENSIONS}
+        CACHE["seeded"] = False
+        CACHE["hits"] = 0
+        CACHE["misses"] = 0
@@ -3,16 +3,27 @@
 import json
 from os import environ as ENV
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 import logging
 
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException
-from requests import get
+from requests import get, Session
 from psycopg2 import connect
 from psycopg2.extras import DictCursor
 from psycopg2.extensions import connection as DBConnection, cursor as DBCursor
 
+from rate_limiter import AdaptiveLimiter, get_limiter, log_limiter_report
+from response_cache import load_response, save_response, load_cached_stations
+from snapshot_real import write_snapshot
+from station_registry import is_fresh, refresh, get_all_crs
+from stream_real import parse_station_stream, STREAM_CHUNK_SIZE
+
+EXTRACT_WORKERS = 8
+
 
 def get_connection() -> DBConnection:
     """Creates a database session and returns a connection object."""
@@ -30,19 +41,61 @@ def get_cursor(conn: DBConnection) -> DBCursor:
     return conn.cursor(cursor_factory=DictCursor)
 
 
-def get_api_url(station_code: str, date: str) -> str:
-    """Constructs the API URL for the given station code and date."""
+def get_extract_workers() -> int:
+    """Returns the number of stations fetched concurrently, configurable with EXTRACT_WORKERS."""
+    return max(1, int(ENV.get("EXTRACT_WORKERS", EXTRACT_WORKERS)))
+
+
+def get_session(username: str | None, password: str | None,
+                pool_size: int = EXTRACT_WORKERS) -> Session:
+    """Creates a keep-alive session that shares the API credentials between requests."""
+    session = Session()
+    if username and password:
+        session.auth = HTTPBasicAuth(username, password)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_api_url(station_code: str, date: str, time: str | None = None) -> str:
+    """Constructs the API URL for the given station code and date.
+    Given an HHMM time, the search only covers services from that time onwards."""
     base_url = "https://api.rtt.io/api/v1/json/search"
+    if time:
+        return f"{base_url}/{station_code}/{date}/{time}"
     return f"{base_url}/{station_code}/{date}"
 
 
-def get_data_from_api(url: str, username: str, password: str) -> dict | None:
-    """Retrieves data from the realtime trains API and returns the response as a dictionary."""
+def is_stream_enabled() -> bool:
+    """Returns whether station responses are parsed incrementally, set with RTT_STREAM_PARSE."""
+    return ENV.get("RTT_STREAM_PARSE", "").lower() in ("1", "true", "yes")
+
+
+def get_data_from_api(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        url: str, username: str, password: str,
+        session: Session | None = None,
+        limiter: AdaptiveLimiter | None = None,
+        stream: bool = False) -> dict | None:
+    """Retrieves data from the realtime trains API and returns the response as a dictionary.
+    Reuses the given session's pooled connection and credentials when one is provided,
+    and throttles and retries the request through the limiter when one is provided.
+    With stream set, the station response is decoded incrementally and only the
+    fields the loader uses are kept."""
+    options = {"stream": True} if stream else {}
+
+    def request():
+        if session is None:
+            return get(url, auth=HTTPBasicAuth(username, password), timeout=10, **options)
+        return session.get(url, timeout=10, **options)
+
     try:
-        response = get(url, auth=HTTPBasicAuth(username, password), timeout=10)
+        response = request() if limiter is None else limiter.call(request)
         response.raise_for_status()
+        if stream:
+            with response:
+                return parse_station_stream(response.iter_content(STREAM_CHUNK_SIZE))
         return response.json()
-    except RequestException as e:
+    except (RequestException, ValueError, TypeError) as e:
         logging.error(
             "Extract: Error occurred while fetching data from API: %s", e)
         logging.error(
@@ -51,13 +104,23 @@ def get_data_from_api(url: str, username: str, password: str) -> dict | None:
 
 
 def save_data_to_file(json_data: list[dict], filename: str) -> None:
-    """Saves the provided data to a JSON file."""
+    """Saves the provided data to a JSON file.
+    Use snapshot_real.write_snapshot for raw extracts that are read back by later stages."""
     with open(filename, "w", encoding="utf-8") as file:
         json.dump(json_data, file, indent=4)
 
 
-def get_yesterday_data_of_station(station_code: str) -> dict | None:
-    """Retrieves data from realtime trains API for the given station code and saves it to a file"""
+def get_run_date() -> str:
+    """Returns yesterday's date, the date each run extracts, as YYYY-MM-DD."""
+    return (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def get_data_of_station(station_code: str,
+                        run_date: str,
+                        session: Session | None = None,
+                        limiter: AdaptiveLimiter | None = None) -> dict | None:
+    """Retrieves data from realtime trains API for the given station code and
+    run date (YYYY-MM-DD)"""
 
     username = ENV.get("REALTIME_USERNAME")
     password = ENV.get("REALTIME_PASSWORD")
@@ -67,10 +130,10 @@ def get_yesterday_data_of_station(station_code: str) -> dict | None:
             "Extract: Username and password are required environment variables.")
         return None
 
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y/%m/%d")
-    api_url = get_api_url(station_code, yesterday)
+    api_url = get_api_url(station_code, run_date.replace("-", "/"))
 
-    station_data = get_data_from_api(api_url, username, password)
+    station_data = get_data_from_api(
+        api_url, username, password, session, limiter, is_stream_enabled())
     if station_data:
         logging.info(
             "Data successfully retrieved for station %s.", station_code)
@@ -80,35 +143,117 @@ def get_yesterday_data_of_station(station_code: str) -> dict | None:
     return None
 
 
+def get_yesterday_data_of_station(station_code: str,
+                                  session: Session | None = None,
+                                  limiter: AdaptiveLimiter | None = None) -> dict | None:
+    """Retrieves yesterday's data from realtime trains API for the given station code"""
+    return get_data_of_station(station_code, get_run_date(), session, limiter)
+
+
 def get_all_stations_crs() -> list[str]:
-    '''Grabs all stations crs from the database'''
-    conn = get_connection()
-    with get_cursor(conn) as cur:
-        cur.execute("SELECT station_crs FROM station")
-        crs_data = cur.fetchall()
-    conn.close()
-    return [crs[0] for crs in crs_data]
+    '''Grabs all stations crs from the station registry, only connecting to the
+    database when the registry is empty or stale'''
+    if not is_fresh():
+        conn = get_connection()
+        try:
+            refresh(conn)
+        finally:
+            conn.close()
+    return get_all_crs()
 
 
-def get_api_data_of_all_stations() -> list[dict] | None:
-    '''Gets all station data from the API'''
+def fetch_station(station_code: str,
+                  session: Session | None = None,
+                  limiter: AdaptiveLimiter | None = None,
+                  run_date: str | None = None) -> dict:
+    '''Fetches one station for the run date, yesterday by default, and records how long
+    the request took. Cached payloads are used instead of the API when the cache is enabled.
+    Streamed payloads are not cached, as they hold only the fields that are loaded.'''
+    start = perf_counter()
+    run_date = run_date or get_run_date()
+    station_data = load_response(station_code, run_date)
+    cached = station_data is not None
+
+    if not cached:
+        station_data = get_data_of_station(
+            station_code, run_date, session, limiter)
+        if station_data and not is_stream_enabled():
+            save_response(station_code, run_date, station_data)
+
+    return {
+        "crs": station_code,
+        "data": station_data,
+        "latency": perf_counter() - start,
+        "cached": cached
+    }
+
+
+def get_station_results(list_of_crs: list[str], max_workers: int | None = None) -> list[dict]:
+    '''Fetches the given stations over a bounded thread pool sharing one session.
+    Requests share one adaptive rate limiter, whose report is logged at the end.
+    Results are returned in the same order as list_of_crs.'''
+    workers = max(1, min(max_workers or get_extract_workers(),
+                         len(list_of_crs) or 1))
+    limiter = get_limiter(workers)
+
+    with get_session(ENV.get("REALTIME_USERNAME"),
+                     ENV.get("REALTIME_PASSWORD"),
+                     pool_size=workers) as session:
+        if workers == 1:
+            results = [fetch_station(crs, session, limiter)
+                       for crs in list_of_crs]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    lambda crs: fetch_station(crs, session, limiter), list_of_crs))
+
+    log_limiter_report(limiter)
+    return results
+
+
+def log_extract_summary(results: list[dict], elapsed: float) -> None:
+    '''Logs how many stations were retrieved and the latency of their requests'''
+    failed = [result["crs"] for result in results if not result["data"]]
+    latencies = [result["latency"] for result in results]
+    cached = sum(1 for result in results if result.get("cached"))
+
+    logging.info("Extract: %s/%s stations retrieved in %.2fs (%s from cache).",
+                 len(results) - len(failed), len(results), elapsed, cached)
+    if latencies:
+        slowest = max(results, key=lambda result: result["latency"])
+        logging.info("Extract: Mean latency %.2fs, slowest station %s at %.2fs.",
+                     sum(latencies) / len(latencies),
+                     slowest["crs"], slowest["latency"])
+    if failed:
+        logging.warning("Extract: Failed stations: %s", ", ".join(failed))
+
+
+def get_api_data_of_all_stations(max_workers: int | None = None) -> list[dict] | None:
+    '''Gets all station data from the API, fetching stations concurrently'''
 
     list_of_crs = get_all_stations_crs()
-    list_of_stations = []
 
-    for crs in list_of_crs:
-        station_data = get_yesterday_data_of_station(crs)
-        if station_data:
-            list_of_stations.append(station_data)
+    start = perf_counter()
+    results = get_station_results(list_of_crs, max_workers)
+    log_extract_summary(results, perf_counter() - start)
+
+    list_of_stations = [result["data"]
+                        for result in results if result["data"]]
 
     logging.info(
         "Data successfully retrieved for all stations.")
     return list_of_stations
 
 
+def get_cached_or_api_data() -> list[dict]:
+    '''Replays yesterday's cached payloads if there are any, otherwise fetches them'''
+    stations = load_cached_stations(get_run_date())
+    return stations or get_api_data_of_all_stations()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s - %(levelname)s - %(message)s")
     load_dotenv()
     data = get_api_data_of_all_stations()
-    save_data_to_file(data, "data.json")
+    write_snapshot(data, "data.ndjson.gz")
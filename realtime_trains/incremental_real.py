@@ -0,0 +1,253 @@
+'''Polls today's RealTime Trains station boards and upserts only the waypoints that changed'''
+
+from os import environ as ENV, path
+from datetime import datetime, timedelta
+from time import sleep, perf_counter
+import json
+import logging
+
+from dotenv import load_dotenv
+from requests import Session
+
+from extract_real import (get_all_stations_crs, get_api_url, get_data_from_api,
+                          get_session)
+from rate_limiter import AdaptiveLimiter, get_limiter
+from api_quota import get_remaining_quota, record_limiter_calls
+from transform_real import ServiceRecord, process_station
+from times_real import resolve_times
+from validate_real import quarantine_services, validate_station
+from anomaly_real import detect_station_anomalies, record_anomalies
+from load_real import (get_connection, get_cursor, get_commit_rows, commit_if_due,
+                       insert_or_get_station,
+                       insert_or_get_operator, insert_or_get_service, upsert_waypoint,
+                       insert_or_get_cancel_code, insert_or_get_cancellation)
+
+SNAPSHOT_FILE = "/tmp/rtt_snapshot.json"
+POLL_INTERVAL = 300
+LOOKBACK_MINUTES = 120
+
+TRACKED_FIELDS = [
+    "booked_arrival",
+    "booked_arrival_next_day",
+    "realtime_arrival",
+    "realtime_arrival_next_day",
+    "booked_departure",
+    "booked_departure_next_day",
+    "realtime_departure",
+    "realtime_departure_next_day",
+    "cancel_code"
+]
+ACTUAL_FLAGS = {
+    "realtime_arrival": "realtime_arrival_actual",
+    "realtime_departure": "realtime_departure_actual"
+}
+
+
+def load_snapshot(snapshot_path: str, run_date: str) -> dict:
+    '''Returns the fingerprints of the last poll, or an empty snapshot on a new day'''
+    if path.exists(snapshot_path):
+        with open(snapshot_path, encoding="utf-8") as file:
+            snapshot = json.load(file)
+        if snapshot.get("run_date") == run_date:
+            return snapshot
+    return {"run_date": run_date, "services": {}}
+
+
+def save_snapshot(snapshot: dict, snapshot_path: str) -> None:
+    '''Saves the fingerprints of the latest poll'''
+    with open(snapshot_path, "w", encoding="utf-8") as file:
+        json.dump(snapshot, file)
+
+
+def keep_actual_times(service: ServiceRecord) -> ServiceRecord:
+    '''Removes realtime times that are still estimates, so only times trains have
+    actually run at are written to the actual_arrival/actual_departure columns'''
+    for time_field, actual_field in ACTUAL_FLAGS.items():
+        if getattr(service, actual_field) is False:
+            setattr(service, time_field, None)
+            setattr(service, f"{time_field}_next_day", None)
+    return service
+
+
+def get_service_key(crs: str, service: ServiceRecord) -> str:
+    '''Returns the key identifying a service's waypoint at a station'''
+    return f"{service.service_uid}:{crs}:{service.run_date}"
+
+
+def get_fingerprint(service: ServiceRecord) -> list:
+    '''Returns the loaded fields of a service, which change as the train runs'''
+    return [getattr(service, field) for field in TRACKED_FIELDS]
+
+
+def get_changed_services(station: dict, snapshot: dict) -> list[ServiceRecord]:
+    '''Returns the services that have an actual time and are new or changed since the
+    last poll. Services without one, including those cancelled before they reached the
+    station, cannot be stored as waypoints and are skipped.'''
+    crs = station["location"]["crs"]
+    changed = []
+
+    for service in station["services"]:
+        service = keep_actual_times(service)
+        if not service.realtime_arrival and not service.realtime_departure:
+            continue
+
+        if snapshot["services"].get(get_service_key(crs, service)) != get_fingerprint(service):
+            changed.append(service)
+
+    return changed
+
+
+def record_services(station: dict, services: list[ServiceRecord], snapshot: dict) -> None:
+    '''Stores the fingerprints of services written to the database in the snapshot'''
+    crs = station["location"]["crs"]
+    for service in services:
+        snapshot["services"][get_service_key(crs, service)] = \
+            get_fingerprint(service)
+
+
+def screen_services(station: dict, services: list[ServiceRecord],
+                    conn) -> list[ServiceRecord]:
+    '''Quarantines the invalid changed services of a station and records their anomalies,
+    as the daily load does. Returns the services left to write.'''
+    screened, quarantined = validate_station({"location": station["location"],
+                                              "services": services})
+    quarantine_services(conn, quarantined)
+    screened, anomalies = detect_station_anomalies(screened)
+    record_anomalies(conn, anomalies)
+    return screened["services"]
+
+
+def upsert_services(station: dict, services: list[ServiceRecord],
+                    conn, cur) -> list[ServiceRecord]:
+    '''Writes the changed services of a station, updating existing waypoints in place,
+    and commits them. Returns the services that were written successfully.'''
+    station_id = insert_or_get_station(station["location"], conn, cur)
+    written = []
+    commit_rows = get_commit_rows()
+    for rows, service in enumerate(services, 1):
+        operator_id = insert_or_get_operator(service, conn, cur)
+        service_id = insert_or_get_service(service, operator_id, conn, cur)
+        waypoint_id = upsert_waypoint(
+            station_id, service_id, service, conn, cur)
+        if waypoint_id is None:
+            continue
+
+        if service.is_cancelled():
+            cancel_code_id = insert_or_get_cancel_code(service, conn, cur)
+            insert_or_get_cancellation(cancel_code_id, waypoint_id, conn, cur)
+        written.append(service)
+        commit_if_due(conn, rows, commit_rows)
+    conn.commit()
+    return written
+
+
+def write_changed_services(station: dict, changed: list[ServiceRecord], snapshot: dict,
+                           conn, cur) -> tuple[int, int]:
+    '''Screens and writes the changed services of a station, recording those written and
+    those quarantined or excluded as anomalies in the snapshot, so the latter are not set
+    aside again until they change. Returns how many were written and set aside.'''
+    valid = screen_services(station, changed, conn)
+    kept = set(map(id, valid))
+    written = upsert_services(station, valid, conn, cur)
+    record_services(station, [service for service in changed if id(service) not in kept]
+                    + written, snapshot)
+    return len(written), len(changed) - len(valid)
+
+
+def get_window_start(now: datetime, lookback: int = LOOKBACK_MINUTES) -> str | None:
+    '''Returns the HHMM start of the search window, or None to search the whole day
+    when the lookback would reach into yesterday'''
+    start = now - timedelta(minutes=lookback)
+    if start.date() != now.date():
+        return None
+    return start.strftime("%H%M")
+
+
+def poll_station(crs: str, now: datetime, snapshot: dict,
+                 session: Session,
+                 limiter: AdaptiveLimiter) -> tuple[dict, list[ServiceRecord]] | None:
+    '''Fetches the recent window of a station's board for today and returns the
+    transformed station with its changed services'''
+    api_url = get_api_url(crs, now.strftime("%Y/%m/%d"), get_window_start(now))
+    station_data = get_data_from_api(api_url, ENV.get("REALTIME_USERNAME"),
+                                     ENV.get("REALTIME_PASSWORD"), session, limiter)
+    if not station_data:
+        return None
+
+    station = process_station(station_data, resolve=False)
+    changed = get_changed_services(station, snapshot)
+    resolve_times(changed)
+    return station, changed
+
+
+def poll_once(list_of_crs: list[str], snapshot: dict) -> dict:
+    '''Polls every station once and upserts only new or changed waypoints.
+    With RTT_DAILY_QUOTA set, stops once today's remaining API calls are spent and
+    records the calls made in the quota ledger.'''
+    now = datetime.now()
+    stats = {"stations": 0, "changed": 0, "set_aside": 0, "elapsed": 0}
+    start = perf_counter()
+
+    limiter = get_limiter(1, get_remaining_quota())
+    conn = get_connection()
+    cur = get_cursor(conn)
+    try:
+        with get_session(ENV.get("REALTIME_USERNAME"),
+                         ENV.get("REALTIME_PASSWORD")) as session:
+            for crs in list_of_crs:
+                if limiter.quota_spent():
+                    logging.warning("Incremental: API quota spent, the remaining "
+                                    "stations were not polled.")
+                    break
+                result = poll_station(crs, now, snapshot, session, limiter)
+                if result is None:
+                    continue
+                station, changed = result
+                if changed:
+                    written, set_aside = write_changed_services(station, changed, snapshot,
+                                                                conn, cur)
+                    stats["changed"] += written
+                    stats["set_aside"] += set_aside
+                stats["stations"] += 1
+    finally:
+        record_limiter_calls(limiter)
+        cur.close()
+        conn.close()
+
+    stats["elapsed"] = perf_counter() - start
+    logging.info("Incremental: %s stations polled, %s waypoints changed, %s set aside "
+                 "in %.2fs.", stats["stations"], stats["changed"], stats["set_aside"],
+                 stats["elapsed"])
+    return stats
+
+
+def handler(_event, _context) -> dict:
+    '''Lambda entry point running one poll, with the snapshot kept in SNAPSHOT_FILE.
+    The file only lasts as long as the warm Lambda environment, and is not saved by a
+    poll that times out, so the next poll then rewrites the whole lookback window.'''
+    logging.getLogger().setLevel(logging.INFO)
+    load_dotenv()
+    snapshot_path = ENV.get("SNAPSHOT_FILE", SNAPSHOT_FILE)
+    snapshot = load_snapshot(snapshot_path, datetime.now().strftime("%Y-%m-%d"))
+    stats = poll_once(get_all_stations_crs(), snapshot)
+    save_snapshot(snapshot, snapshot_path)
+    return stats
+
+
+def run_polling(interval: int = POLL_INTERVAL) -> None:
+    '''Polls all stations every interval seconds, keeping the snapshot in memory'''
+    list_of_crs = get_all_stations_crs()
+    snapshot = {"run_date": None, "services": {}}
+    while True:
+        today = datetime.now().strftime("%Y-%m-%d")
+        if snapshot["run_date"] != today:
+            snapshot = {"run_date": today, "services": {}}
+        poll_once(list_of_crs, snapshot)
+        sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    load_dotenv()
+    run_polling(int(ENV.get("POLL_INTERVAL", POLL_INTERVAL)))
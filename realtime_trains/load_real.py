@@ -1,30 +1,104 @@
 '''Imports cleaned and loaded data from RealTime Trains API to a database'''
 
 from os import environ as ENV
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import groupby
+from operator import attrgetter
 import logging
 from datetime import datetime, timedelta
+from time import perf_counter
 
 from dotenv import load_dotenv
 from psycopg2 import connect
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extensions import connection as DBConnection, cursor as DBCursor
 
-from extract_real import get_api_data_of_all_stations
-from transform_real import process_all_stations
-
-CANCELLATION_FIELDS = ["cancelReasonCode",
-                       "cancelReasonLongText"]
+from extract_real import get_cached_or_api_data
+from transform_real import (NormalisedBatch, ServiceRecord, WaypointFact, normalise_facts,
+                            process_station, process_all_stations)
+from station_registry import refresh, get_station_id, add_station
+from dimension_cache import (cache_id, clear_cache, get_cached_id, log_cache_stats,
+                             preload_dimensions)
+from payload_ledger import get_payload_key, is_payload_loaded, read_ledger, record_payloads
+from anomaly_real import detect_batch_anomalies, detect_station_anomalies, record_anomalies
+from validate_real import (get_reason_counts, quarantine_services,
+                           validate_batch, validate_station)
+from columnar_real import facts_to_batch
+from bulk_load_real import WAYPOINT_CONFLICT, bulk_load
+
+WAYPOINT_TIME_FIELDS = ["run_date", "booked_arrival", "actual_arrival",
+                        "booked_departure", "actual_departure"]
+LOAD_MODE = "row"
+LOAD_COMMIT_ROWS = 0
+LOAD_WORKERS = 4
+ROW_SAVEPOINT = "load_row"
+
+
+def get_connection_config() -> dict:
+    """Returns the database connection details from the environment."""
+    return {
+        "host": ENV["DB_IP"],
+        "port": ENV["DB_PORT"],
+        "user": ENV["DB_USERNAME"],
+        "password": ENV["DB_PASSWORD"],
+        "database": ENV["DB_NAME"],
+    }
 
 
 def get_connection() -> DBConnection:
     """Creates a database session and returns a connection object."""
-    return connect(
-        host=ENV["DB_IP"],
-        port=ENV["DB_PORT"],
-        user=ENV["DB_USERNAME"],
-        password=ENV["DB_PASSWORD"],
-        database=ENV["DB_NAME"],
-    )
+    return connect(**get_connection_config())
+
+
+def get_connection_pool(size: int) -> ThreadedConnectionPool:
+    """Creates a pool of up to size database sessions that threads can share."""
+    return ThreadedConnectionPool(1, size, **get_connection_config())
+
+
+def get_load_mode() -> str:
+    '''Returns how batches are loaded, set with LOAD_MODE: "row" looks up and inserts
+    each row, "parallel" does the same for several stations at once, and "bulk" copies
+    the day into a staging table and merges it in SQL'''
+    return ENV.get("LOAD_MODE", LOAD_MODE)
+
+
+def get_load_workers() -> int:
+    '''Returns how many stations are loaded at once in parallel mode, set with LOAD_WORKERS'''
+    return max(1, int(ENV.get("LOAD_WORKERS", LOAD_WORKERS)))
+
+
+def get_commit_rows() -> int:
+    '''Returns how many waypoints are written between commits, set with LOAD_COMMIT_ROWS.
+    0, the default, commits once per station.'''
+    return max(0, int(ENV.get("LOAD_COMMIT_ROWS", LOAD_COMMIT_ROWS)))
+
+
+def commit_if_due(conn: DBConnection, rows: int, commit_rows: int) -> None:
+    '''Commits after every commit_rows waypoints, when a row limit is set'''
+    if commit_rows and rows % commit_rows == 0:
+        conn.commit()
+
+
+@contextmanager
+def row_savepoint(cur: DBCursor):
+    '''Runs a row's statements under a savepoint, so an error rolls back that row alone
+    and the rest of the transaction can still be committed'''
+    cur.execute(f"SAVEPOINT {ROW_SAVEPOINT}")
+    try:
+        yield
+    except Exception:
+        cur.execute(f"ROLLBACK TO SAVEPOINT {ROW_SAVEPOINT}")
+        raise
+    cur.execute(f"RELEASE SAVEPOINT {ROW_SAVEPOINT}")
+
+
+def log_load_rate(mode: str, rows: int, seconds: float) -> None:
+    '''Logs how many waypoints a load path handled and how fast'''
+    logging.info("Load: Loaded %s waypoints by %s in %.2fs (%.0f rows/s).",
+                 rows, mode, seconds, rows / seconds if seconds else 0)
 
 
 def get_cursor(conn: DBConnection) -> DBCursor:
@@ -50,93 +124,76 @@ def get_id_if_exists(cur: DBCursor, table_name: str, conditions: dict[any]) -> i
     return table_id[0] if table_id is not None else None
 
 
+def get_waypoint_time(run_date: datetime, time_str: str | None,
+                      next_day: bool | None) -> datetime | None:
+    '''Converts an HHMM time of a service into a timestamp on its run date,
+    moving it to the following day when the next day flag is set'''
+    if not time_str:
+        return None
+
+    day = run_date + timedelta(days=1) if next_day else run_date
+    return day.replace(hour=int(time_str[:2]), minute=int(time_str[2:]))
+
+
+def get_waypoint_times(service: ServiceRecord) -> dict:
+    '''Returns the run date and booked/actual timestamps of a service, using the times
+    resolved in transform when there are any'''
+    if service.times is not None:
+        return {field: getattr(service.times, field) for field in WAYPOINT_TIME_FIELDS}
+
+    run_date = datetime.strptime(service.run_date, "%Y-%m-%d")
+
+    return {
+        "run_date": run_date,
+        "booked_arrival": get_waypoint_time(run_date, service.booked_arrival,
+                                            service.booked_arrival_next_day),
+        "actual_arrival": get_waypoint_time(run_date, service.realtime_arrival,
+                                            service.realtime_arrival_next_day),
+        "booked_departure": get_waypoint_time(run_date, service.booked_departure,
+                                              service.booked_departure_next_day),
+        "actual_departure": get_waypoint_time(run_date, service.realtime_departure,
+                                              service.realtime_departure_next_day)
+    }
+
+
 def insert_or_get_waypoint(station_id: int,
                            service_id: int,
-                           service_dict: dict,
+                           service: ServiceRecord,
                            conn: DBConnection,
                            cur: DBCursor):
-    '''Inserts or gets a journey from the database'''
+    '''Inserts or gets a journey from the database, refreshing its times when the
+    service's waypoint at the station on its run date is already stored'''
+    return upsert_waypoint(station_id, service_id, service, conn, cur)
 
-    location_detail = service_dict["locationDetail"]
 
-    try:
-        run_date = datetime.strptime(service_dict["runDate"], "%Y-%m-%d")
-
-        booked_arrival_str = location_detail.get("gbttBookedArrival")
-        actual_arrival_str = location_detail.get("realtimeArrival")
-        booked_departure_str = location_detail.get("gbttBookedDeparture")
-        actual_departure_str = location_detail.get("realtimeDeparture")
-
-        booked_arrival = None
-        actual_arrival = None
-        booked_departure = None
-        actual_departure = None
-
-        if booked_arrival_str:
-            booked_arrival_day = run_date + \
-                timedelta(days=1) if location_detail.get(
-                    "gbttBookedArrivalNextDay", False) else run_date
-            booked_arrival = booked_arrival_day.replace(
-                hour=int(booked_arrival_str[:2]), minute=int(booked_arrival_str[2:]))
-
-        if actual_arrival_str:
-            actual_arrival_day = run_date + \
-                timedelta(days=1) if location_detail.get(
-                    "realtimeArrivalNextDay", False) else run_date
-            actual_arrival = actual_arrival_day.replace(
-                hour=int(actual_arrival_str[:2]), minute=int(actual_arrival_str[2:]))
-
-        if booked_departure_str:
-            booked_departure_day = run_date + \
-                timedelta(days=1) if location_detail.get(
-                    "gbttBookedDepartureNextDay", False) else run_date
-            booked_departure = booked_departure_day.replace(
-                hour=int(booked_departure_str[:2]), minute=int(booked_departure_str[2:]))
-
-        if actual_departure_str:
-            actual_departure_day = run_date + \
-                timedelta(days=1) if location_detail.get(
-                    "realtimeDepartureNextDay", False) else run_date
-            actual_departure = actual_departure_day.replace(
-                hour=int(actual_departure_str[:2]), minute=int(actual_departure_str[2:]))
-
-        conditions = {
-            "run_date": run_date,
-            "booked_arrival": booked_arrival,
-            "actual_arrival": actual_arrival,
-            "booked_departure": booked_departure,
-            "actual_departure": actual_departure,
-            "service_id": service_id,
-            "station_id": station_id
-        }
-        existing_id = get_id_if_exists(cur, "waypoint", conditions)
-        if existing_id:
-            return existing_id
-
-        query = '''
-        INSERT INTO waypoint (
-            run_date, booked_arrival, actual_arrival, booked_departure, actual_departure, service_id, station_id
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING waypoint_id
-        '''
+def upsert_waypoint(station_id: int,
+                    service_id: int,
+                    service: ServiceRecord,
+                    conn: DBConnection,  # pylint: disable=unused-argument
+                    cur: DBCursor) -> int | None:
+    '''Updates the times of a service's waypoint at a station on its run date,
+    inserting the waypoint if it does not exist yet, in a single statement
+    against the waypoint's natural key. The statement runs under a savepoint
+    and is committed by the caller.'''
 
-        cur.execute(query, (
-            run_date,
-            booked_arrival,
-            actual_arrival,
-            booked_departure,
-            actual_departure,
-            service_id,
-            station_id
-        ))
-        waypoint_id = cur.fetchone()[0]
-        conn.commit()
+    try:
+        times = get_waypoint_times(service)
+
+        with row_savepoint(cur):
+            cur.execute(f'''
+            INSERT INTO waypoint (
+                run_date, booked_arrival, actual_arrival, booked_departure, actual_departure,
+                service_id, station_id
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            {WAYPOINT_CONFLICT}
+            RETURNING waypoint_id
+            ''', (*(times[field] for field in WAYPOINT_TIME_FIELDS), service_id, station_id))
+            waypoint_id = cur.fetchone()[0]
         return waypoint_id
 
     except Exception as e:  # pylint: disable=broad-exception-caught
-        conn.rollback()
         logging.error(
-            "Load: Error occurred inserting Waypoint: %s", e)
+            "Load: Error occurred upserting Waypoint: %s", e)
         return None
 
 
@@ -158,68 +215,121 @@ def insert_or_get_cancellation(cancel_code_id: int,
                                cur)
 
 
-def insert_or_get_cancel_code(cancelled_service_loc: dict, conn: DBConnection, cur: DBCursor):
+def insert_or_get_cancel_code(cancelled_service: ServiceRecord,
+                              conn: DBConnection, cur: DBCursor):
     '''Inserts a cancel code into the database'''
+    return insert_or_get_cancel_code_by_code(cancelled_service.cancel_code,
+                                             cancelled_service.cancel_reason,
+                                             conn,
+                                             cur)
+
+
+def insert_or_get_cancel_code_by_code(cancel_code: str, cause: str | None,
+                                      conn: DBConnection, cur: DBCursor):
+    '''Inserts a cancel code and its cause into the database, looking it up in the
+    dimension cache first'''
+    cancel_code_id = get_cached_id('cancel_code', cancel_code)
+    if cancel_code_id is not None:
+        return cancel_code_id
+
     cancel_code_conditions = {
-        'cancel_code': cancelled_service_loc["cancelReasonCode"]
+        'cancel_code': cancel_code
     }
 
     insert_values = {
-        'cancel_code': cancelled_service_loc["cancelReasonCode"],
-        'cause':  cancelled_service_loc["cancelReasonLongText"]
+        'cancel_code': cancel_code,
+        'cause':  cause
     }
 
-    return insert_or_get_entry('cancel_code',
-                               insert_values,
-                               cancel_code_conditions,
-                               cancelled_service_loc["cancelReasonCode"],
-                               conn,
-                               cur)
+    cancel_code_id = insert_or_get_entry('cancel_code',
+                                         insert_values,
+                                         cancel_code_conditions,
+                                         cancel_code,
+                                         conn,
+                                         cur)
+    if cancel_code_id is not None:
+        cache_id('cancel_code', cancel_code, cancel_code_id)
+    return cancel_code_id
 
 
-def insert_or_get_service(service_dict: dict,
+def insert_or_get_service(service: ServiceRecord,
                           operator_id: int,
                           conn: DBConnection,
                           cur: DBCursor) -> int:
     '''Insert or get operator id from the database'''
+    return insert_or_get_service_by_uid(service.service_uid, operator_id, conn, cur)
+
+
+def insert_or_get_service_by_uid(service_uid: str,
+                                 operator_id: int,
+                                 conn: DBConnection,
+                                 cur: DBCursor) -> int:
+    '''Insert or get the id of the service with a UID, looking it up in the
+    dimension cache before the database'''
+    service_id = get_cached_id('service', service_uid)
+    if service_id is not None:
+        return service_id
+
     service_conditions = {
-        'service_uid': service_dict["serviceUid"]
+        'service_uid': service_uid
     }
 
     insert_values = {
         'operator_id': operator_id,
-        'service_uid': service_dict["serviceUid"]
+        'service_uid': service_uid
     }
 
-    return insert_or_get_entry('service',
-                               insert_values,
-                               service_conditions,
-                               service_dict["serviceUid"],
-                               conn,
-                               cur)
+    service_id = insert_or_get_entry('service',
+                                     insert_values,
+                                     service_conditions,
+                                     service_uid,
+                                     conn,
+                                     cur)
+    if service_id is not None:
+        cache_id('service', service_uid, service_id)
+    return service_id
 
 
-def insert_or_get_operator(service_dict: dict, conn: DBConnection, cur: DBCursor) -> int:
+def insert_or_get_operator(service: ServiceRecord, conn: DBConnection, cur: DBCursor) -> int:
     '''Insert or get operator id from the database'''
+    return insert_or_get_operator_by_code(service.atoc_code, service.atoc_name, conn, cur)
+
+
+def insert_or_get_operator_by_code(atoc_code: str | None, atoc_name: str | None,
+                                   conn: DBConnection, cur: DBCursor) -> int:
+    '''Insert or get the id of the operator with an ATOC code, looking it up in the
+    dimension cache before the database'''
+    operator_id = get_cached_id('operator', atoc_code)
+    if operator_id is not None:
+        return operator_id
+
     operator_conditions = {
-        'operator_code': service_dict["atocCode"]
+        'operator_code': atoc_code
     }
 
     insert_values = {
-        'operator_code': service_dict["atocCode"],
-        'operator_name': service_dict["atocName"]
+        'operator_code': atoc_code,
+        'operator_name': atoc_name
     }
 
-    return insert_or_get_entry('operator',
-                               insert_values,
-                               operator_conditions,
-                               service_dict["atocCode"],
-                               conn,
-                               cur)
+    operator_id = insert_or_get_entry('operator',
+                                      insert_values,
+                                      operator_conditions,
+                                      atoc_code,
+                                      conn,
+                                      cur)
+    if operator_id is not None:
+        cache_id('operator', atoc_code, operator_id)
+    return operator_id
 
 
 def insert_or_get_station(location_dict: dict, conn: DBConnection, cur: DBCursor) -> int:
-    '''Insert or get station id from the database'''
+    '''Insert or get station id, looking it up in the station registry before the database'''
+    refresh(conn)
+    station_id = get_station_id(location_dict["crs"])
+    if station_id is not None:
+        return station_id
+
     station_conditions = {
         'station_crs': location_dict["crs"]
     }
@@ -229,41 +339,54 @@ def insert_or_get_station(location_dict: dict, conn: DBConnection, cur: DBCursor
         'station_name': location_dict["name"]
     }
 
-    return insert_or_get_entry('station',
-                               insert_values,
-                               station_conditions,
-                               location_dict["crs"],
-                               conn,
-                               cur)
+    station_id = insert_or_get_entry('station',
+                                     insert_values,
+                                     station_conditions,
+                                     location_dict["crs"],
+                                     conn,
+                                     cur)
+    if station_id is not None:
+        add_station(station_id, location_dict["crs"], location_dict["name"])
+    return station_id
 
 
 def insert_or_get_entry(table_name: str,
                         insert_values: dict,
                         unique_data_conditions: dict,
                         entry_name: str,
-                        conn: DBConnection,
+                        conn: DBConnection,  # pylint: disable=unused-argument
                         cur: DBCursor) -> int:
-    '''Insert or get an entry's id from the database'''
+    '''Insert or get an entry's id from the database. The insert runs under a savepoint
+    and is committed by the caller. When another loader inserts an entry with the same
+    unique data conditions first, the insert does nothing and the entry is looked up
+    again. A conflict on any other unique column is raised and logged.'''
 
     table_id = get_id_if_exists(cur, table_name, unique_data_conditions)
-    columns = ', '.join(insert_values.keys())
 
     if table_id is None:
         columns = ', '.join(insert_values.keys())
         num_of_values = ', '.join(['%s'] * len(insert_values))
+        conflict_columns = ', '.join(unique_data_conditions.keys())
         query = f'''
         INSERT INTO {table_name} ({columns})
         VALUES
         ({num_of_values})
+        ON CONFLICT ({conflict_columns}) DO NOTHING
         RETURNING {table_name}_id
         '''
 
         try:
-            cur.execute(query, tuple(insert_values.values()))
-            table_id = cur.fetchone()[0]
-            conn.commit()
+            with row_savepoint(cur):
+                cur.execute(query, tuple(insert_values.values()))
+                row = cur.fetchone()
+            if row is not None:
+                table_id = row[0]
+            else:
+                table_id = get_id_if_exists(cur, table_name, unique_data_conditions)
+                if table_id is None:
+                    logging.error("Load: %s %s conflicted but was not found",
+                                  table_name.capitalize(), entry_name)
         except Exception as e:  # pylint: disable=broad-exception-caught
-            conn.rollback()
             logging.error("Load: Error occurred inserting %s %s: %s",
                           table_name.capitalize(), entry_name, e)
             table_id = None
@@ -271,29 +394,266 @@ def insert_or_get_entry(table_name: str,
     return table_id
 
 
-def import_to_database(stations: list[dict]) -> None:
-    '''Import data retrieved to the database'''
+def log_failures(crs: str, failures: int, rows: int) -> None:
+    '''Logs how many of a station's waypoints failed to load, if any'''
+    if failures:
+        logging.warning("Load: %s of %s waypoints at station %s failed to load.",
+                        failures, rows, crs)
+
+
+def import_station(station: dict, conn: DBConnection,
+                   cur: DBCursor) -> tuple[Counter, int]:
+    '''Import a single transformed station and its valid services to the database in one
+    transaction, or one per LOAD_COMMIT_ROWS waypoints. Invalid services are quarantined
+    and anomalies recorded. Returns the counts of their reasons and how many waypoints
+    or cancellations failed to load.'''
+    logging.info("Processing station %s...", station["location"]["crs"])
+    station, quarantined = validate_station(station)
+    quarantine_services(conn, quarantined)
+    station, anomalies = detect_station_anomalies(station)
+    record_anomalies(conn, anomalies)
+    preload_dimensions(conn, [service.service_uid for service in station["services"]])
+    station_id = insert_or_get_station(station["location"], conn, cur)
+    commit_rows = get_commit_rows()
+    failures = 0
+    for rows, service in enumerate(station["services"], 1):
+        operator_id = insert_or_get_operator(service, conn, cur)
+        service_id = insert_or_get_service(service, operator_id, conn, cur)
+        waypoint_id = insert_or_get_waypoint(
+            station_id, service_id, service, conn, cur)
+
+        if waypoint_id is None:
+            failures += 1
+        elif service.is_cancelled():
+            cancel_code_id = insert_or_get_cancel_code(service, conn, cur)
+            if insert_or_get_cancellation(cancel_code_id, waypoint_id, conn, cur) is None:
+                failures += 1
+        commit_if_due(conn, rows, commit_rows)
+    conn.commit()
+    logging.info("Station %s processed with %s waypoints.",
+                 station["location"]["crs"], len(station["services"]))
+    log_failures(station["location"]["crs"], failures, len(station["services"]))
+    return get_reason_counts(quarantined + anomalies), failures
+
+
+def resolve_dimensions(batch: NormalisedBatch, conn: DBConnection,
+                       cur: DBCursor) -> dict[str, dict]:
+    '''Looks up or inserts each distinct station, operator, service and cancel code
+    of a batch once, returning their ids keyed as in the batch'''
+    operator_ids = {code: insert_or_get_operator_by_code(code, name, conn, cur)
+                    for code, name in batch.operators.items()}
+    return {
+        "stations": {crs: insert_or_get_station(location, conn, cur)
+                     for crs, location in batch.stations.items()},
+        "services": {uid: insert_or_get_service_by_uid(uid, operator_ids[code], conn, cur)
+                     for uid, code in batch.services.items()},
+        "cancel_codes": {code: insert_or_get_cancel_code_by_code(code, cause, conn, cur)
+                         for code, cause in batch.cancel_codes.items()}
+    }
+
+
+def prepare_batch(batch: NormalisedBatch,
+                  conn: DBConnection) -> tuple[NormalisedBatch, Counter]:
+    '''Quarantines the invalid services of a batch and records its anomalies. Returns the
+    batch left to load and the counts of the reasons services were set aside.'''
+    batch, quarantined = validate_batch(batch)
+    quarantine_services(conn, quarantined)
+    batch, anomalies = detect_batch_anomalies(batch)
+    record_anomalies(conn, anomalies)
+    return batch, get_reason_counts(quarantined + anomalies)
+
+
+def resolve_batch(batch: NormalisedBatch, conn: DBConnection, cur: DBCursor) -> dict[str, dict]:
+    '''Resolves and commits the dimensions of a batch, returning their ids'''
+    preload_dimensions(conn, list(batch.services))
+    ids = resolve_dimensions(batch, conn, cur)
+    logging.info("Load: Resolved %s stations, %s operators, %s services and %s cancel codes.",
+                 len(batch.stations), len(batch.operators), len(batch.services),
+                 len(batch.cancel_codes))
+    conn.commit()
+    return ids
+
+
+def group_station_facts(facts: list[WaypointFact]) -> list[list[WaypointFact]]:
+    '''Groups the facts of a batch into a list for each station'''
+    return [list(station_facts)
+            for _, station_facts in groupby(facts, key=attrgetter("station_crs"))]
+
+
+def load_station_facts(facts: list[WaypointFact], ids: dict[str, dict],
+                       conn: DBConnection, cur: DBCursor) -> int:
+    '''Loads the waypoints and cancellations of a station's facts and commits them,
+    returning how many failed to load'''
+    commit_rows = get_commit_rows()
+    failures = 0
+    for rows, fact in enumerate(facts, 1):
+        waypoint_id = insert_or_get_waypoint(ids["stations"][fact.station_crs],
+                                             ids["services"][fact.service_uid],
+                                             fact.service, conn, cur)
+        if waypoint_id is None:
+            failures += 1
+        elif fact.cancel_code is not None and insert_or_get_cancellation(
+                ids["cancel_codes"][fact.cancel_code], waypoint_id, conn, cur) is None:
+            failures += 1
+        commit_if_due(conn, rows, commit_rows)
+    conn.commit()
+    log_failures(facts[0].station_crs, failures, len(facts))
+    return failures
+
+
+def import_batch(batch: NormalisedBatch, conn: DBConnection,
+                 cur: DBCursor) -> tuple[Counter, set[str]]:
+    '''Imports a normalised batch, resolving its dimensions before loading the waypoints
+    and cancellations that refer to them, committing once per station. Invalid services
+    are quarantined and anomalies recorded first. Returns the counts of their reasons and
+    the stations with rows that failed to load.'''
+    batch, counts = prepare_batch(batch, conn)
+    start = perf_counter()
+    ids = resolve_batch(batch, conn, cur)
+    failed = {facts[0].station_crs for facts in group_station_facts(batch.facts)
+              if load_station_facts(facts, ids, conn, cur)}
+    log_load_rate("row", len(batch.facts), perf_counter() - start)
+    return counts, failed
+
+
+def partition_stations(stations: list[list[WaypointFact]],
+                       workers: int) -> list[list[list[WaypointFact]]]:
+    '''Splits the stations between workers, giving the largest remaining station to the
+    worker with the fewest waypoints so far. Workers left without stations are dropped.'''
+    partitions = [[] for _ in range(workers)]
+    sizes = [0] * workers
+    for facts in sorted(stations, key=len, reverse=True):
+        worker = sizes.index(min(sizes))
+        partitions[worker].append(facts)
+        sizes[worker] += len(facts)
+    return [partition for partition in partitions if partition]
+
+
+def load_partition(pool: ThreadedConnectionPool, stations: list[list[WaypointFact]],
+                   ids: dict[str, dict]) -> dict:
+    '''Loads a worker's stations over a connection from the pool, returning how many
+    stations and waypoints it loaded, the stations with rows that failed to load and
+    how long it took'''
+    start = perf_counter()
+    conn = pool.getconn()
+    try:
+        cur = get_cursor(conn)
+        failed = {facts[0].station_crs for facts in stations
+                  if load_station_facts(facts, ids, conn, cur)}
+        cur.close()
+    finally:
+        pool.putconn(conn)
+    return {"stations": len(stations), "rows": sum(map(len, stations)),
+            "failed": failed, "seconds": perf_counter() - start}
+
+
+def parallel_import_batch(batch: NormalisedBatch, conn: DBConnection, cur: DBCursor,
+                          workers: int | None = None) -> tuple[Counter, set[str]]:
+    '''Imports a normalised batch with its stations split across a pool of threads, each
+    loading over its own pooled connection. The dimensions are resolved and committed
+    first, so workers only write the waypoints and cancellations of their own stations.
+    Invalid services are quarantined and anomalies recorded first. Returns the counts of
+    their reasons and the stations with rows that failed to load.'''
+    workers = workers or get_load_workers()
+    batch, counts = prepare_batch(batch, conn)
+    start = perf_counter()
+    ids = resolve_batch(batch, conn, cur)
+    partitions = partition_stations(group_station_facts(batch.facts), workers)
+    if not partitions:
+        return counts, set()
+
+    pool = get_connection_pool(len(partitions))
+    try:
+        with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+            results = list(executor.map(load_partition, [pool] * len(partitions),
+                                        partitions, [ids] * len(partitions)))
+    finally:
+        pool.closeall()
+
+    for worker, result in enumerate(results):
+        logging.info("Load: Worker %s loaded %s waypoints from %s stations in %.2fs "
+                     "(%.0f rows/s).", worker, result["rows"], result["stations"],
+                     result["seconds"],
+                     result["rows"] / result["seconds"] if result["seconds"] else 0)
+    log_load_rate(f"{len(partitions)} workers", len(batch.facts), perf_counter() - start)
+    return counts, set().union(*(result["failed"] for result in results))
+
+
+def bulk_import_batch(batch: NormalisedBatch,
+                      conn: DBConnection) -> tuple[Counter, set[str]]:
+    '''Imports a normalised batch by copying it into a staging table and merging it in
+    a single transaction. Invalid services are quarantined and anomalies recorded first.
+    Returns the counts of their reasons and, as the merge raises rather than loading
+    part of the batch, no failed stations.'''
+    batch, counts = prepare_batch(batch, conn)
+    stats = bulk_load(facts_to_batch(batch), conn)
+    log_load_rate("bulk", stats["rows"], stats["seconds"])
+    return counts, set()
+
+
+def skip_loaded_payloads(batch: NormalisedBatch,
+                         loaded: set[tuple[str, str]]) -> NormalisedBatch:
+    '''Returns the batch without the stations whose payload was already loaded'''
+    unchanged = {crs for crs, payload_hash in batch.payloads.items()
+                 if (crs, payload_hash) in loaded}
+    if not unchanged:
+        return batch
+
+    logging.info("Load: Skipped %s stations whose payload was already loaded.", len(unchanged))
+    return normalise_facts(
+        {crs: location for crs, location in batch.stations.items() if crs not in unchanged},
+        [fact for fact in batch.facts if fact.station_crs not in unchanged],
+        {crs: payload_hash for crs, payload_hash in batch.payloads.items()
+         if crs not in unchanged})
+
+
+def import_payload(station_data: dict, conn: DBConnection, cur: DBCursor) -> str:
+    '''Transforms and imports a raw station payload, unless the same payload was loaded
+    before. The payload is recorded only when every row loaded. Returns "skipped" for a
+    payload already loaded, "loaded" when every row loaded and "failed" when any did not.'''
+    key = get_payload_key(station_data)
+    if is_payload_loaded(conn, key):
+        logging.info("Load: Skipped station %s, its payload was already loaded.", key[0])
+        return "skipped"
+
+    _, failures = import_station(process_station(station_data), conn, cur)
+    if failures:
+        return "failed"
+    record_payloads(conn, [key])
+    return "loaded"
+
+
+def import_normalised_batch(batch: NormalisedBatch, conn: DBConnection,
+                            cur: DBCursor) -> tuple[Counter, set[str]]:
+    '''Imports a normalised batch the way LOAD_MODE chooses, row by row, row by row in
+    parallel or in bulk, and records the payloads of the stations that loaded without
+    errors. Returns the counts of quarantine reasons and the stations with rows that
+    failed to load.'''
+    mode = get_load_mode()
+    if mode == "bulk":
+        counts, failed = bulk_import_batch(batch, conn)
+    elif mode == "parallel":
+        counts, failed = parallel_import_batch(batch, conn, cur)
+        log_cache_stats()
+    else:
+        counts, failed = import_batch(batch, conn, cur)
+        log_cache_stats()
+    record_payloads(conn, [(crs, payload_hash) for crs, payload_hash
+                           in batch.payloads.items() if crs not in failed])
+    return counts, failed
+
+
+def import_to_database(batch: NormalisedBatch) -> None:
+    '''Import a normalised batch of data retrieved to the database, skipping the stations
+    whose payload was already loaded. LOAD_MODE chooses between loading row by row, row
+    by row in parallel and in bulk.'''
     conn = get_connection()
     cur = get_cursor(conn)
+    clear_cache()
 
-    for station in stations:
-        logging.info("Processing station %s...", station["location"]["crs"])
-        station_id = insert_or_get_station(station["location"], conn, cur)
-        for service in station["services"]:
-            operator_id = insert_or_get_operator(service, conn, cur)
-            service_id = insert_or_get_service(service, operator_id, conn, cur)
-            waypoint_id = insert_or_get_waypoint(
-                station_id, service_id, service, conn, cur)
-
-            for key in service["locationDetail"]:
-                if key in CANCELLATION_FIELDS:
-                    cancel_code_id = insert_or_get_cancel_code(
-                        service["locationDetail"], conn, cur)
-                    insert_or_get_cancellation(
-                        cancel_code_id, waypoint_id, conn, cur)
-                    break
-        logging.info("Station %s processed with %s waypoints.",
-                     station["location"]["crs"], len(station["services"]))
+    if batch.payloads:
+        batch = skip_loaded_payloads(batch, read_ledger(conn))
+    import_normalised_batch(batch, conn, cur)
 
     cur.close()
     conn.close()
@@ -303,7 +663,10 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s - %(levelname)s - %(message)s")
     load_dotenv()
-    data = get_api_data_of_all_stations()
-    modified_data = process_all_stations(data)
+    data = get_cached_or_api_data()
+    ledger_conn = get_connection()
+    modified_data = process_all_stations(data, normalise=True,
+                                         loaded=read_ledger(ledger_conn))
+    ledger_conn.close()
     print("\n-------------------------")
     import_to_database(modified_data)
@@ -0,0 +1,84 @@
+'''Ledger of the raw station payloads already loaded, keyed by a hash of their content,
+so reruns skip the stations whose data has not changed'''
+
+from os import environ as ENV
+from hashlib import blake2b
+import json
+import logging
+
+from psycopg2.extensions import connection as DBConnection
+
+LEDGER_DAYS = 7
+HASH_BYTES = 16
+
+
+def get_payload_hash(station_data: dict) -> str:
+    '''Returns a hash of a station payload's content, independent of its key order'''
+    content = json.dumps(station_data, sort_keys=True, separators=(",", ":"))
+    return blake2b(content.encode("utf-8"), digest_size=HASH_BYTES).hexdigest()
+
+
+def get_payload_key(station_data: dict) -> tuple[str, str]:
+    '''Returns the (CRS, hash) key of a station payload in the ledger'''
+    return (station_data["location"] or {}).get("crs"), get_payload_hash(station_data)
+
+
+def get_ledger_days() -> int:
+    '''Returns how many days of loaded payloads are checked, set with PAYLOAD_LEDGER_DAYS'''
+    return int(ENV.get("PAYLOAD_LEDGER_DAYS", LEDGER_DAYS))
+
+
+def get_loaded_payloads(conn: DBConnection, days: int | None = None) -> set[tuple[str, str]]:
+    '''Returns the (CRS, hash) keys of the payloads loaded in the last few days'''
+    days = get_ledger_days() if days is None else days
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT station_crs, payload_hash FROM loaded_payload
+            WHERE loaded_at >= NOW() - make_interval(days => %s)
+        ''', (days,))
+        return {(crs.strip(), payload_hash) for crs, payload_hash in cur.fetchall()}
+
+
+def is_payload_loaded(conn: DBConnection, key: tuple[str, str]) -> bool:
+    '''Returns whether a payload was loaded in the last few days'''
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT 1 FROM loaded_payload
+            WHERE station_crs = %s AND payload_hash = %s
+            AND loaded_at >= NOW() - make_interval(days => %s)
+        ''', (*key, get_ledger_days()))
+        return cur.fetchone() is not None
+
+
+def record_payloads(conn: DBConnection, keys: list[tuple[str, str]]) -> None:
+    '''Marks payloads as loaded, refreshing the time of any loaded before'''
+    if not keys:
+        return
+
+    query = '''
+        INSERT INTO loaded_payload (station_crs, payload_hash) VALUES (%s, %s)
+        ON CONFLICT (station_crs, payload_hash) DO UPDATE SET loaded_at = CURRENT_TIMESTAMP
+    '''
+    try:
+        with conn.cursor() as cur:
+            for key in keys:
+                cur.execute(query, key)
+        conn.commit()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        conn.rollback()
+        logging.error("Ledger: Error occurred recording %s payloads: %s", len(keys), e)
+
+
+def read_ledger(conn: DBConnection) -> set[tuple[str, str]]:
+    '''Returns the loaded payloads, or an empty set so every station is loaded
+    when the ledger cannot be read'''
+    try:
+        loaded = get_loaded_payloads(conn)
+        conn.commit()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        conn.rollback()
+        logging.error("Ledger: Error occurred reading loaded payloads: %s", e)
+        return set()
+    logging.info("Ledger: %s payloads loaded in the last %s days.",
+                 len(loaded), get_ledger_days())
+    return loaded
@@ -0,0 +1,251 @@
+'''Runs extract, transform and load as concurrent stages joined by bounded queues'''
+
+from os import environ as ENV
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Callable
+import logging
+
+from psycopg2.extensions import connection as DBConnection, cursor as DBCursor
+
+from extract_real import (get_all_stations_crs, get_extract_workers,
+                          get_session, fetch_station)
+from rate_limiter import get_limiter, log_limiter_report
+from api_quota import plan_api_stations, record_limiter_calls
+from transform_real import normalise_stations, process_station
+from payload_ledger import get_payload_key, read_ledger, record_payloads
+from load_real import (get_connection, get_cursor, get_load_mode, import_normalised_batch,
+                       import_station)
+from dimension_cache import clear_cache, log_cache_stats
+
+QUEUE_DEPTH = 4
+END_OF_STAGE = None
+
+
+def get_queue_depth() -> int:
+    '''Returns the size of the queues between stages, configurable with PIPELINE_QUEUE_DEPTH'''
+    return max(1, int(ENV.get("PIPELINE_QUEUE_DEPTH", QUEUE_DEPTH)))
+
+
+def drain(in_queue: Queue) -> None:
+    '''Discards payloads until the upstream stage finishes, so it never blocks on a full queue'''
+    while in_queue.get() is not END_OF_STAGE:
+        pass
+
+
+def extract_stage(list_of_crs: list[str],  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                  fetch: Callable[[str], dict | None],
+                  out_queue: Queue,
+                  stop: Event,
+                  workers: int,
+                  stats: dict) -> None:
+    '''Fetches stations over a thread pool and passes each payload to the transform stage.
+    Workers block on the full queue, so at most one payload is held per worker.
+    An unexpected error stops the other stages and is kept in stats for run_pipeline.'''
+    stats_lock = Lock()
+
+    def fetch_into_queue(crs: str) -> None:
+        if stop.is_set():
+            return
+        station_data = fetch(crs)
+        with stats_lock:
+            stats["extracted" if station_data else "failed"] += 1
+            if not station_data:
+                stats["failed_crs"].append(crs)
+        if station_data:
+            out_queue.put(station_data)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch_into_queue, list_of_crs))
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        stop.set()
+        stats["error"] = e
+    finally:
+        out_queue.put(END_OF_STAGE)
+
+
+def transform_stage(in_queue: Queue, out_queue: Queue,  # pylint: disable=too-many-arguments
+                    stop: Event, stats: dict,
+                    loaded: set[tuple[str, str]] = frozenset()) -> None:
+    '''Transforms each station as it arrives and passes it to the load stage.
+    Stations whose payload was already loaded are skipped before being transformed.
+    Stations that cannot be transformed are logged and skipped. An unexpected error stops
+    the other stages and is kept in stats for run_pipeline.'''
+    try:
+        while (station := in_queue.get()) is not END_OF_STAGE:
+            try:
+                key = get_payload_key(station)
+                if key in loaded:
+                    stats["unchanged"] += 1
+                    continue
+                transformed = process_station(station)
+                transformed["payload_hash"] = key[1]
+                out_queue.put(transformed)
+                stats["transformed"] += 1
+            except (KeyError, TypeError) as e:
+                stats["rejected"] += 1
+                logging.error(
+                    "Pipeline: Error occurred transforming station: %s", e)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        stop.set()
+        stats["error"] = e
+        drain(in_queue)
+    finally:
+        out_queue.put(END_OF_STAGE)
+
+
+def load_stations(in_queue: Queue, conn: DBConnection, cur: DBCursor, stats: dict) -> None:
+    '''Loads each station as it arrives, recording its payload when every row loaded
+    and otherwise adding it to the failed stations to be retried'''
+    while (station := in_queue.get()) is not END_OF_STAGE:
+        counts, failures = import_station(station, conn, cur)
+        stats["quarantined"].update(counts)
+        if failures:
+            stats["load_failed"] += 1
+            stats["failed_crs"].append(station["location"]["crs"])
+        else:
+            record_payloads(conn, [(station["location"]["crs"], station["payload_hash"])])
+        stats["loaded"] += 1
+    log_cache_stats()
+
+
+def load_normalised(in_queue: Queue, conn: DBConnection, cur: DBCursor,
+                    stats: dict) -> None:
+    '''Collects every transformed station into a normalised batch and loads it the way
+    LOAD_MODE chooses once the transform stage finishes, adding the stations with rows
+    that failed to load to the failed stations to be retried'''
+    stations = []
+    while (station := in_queue.get()) is not END_OF_STAGE:
+        stations.append(station)
+    if not stations:
+        return
+
+    counts, failed = import_normalised_batch(normalise_stations(stations), conn, cur)
+    stats["quarantined"].update(counts)
+    stats["load_failed"] += len(failed)
+    stats["failed_crs"].extend(sorted(failed))
+    stats["loaded"] += len(stations)
+
+
+def load_stage(in_queue: Queue, stop: Event, stats: dict) -> None:
+    '''Loads the transformed stations into the database. With LOAD_MODE=row, each station
+    is loaded as it arrives, otherwise the stations are loaded as one normalised batch.
+    If the database fails, upstream stages are stopped and the queue is drained.'''
+    conn = None
+    try:
+        conn = get_connection()
+        cur = get_cursor(conn)
+        clear_cache()
+        if get_load_mode() == "row":
+            load_stations(in_queue, conn, cur, stats)
+        else:
+            load_normalised(in_queue, conn, cur, stats)
+        cur.close()
+    except Exception:
+        stop.set()
+        drain(in_queue)
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def get_api_fetch(workers: int,
+                  max_requests: int | None = None) -> tuple[Callable[[str], dict | None],
+                                                            Callable[[], None]]:
+    '''Returns a fetch function sharing one session and rate limiter, and a function
+    that closes the session, logs the limiter report and records the calls made'''
+    limiter = get_limiter(workers, max_requests)
+    session = get_session(ENV.get("REALTIME_USERNAME"),
+                          ENV.get("REALTIME_PASSWORD"),
+                          pool_size=workers)
+
+    def fetch(crs: str) -> dict | None:
+        return fetch_station(crs, session, limiter)["data"]
+
+    def close() -> None:
+        session.close()
+        log_limiter_report(limiter)
+        record_limiter_calls(limiter)
+
+    return fetch, close
+
+
+def get_loaded_payloads() -> set[tuple[str, str]]:
+    '''Reads the ledger of payloads loaded by earlier runs over its own connection'''
+    conn = get_connection()
+    try:
+        return read_ledger(conn)
+    finally:
+        conn.close()
+
+
+def run_pipeline(list_of_crs: list[str] | None = None,
+                 fetch: Callable[[str], dict | None] | None = None,
+                 queue_depth: int | None = None,
+                 workers: int | None = None) -> dict:
+    '''Runs the ETL pipeline with each stage in its own thread.
+    Payloads in flight are bounded by the workers and queue depth, not the station count.
+    Fetches yesterday's data from the API unless another fetch function is given. When
+    fetching from the API, stations beyond today's remaining API quota are skipped,
+    lowest priority first.
+    Stations whose payload matches one loaded by an earlier run are not transformed again.
+    An unexpected error in any stage is raised once every stage has stopped.'''
+    if list_of_crs is None:
+        list_of_crs = get_all_stations_crs()
+    skipped, remaining = [], None
+    if fetch is None:
+        list_of_crs, skipped, remaining = plan_api_stations(list_of_crs)
+    queue_depth = queue_depth or get_queue_depth()
+    workers = max(1, min(workers or get_extract_workers(),
+                         len(list_of_crs) or 1))
+    loaded = get_loaded_payloads()
+
+    close = None
+    if fetch is None:
+        fetch, close = get_api_fetch(workers, remaining)
+
+    stats = {"extracted": 0, "transformed": 0, "unchanged": 0, "loaded": 0,
+             "failed": 0, "rejected": 0, "load_failed": 0, "failed_crs": [],
+             "skipped_crs": skipped,
+             "quarantined": Counter()}
+    transform_queue = Queue(maxsize=queue_depth)
+    load_queue = Queue(maxsize=queue_depth)
+    stop = Event()
+
+    start = perf_counter()
+    stages = [
+        Thread(target=extract_stage,
+               args=(list_of_crs, fetch, transform_queue, stop, workers, stats)),
+        Thread(target=transform_stage,
+               args=(transform_queue, load_queue, stop, stats, loaded))
+    ]
+    for stage in stages:
+        stage.start()
+
+    try:
+        load_stage(load_queue, stop, stats)
+    finally:
+        for stage in stages:
+            stage.join()
+        if close is not None:
+            close()
+    if "error" in stats:
+        raise stats.pop("error")
+
+    stats["elapsed"] = perf_counter() - start
+    logging.info("Pipeline: %s extracted, %s transformed, %s unchanged, %s loaded, "
+                 "%s failed to extract, %s failed to transform, %s with rows that failed "
+                 "to load, %s skipped for quota in %.2fs.",
+                 stats["extracted"], stats["transformed"], stats["unchanged"], stats["loaded"],
+                 stats["failed"], stats["rejected"], stats["load_failed"],
+                 len(stats["skipped_crs"]),
+                 stats["elapsed"])
+    if stats["quarantined"]:
+        logging.warning("Pipeline: Quarantined services by reason: %s",
+                        dict(stats["quarantined"]))
+    return stats
@@ -0,0 +1,257 @@
+'''Adaptive rate limiting, concurrency control and retries for RealTime Trains API calls'''
+
+from os import environ as ENV
+from threading import Condition, Lock
+from time import monotonic, sleep
+from typing import Callable
+import logging
+import random
+
+from requests import Response
+from requests.exceptions import RequestException
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+REQUESTS_PER_SECOND = 5.0
+MAX_REQUESTS_PER_SECOND = 20.0
+MIN_REQUESTS_PER_SECOND = 0.5
+LATENCY_TARGET = 2.0
+MAX_RETRIES = 3
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+TIME_BUDGET = 600.0
+BACKOFF_WINDOW = 1.0
+
+
+class RetryBudgetExceeded(RequestException):
+    '''Raised when the run's time budget or call quota is spent before a request could be made'''
+
+
+class TokenBucket:
+    '''Thread-safe token bucket refilled continuously at a configurable rate'''
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def set_rate(self, rate: float) -> None:
+        '''Changes the refill rate, keeping the tokens already accrued'''
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline: float | None = None) -> bool:
+        '''Blocks until a token is available. Returns False if the deadline passes first.'''
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and monotonic() + wait > deadline:
+                return False
+            sleep(wait)
+
+
+class AdaptiveLimiter:  # pylint: disable=too-many-instance-attributes
+    '''Limits the request rate and number of in-flight requests. The rate never grows
+    past max_rate, and retries stop once time_budget seconds have passed, unless it is None.
+    Both grow on fast successes and are halved on 429s or 5xx responses. Slow responses
+    only take one request off the concurrency. Either backs off at most once a window.'''
+
+    def __init__(self,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                 rate: float = REQUESTS_PER_SECOND,
+                 max_concurrency: int = 8,
+                 time_budget: float | None = TIME_BUDGET,
+                 latency_target: float = LATENCY_TARGET,
+                 max_retries: int = MAX_RETRIES,
+                 base_backoff: float = BASE_BACKOFF,
+                 max_requests: int | None = None,
+                 max_rate: float | None = None):
+        self.bucket = TokenBucket(rate)
+        self.max_rate = max(rate, MAX_REQUESTS_PER_SECOND) if max_rate is None else max_rate
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        self.latency_target = latency_target
+        self.avg_latency = None
+        self.successes = 0
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_requests = max_requests
+        self.started = monotonic()
+        self.deadline = None if time_budget is None else self.started + time_budget
+        self.backed_off = None
+        self.stats = {"requests": 0, "retries": 0,
+                      "throttle_events": 0, "slow_events": 0, "failures": 0}
+        self.condition = Condition()
+
+    def _acquire_slot(self) -> None:
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def _release_slot(self) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _on_success(self, latency: float) -> None:
+        with self.condition:
+            self.avg_latency = latency if self.avg_latency is None \
+                else 0.8 * self.avg_latency + 0.2 * latency
+            if self.avg_latency > self.latency_target:
+                self._slow_down()
+                return
+            self.successes += 1
+            if self.successes >= self.concurrency:
+                self.successes = 0
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1)
+                self.bucket.set_rate(
+                    min(self.max_rate, self.bucket.rate * 1.1))
+
+    def _on_throttle(self) -> None:
+        with self.condition:
+            self._back_off()
+
+    def _in_backoff_window(self) -> bool:
+        '''Returns whether the limiter already backed off within the window, so a burst
+        of responses to requests made at the old rate is only acted on once'''
+        now = monotonic()
+        if self.backed_off is not None and now - self.backed_off < BACKOFF_WINDOW:
+            return True
+        self.backed_off = now
+        return False
+
+    def _slow_down(self) -> None:
+        self.successes = 0
+        if self._in_backoff_window():
+            return
+        self.stats["slow_events"] += 1
+        self.concurrency = max(1, self.concurrency - 1)
+
+    def _back_off(self) -> None:
+        self.successes = 0
+        if self._in_backoff_window():
+            return
+        self.stats["throttle_events"] += 1
+        self.concurrency = max(1, self.concurrency // 2)
+        self.bucket.set_rate(
+            max(MIN_REQUESTS_PER_SECOND, self.bucket.rate / 2))
+        self.condition.notify_all()
+
+    def _reserve_request(self) -> bool:
+        '''Counts a request before it is sent, so concurrent callers cannot all pass
+        the quota check at once. Returns False when max_requests have been made.'''
+        with self.condition:
+            if self.max_requests is not None and self.stats["requests"] >= self.max_requests:
+                return False
+            self.stats["requests"] += 1
+            return True
+
+    def quota_spent(self) -> bool:
+        '''Returns whether max_requests have been made, so no further request will be sent'''
+        with self.condition:
+            return self.max_requests is not None and self.stats["requests"] >= self.max_requests
+
+    def _backoff_delay(self, attempt: int, response: Response | None) -> float:
+        retry_after = response.headers.get(
+            "Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(MAX_BACKOFF, float(retry_after))
+        return random.uniform(0, min(MAX_BACKOFF, self.base_backoff * 2 ** attempt))
+
+    def call(self, request: Callable[[], Response]) -> Response:
+        '''Makes a request, retrying 429/5xx responses and connection errors with jittered
+        exponential backoff while the time budget lasts. The budget only limits retries,
+        so a first attempt is always made. Returns the last response, or raises the last
+        error if no response was received.'''
+        last_error = RetryBudgetExceeded("Extract time budget exceeded")
+        response = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.condition:
+                    self.stats["retries"] += 1
+            if not self.bucket.acquire(self.deadline if attempt else None):
+                break
+            if not self._reserve_request():
+                last_error = RetryBudgetExceeded("API call quota exhausted")
+                break
+
+            response = None
+            self._acquire_slot()
+            start = monotonic()
+            try:
+                response = request()
+            except RequestException as e:
+                last_error = e
+            finally:
+                self._release_slot()
+            latency = monotonic() - start
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                self._on_success(latency)
+                return response
+
+            self._on_throttle()
+            delay = self._backoff_delay(attempt, response)
+            if attempt == self.max_retries or (
+                    self.deadline is not None and monotonic() + delay > self.deadline):
+                break
+            sleep(delay)
+
+        with self.condition:
+            self.stats["failures"] += 1
+        if response is not None:
+            return response
+        raise last_error
+
+    def report(self) -> dict:
+        '''Returns the run's retry counts, throttle and slow response events and
+        effective request rate'''
+        with self.condition:
+            elapsed = max(monotonic() - self.started, 1e-9)
+            return {
+                **self.stats,
+                "elapsed": elapsed,
+                "effective_rate": self.stats["requests"] / elapsed,
+                "final_rate": self.bucket.rate,
+                "final_concurrency": self.concurrency
+            }
+
+
+def get_limiter(max_concurrency: int, max_requests: int | None = None) -> AdaptiveLimiter:
+    '''Creates a limiter configured from RTT_REQUESTS_PER_SECOND and EXTRACT_TIME_BUDGET,
+    which stops making requests once max_requests have been made'''
+    return AdaptiveLimiter(
+        rate=float(ENV.get("RTT_REQUESTS_PER_SECOND", REQUESTS_PER_SECOND)),
+        max_concurrency=max_concurrency,
+        time_budget=float(ENV.get("EXTRACT_TIME_BUDGET", TIME_BUDGET)),
+        max_requests=max_requests
+    )
+
+
+def log_limiter_report(limiter: AdaptiveLimiter) -> None:
+    '''Logs the limiter's statistics for the run'''
+    report = limiter.report()
+    logging.info(
+        "Extract: %s requests, %s retries, %s throttle events, %s slow response events, "
+        "%s failures in %.2fs (%.2f requests/s, final rate %.2f/s, final concurrency %s).",
+        report["requests"], report["retries"], report["throttle_events"],
+        report["slow_events"], report["failures"], report["elapsed"], report["effective_rate"],
+        report["final_rate"], report["final_concurrency"])
@@ -2,22 +2,32 @@
 
 
 import logging
+from functools import partial
 from dotenv import load_dotenv
 
-from extract_real import get_api_data_of_all_stations
-from transform_real import process_all_stations
-from load_real import import_to_database
+from extract_real import get_run_date
+from response_cache import get_cached_crs, load_response
+from pipeline_real import run_pipeline
+from snapshot_real import read_index, read_station
+from retry_queue import drain_retry_queue, queue_failed_stations
 
 
-def main(_event, _context):
+def main(event, _context):
     """
     Main function to execute the ETL (Extract, Transform, Load) pipeline.
 
     - Configures logging with a warning level and a specific format.
     - Loads environment variables from a .env file using dotenv.
-    - Fetches trains data using get_api_data_of_all_stations().
-    - Transforms the fetched data using process_all_stations().
-    - Loads the transformed data into a database using import_to_database().
+    - Runs extract, transform and load as overlapping stages using run_pipeline(),
+      so stations are loaded while others are still downloading.
+    - Fetches yesterday's trains data from the API, or replays the cached payloads
+      of the event's replay_date (YYYY-MM-DD) without network access, or reads
+      the stations of the event's snapshot_file written by write_snapshot().
+    - Retries stations that failed on earlier runs with drain_retry_queue(), carrying
+      on with today's run if the retries fail, and queues the stations that fail
+      on this run with queue_failed_stations().
+    - With RTT_DAILY_QUOTA set, extracts the highest priority stations that today's
+      remaining API calls allow, and queues the rest with the failed stations.
     """
 
     logging.getLogger().setLevel(logging.INFO)
@@ -25,12 +35,23 @@ def main(_event, _context):
     try:
         load_dotenv()
         print("Pipeline has started.")
-        data = get_api_data_of_all_stations()
-        print("Extract finished.")
-        modified_data = process_all_stations(data)
-        print("Transformation finished.")
-        import_to_database(modified_data)
-        print("Load finished.")
+        replay_date = (event or {}).get("replay_date")
+        snapshot_file = (event or {}).get("snapshot_file")
+        if replay_date:
+            run_pipeline(get_cached_crs(replay_date),
+                         partial(load_response, run_date=replay_date))
+        elif snapshot_file:
+            index = read_index(snapshot_file)
+            run_pipeline(list(index),
+                         partial(read_station, snapshot_file, index=index))
+        else:
+            try:
+                drain_retry_queue()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.error("Retry: Error occurred draining the retry queue: %s", e)
+            stats = run_pipeline()
+            queue_failed_stations(stats["failed_crs"] + stats["skipped_crs"],
+                                  get_run_date())
         print("Pipeline has finished.")
 
     except Exception as e:  # pylint: disable=broad-exception-caught
@@ -0,0 +1,103 @@
+'''Content-addressed on-disk cache of raw RealTime Trains API responses'''
+
+from os import environ as ENV, makedirs, path, listdir, replace
+from hashlib import sha256
+import gzip
+import json
+import logging
+
+
+def get_cache_dir() -> str | None:
+    '''Returns the cache directory set in RTT_CACHE_DIR, or None if caching is disabled'''
+    return ENV.get("RTT_CACHE_DIR") or None
+
+
+def get_object_path(cache_dir: str, digest: str) -> str:
+    '''Returns the path of the compressed payload with the given content hash'''
+    return path.join(cache_dir, "objects", digest[:2], f"{digest}.json.gz")
+
+
+def get_ref_path(cache_dir: str, crs: str, run_date: str) -> str:
+    '''Returns the path of the file pointing a station and run date at a payload'''
+    return path.join(cache_dir, "refs", run_date, crs)
+
+
+def write_atomically(file_path: str, content: bytes) -> None:
+    '''Writes to a temporary file and renames it, so readers never see partial files'''
+    makedirs(path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    replace(temp_path, file_path)
+
+
+def encode_payload(station_data: dict) -> bytes:
+    '''Serialises a payload deterministically so equal payloads share a hash'''
+    return json.dumps(station_data, separators=(",", ":"),
+                      sort_keys=True).encode("utf-8")
+
+
+def save_response(crs: str, run_date: str, station_data: dict,
+                  cache_dir: str | None = None) -> str | None:
+    '''Stores a station's raw payload for the run date (YYYY-MM-DD) and returns its hash'''
+    cache_dir = cache_dir or get_cache_dir()
+    if not cache_dir:
+        return None
+
+    try:
+        payload = encode_payload(station_data)
+        digest = sha256(payload).hexdigest()
+        object_path = get_object_path(cache_dir, digest)
+        if not path.exists(object_path):
+            write_atomically(object_path, gzip.compress(payload))
+        write_atomically(get_ref_path(cache_dir, crs, run_date),
+                         digest.encode("utf-8"))
+        return digest
+    except OSError as e:
+        logging.error("Cache: Error occurred saving station %s: %s", crs, e)
+        return None
+
+
+def load_response(crs: str, run_date: str, cache_dir: str | None = None) -> dict | None:
+    '''Returns the cached payload of a station for the run date, or None if there is none'''
+    cache_dir = cache_dir or get_cache_dir()
+    if not cache_dir:
+        return None
+
+    ref_path = get_ref_path(cache_dir, crs, run_date)
+    if not path.exists(ref_path):
+        return None
+
+    try:
+        with open(ref_path, encoding="utf-8") as file:
+            digest = file.read().strip()
+        with gzip.open(get_object_path(cache_dir, digest), "rb") as file:
+            return json.loads(file.read())
+    except (OSError, ValueError) as e:
+        logging.error("Cache: Error occurred loading station %s: %s", crs, e)
+        return None
+
+
+def get_cached_crs(run_date: str, cache_dir: str | None = None) -> list[str]:
+    '''Returns the CRS codes cached for the run date, in alphabetical order'''
+    cache_dir = cache_dir or get_cache_dir()
+    if not cache_dir:
+        return []
+
+    refs_dir = path.join(cache_dir, "refs", run_date)
+    if not path.isdir(refs_dir):
+        return []
+    return sorted(name for name in listdir(refs_dir) if not name.endswith(".tmp"))
+
+
+def load_cached_stations(run_date: str, cache_dir: str | None = None) -> list[dict]:
+    '''Replays every cached payload for the run date without touching the network'''
+    stations = []
+    for crs in get_cached_crs(run_date, cache_dir):
+        station_data = load_response(crs, run_date, cache_dir)
+        if station_data:
+            stations.append(station_data)
+
+    logging.info("Cache: Replayed %s stations for %s.",
+                 len(stations), run_date)
+    return stations
@@ -0,0 +1,137 @@
+'''Persistent queue of (station, run date) pairs that failed extraction, retried with
+exponential backoff on later runs'''
+
+from os import environ as ENV
+from datetime import timedelta
+import logging
+
+from psycopg2.extensions import connection as DBConnection
+
+from extract_real import get_session, fetch_station
+from rate_limiter import get_limiter
+from load_real import get_connection, get_cursor, import_payload
+from api_quota import get_remaining_calls, record_limiter_calls
+
+RETRY_BASE_SECONDS = 900
+RETRY_MAX_SECONDS = 86400
+MAX_ATTEMPTS = 8
+RETRY_BATCH = 50
+ALERT_AGE_HOURS = 48
+
+
+def enqueue_failures(conn: DBConnection, units: list[tuple[str, str]]) -> None:
+    '''Adds failed (station, run date) pairs to the queue. Pairs already queued have their
+    attempt count increased and their next attempt pushed back exponentially.'''
+    if not units:
+        return
+
+    query = '''
+        INSERT INTO extract_retry (station_crs, run_date, next_attempt)
+        VALUES (%s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (station_crs, run_date) DO UPDATE
+        SET attempts = extract_retry.attempts + 1,
+            next_attempt = NOW() + make_interval(
+                secs => LEAST(%s * POWER(2, extract_retry.attempts), %s))
+    '''
+    with get_cursor(conn) as cur:
+        for crs, run_date in units:
+            cur.execute(query, (crs, run_date, RETRY_BASE_SECONDS,
+                                RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
+    conn.commit()
+    logging.info("Retry: Queued %s failed stations.", len(units))
+
+
+def get_due_retries(conn: DBConnection, limit: int = RETRY_BATCH) -> list[tuple[str, str]]:
+    '''Returns queued pairs whose next attempt is due and that have attempts left'''
+    query = '''
+        SELECT station_crs, run_date FROM extract_retry
+        WHERE next_attempt <= NOW() AND attempts < %s
+        ORDER BY next_attempt
+        LIMIT %s
+    '''
+    with get_cursor(conn) as cur:
+        cur.execute(query, (MAX_ATTEMPTS, limit))
+        return [(crs, run_date.isoformat()) for crs, run_date in cur.fetchall()]
+
+
+def remove_retry(conn: DBConnection, unit: tuple[str, str]) -> None:
+    '''Removes a pair from the queue once it has been loaded'''
+    with get_cursor(conn) as cur:
+        cur.execute("DELETE FROM extract_retry WHERE station_crs = %s AND run_date = %s",
+                    unit)
+    conn.commit()
+
+
+def get_oldest_retry_age(conn: DBConnection) -> timedelta | None:
+    '''Returns how long the oldest pair has been waiting in the queue'''
+    with get_cursor(conn) as cur:
+        cur.execute("SELECT NOW() - MIN(created_at) FROM extract_retry")
+        return cur.fetchone()[0]
+
+
+def log_queue_age(conn: DBConnection) -> None:
+    '''Logs the age of the oldest queued pair, as an error past ALERT_AGE_HOURS'''
+    age = get_oldest_retry_age(conn)
+    if age is None:
+        return
+
+    hours = age.total_seconds() / 3600
+    alert_hours = float(ENV.get("RETRY_ALERT_AGE_HOURS", ALERT_AGE_HOURS))
+    log = logging.error if hours > alert_hours else logging.info
+    log("Retry: Oldest queued station has waited %.1f hours.", hours)
+
+
+def drain_retry_queue(limit: int = RETRY_BATCH) -> dict:
+    '''Retries the due pairs in the queue, removing those that load cleanly and
+    backing off those that fail again or have rows that fail to load. Stops when
+    today's API quota, including the reserve kept back from other runs, runs out,
+    leaving the remaining pairs' attempts as they were. The calls made are recorded
+    even if the drain fails partway.'''
+    stats = {"retried": 0, "recovered": 0}
+    conn = get_connection()
+    cur = get_cursor(conn)
+    limiter = None
+
+    try:
+        due = get_due_retries(conn, limit)
+        limiter = get_limiter(1, get_remaining_calls(conn, reserve=False))
+        with get_session(ENV.get("REALTIME_USERNAME"),
+                         ENV.get("REALTIME_PASSWORD"), pool_size=1) as session:
+            for crs, run_date in due:
+                if limiter.quota_spent():
+                    break
+                station_data = fetch_station(
+                    crs, session, limiter, run_date)["data"]
+                if not station_data and limiter.quota_spent():
+                    break
+                stats["retried"] += 1
+                if station_data and import_payload(station_data, conn, cur) != "failed":
+                    remove_retry(conn, (crs, run_date))
+                    stats["recovered"] += 1
+                else:
+                    enqueue_failures(conn, [(crs, run_date)])
+
+        if stats["retried"] < len(due):
+            logging.warning("Retry: API quota spent, %s due stations left for a later run.",
+                            len(due) - stats["retried"])
+        logging.info("Retry: %s of %s due stations recovered.",
+                     stats["recovered"], stats["retried"])
+        log_queue_age(conn)
+    finally:
+        if limiter is not None:
+            record_limiter_calls(limiter)
+        cur.close()
+        conn.close()
+
+    return stats
+
+
+def queue_failed_stations(list_of_crs: list[str], run_date: str) -> None:
+    '''Queues stations that failed in a pipeline run for a later retry'''
+    if not list_of_crs:
+        return
+    conn = get_connection()
+    try:
+        enqueue_failures(conn, [(crs, run_date) for crs in list_of_crs])
+    finally:
+        conn.close()
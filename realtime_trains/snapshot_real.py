@@ -0,0 +1,61 @@
+'''Reads and writes raw extracts as compressed newline-delimited JSON with an offset index.
+
+Each station is written as its own gzip member, so the file as a whole is a valid gzip
+stream of NDJSON that can be read sequentially, while the sidecar index of byte offsets
+lets a single station be read without decompressing the others.'''
+
+from typing import Iterable, Iterator
+import gzip
+import json
+import logging
+
+INDEX_SUFFIX = ".idx"
+
+
+def get_index_path(filename: str) -> str:
+    '''Returns the path of the offset index next to a snapshot file'''
+    return f"{filename}{INDEX_SUFFIX}"
+
+
+def write_snapshot(stations: Iterable[dict], filename: str) -> dict[str, list[int]]:
+    '''Writes one compressed record per station and saves the index of their offsets.
+    Stations are written as they are iterated, so they need not all be held in memory.'''
+    index = {}
+    with open(filename, "wb") as file:
+        for station in stations:
+            record = json.dumps(station, separators=(",", ":")) + "\n"
+            member = gzip.compress(record.encode("utf-8"))
+            index[station["location"]["crs"]] = [file.tell(), len(member)]
+            file.write(member)
+
+    with open(get_index_path(filename), "w", encoding="utf-8") as file:
+        json.dump(index, file)
+
+    logging.info("Snapshot: Wrote %s stations to %s.", len(index), filename)
+    return index
+
+
+def read_index(filename: str) -> dict[str, list[int]]:
+    '''Returns the byte offset and length of each station's record, keyed by CRS'''
+    with open(get_index_path(filename), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def iter_snapshot(filename: str) -> Iterator[dict]:
+    '''Yields the stations of a snapshot one at a time, in the order they were written'''
+    with gzip.open(filename, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def read_station(filename: str, crs: str,
+                 index: dict[str, list[int]] | None = None) -> dict | None:
+    '''Reads a single station by seeking straight to its record'''
+    index = index if index is not None else read_index(filename)
+    if crs not in index:
+        return None
+
+    offset, length = index[crs]
+    with open(filename, "rb") as file:
+        file.seek(offset)
+        return json.loads(gzip.decompress(file.read(length)))
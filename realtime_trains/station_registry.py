@@ -0,0 +1,95 @@
+'''In-process registry of stations, loaded once and shared by extract and load'''
+
+from os import environ as ENV
+from threading import Lock
+from time import monotonic
+import logging
+
+from psycopg2.extensions import connection as DBConnection
+
+REGISTRY_TTL = 3600
+
+REGISTRY = {
+    "by_crs": {},
+    "by_id": {},
+    "version": None,
+    "checked": None
+}
+REGISTRY_LOCK = Lock()
+
+
+def get_ttl() -> float:
+    '''Returns how many seconds the registry is trusted before it is checked again'''
+    return float(ENV.get("STATION_REGISTRY_TTL", REGISTRY_TTL))
+
+
+def is_fresh() -> bool:
+    '''Returns whether the registry was loaded or checked within the TTL'''
+    checked = REGISTRY["checked"]
+    return checked is not None and monotonic() - checked < get_ttl()
+
+
+def get_version(conn: DBConnection) -> tuple:
+    '''Returns a cheap fingerprint of the station table that changes when stations are added'''
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*), MAX(station_id) FROM station")
+        return tuple(cur.fetchone())
+
+
+def load_stations(conn: DBConnection) -> None:
+    '''Replaces the registry with every station in the database'''
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT station_id, station_crs, station_name FROM station ORDER BY station_id")
+        rows = cur.fetchall()
+
+    REGISTRY["by_crs"] = {}
+    REGISTRY["by_id"] = {}
+    for station_id, crs, name in rows:
+        add_station(station_id, crs, name)
+    REGISTRY["version"] = (len(rows), rows[-1][0] if rows else None)
+    logging.info("Registry: Loaded %s stations.", len(rows))
+
+
+def refresh(conn: DBConnection, force: bool = False) -> None:
+    '''Loads the registry if it is empty or stale. Once the TTL expires, the stations are
+    only reloaded if the station table's version has changed.'''
+    with REGISTRY_LOCK:
+        if not force and is_fresh():
+            return
+        if force or REGISTRY["version"] is None or get_version(conn) != REGISTRY["version"]:
+            load_stations(conn)
+        REGISTRY["checked"] = monotonic()
+
+
+def add_station(station_id: int, crs: str, name: str) -> None:
+    '''Adds a station to the registry, such as one just inserted by the loader'''
+    station = {"station_id": station_id,
+               "station_crs": crs, "station_name": name}
+    REGISTRY["by_crs"][crs] = station
+    REGISTRY["by_id"][station_id] = station
+
+
+def get_station_id(crs: str) -> int | None:
+    '''Returns the id of the station with the given CRS, if it is registered'''
+    station = REGISTRY["by_crs"].get(crs)
+    return station["station_id"] if station else None
+
+
+def get_station_by_id(station_id: int) -> dict | None:
+    '''Returns the station with the given id, if it is registered'''
+    return REGISTRY["by_id"].get(station_id)
+
+
+def get_all_crs() -> list[str]:
+    '''Returns the CRS of every registered station'''
+    return list(REGISTRY["by_crs"])
+
+
+def clear() -> None:
+    '''Empties the registry, so the next refresh reloads it'''
+    with REGISTRY_LOCK:
+        REGISTRY["by_crs"] = {}
+        REGISTRY["by_id"] = {}
+        REGISTRY["version"] = None
+        REGISTRY["checked"] = None
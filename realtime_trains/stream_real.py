@@ -0,0 +1,205 @@
+'''Streams RealTime Trains station responses, decoding one service at a time
+and keeping only the fields the loader uses'''
+
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Any, Iterable, Iterator
+import codecs
+import gzip
+import json
+import tracemalloc
+
+STREAM_CHUNK_SIZE = 65536
+STREAMED_KEYS = ("services",)
+WHITESPACE = " \t\n\r"
+DECODER = json.JSONDecoder()
+
+LOCATION_FIELDS = ["name", "crs"]
+SERVICE_RECORD_FIELDS = {
+    "run_date": "runDate",
+    "service_uid": "serviceUid",
+    "atoc_code": "atocCode",
+    "atoc_name": "atocName"
+}
+LOCATION_DETAIL_RECORD_FIELDS = {
+    "booked_arrival": "gbttBookedArrival",
+    "booked_arrival_next_day": "gbttBookedArrivalNextDay",
+    "realtime_arrival": "realtimeArrival",
+    "realtime_arrival_next_day": "realtimeArrivalNextDay",
+    "realtime_arrival_actual": "realtimeArrivalActual",
+    "booked_departure": "gbttBookedDeparture",
+    "booked_departure_next_day": "gbttBookedDepartureNextDay",
+    "realtime_departure": "realtimeDeparture",
+    "realtime_departure_next_day": "realtimeDepartureNextDay",
+    "realtime_departure_actual": "realtimeDepartureActual",
+    "cancel_code": "cancelReasonCode",
+    "cancel_reason": "cancelReasonLongText"
+}
+SERVICE_FIELDS = [*SERVICE_RECORD_FIELDS.values(), "serviceType"]
+LOCATION_DETAIL_FIELDS = list(LOCATION_DETAIL_RECORD_FIELDS.values())
+
+
+def iter_events(chunks: Iterable[bytes],
+                streamed_keys: tuple = STREAMED_KEYS) -> Iterator[tuple[str, str, Any]]:
+    '''Incrementally parses a top-level JSON object from chunks of bytes.
+    Yields ("item", key, value) for each element of an array under a streamed key,
+    and ("field", key, value) for every other key. Only the unparsed remainder of the
+    body and the current value are held in memory.'''
+    chunks = iter(chunks)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    state = {"buffer": "", "pos": 0}
+
+    def fill() -> bool:
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                state["buffer"] = state["buffer"][state["pos"]:] + text
+                state["pos"] = 0
+                return True
+        return False
+
+    def peek() -> str:
+        while True:
+            buffer, pos = state["buffer"], state["pos"]
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            state["pos"] = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                raise ValueError("Stream: Unexpected end of JSON response")
+
+    def expect(char: str) -> None:
+        if peek() != char:
+            raise ValueError(
+                f"Stream: Expected {char!r} at character {state['pos']}")
+        state["pos"] += 1
+
+    def decode_value() -> Any:
+        peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(state["buffer"], state["pos"])
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            if isinstance(value, (int, float)) and end == len(state["buffer"]) and fill():
+                continue
+            state["pos"] = end
+            return value
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = decode_value()
+        expect(":")
+        if key in streamed_keys and peek() == "[":
+            state["pos"] += 1
+            if peek() == "]":
+                state["pos"] += 1
+            else:
+                while True:
+                    yield "item", key, decode_value()
+                    if peek() != ",":
+                        expect("]")
+                        break
+                    state["pos"] += 1
+        else:
+            yield "field", key, decode_value()
+
+        if peek() != ",":
+            expect("}")
+            return
+        state["pos"] += 1
+
+
+def project(a_dict: dict, fields: list[str]) -> dict:
+    '''Keeps only the listed fields that exist in a dictionary'''
+    if not isinstance(a_dict, dict):
+        raise TypeError(
+            f"Transform: Expected dictionary item but got {type(a_dict)}")
+
+    return {field: a_dict[field] for field in fields if field in a_dict}
+
+
+def project_service(service: dict) -> dict:
+    '''Keeps only the fields of a service that the loader uses'''
+    projected = project(service, SERVICE_FIELDS)
+    projected["locationDetail"] = project(service.get("locationDetail") or {},
+                                          LOCATION_DETAIL_FIELDS)
+    return projected
+
+
+def iter_station_records(chunks: Iterable[bytes]) -> Iterator[tuple[str, dict]]:
+    '''Yields ("location", location) and ("service", service) for each service,
+    projected to the loaded fields as soon as it has been decoded'''
+    for kind, key, value in iter_events(chunks):
+        if kind == "item":
+            yield "service", project_service(value)
+        elif kind == "field" and key == "location" and value:
+            yield "location", project(value, LOCATION_FIELDS)
+
+
+def parse_station_stream(chunks: Iterable[bytes]) -> dict | None:
+    '''Builds a station from a streamed response, in the shape process_station expects.
+    Services are filtered by type in process_station, as with a fully decoded response.'''
+    station = {"location": None, "services": []}
+    for kind, record in iter_station_records(chunks):
+        if kind == "service":
+            station["services"].append(record)
+        else:
+            station["location"] = record
+    return station if station["location"] else None
+
+
+def measure(function, *function_args) -> tuple[Any, float, int]:
+    '''Returns a function's result, run time in seconds and peak traced memory in bytes'''
+    tracemalloc.start()
+    start = perf_counter()
+    result = function(*function_args)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def compare_parsers(body: bytes) -> dict:
+    '''Compares decoding a recorded response in full against streaming it'''
+    def full_parse(body: bytes) -> dict:
+        return json.loads(body)
+
+    def stream_parse(body: bytes) -> dict:
+        chunks = (body[i:i + STREAM_CHUNK_SIZE]
+                  for i in range(0, len(body), STREAM_CHUNK_SIZE))
+        return parse_station_stream(chunks)
+
+    full, full_time, full_peak = measure(full_parse, body)
+    streamed, stream_time, stream_peak = measure(stream_parse, body)
+    return {
+        "services": len(full["services"]),
+        "matches": len(streamed["services"]) == len(full["services"]),
+        "full_seconds": full_time,
+        "full_peak_bytes": full_peak,
+        "stream_seconds": stream_time,
+        "stream_peak_bytes": stream_peak
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare full and streaming parsing of recorded RTT responses.")
+    parser.add_argument("files", nargs="+",
+                        help="Recorded responses (.json, or .json.gz from the response cache)")
+    args = parser.parse_args()
+
+    for filename in args.files:
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, "rb") as file:
+            results = compare_parsers(file.read())
+        print(f"{filename}: {results['services']} services, "
+              f"full {results['full_seconds']:.3f}s / {results['full_peak_bytes'] / 1e6:.1f}MB, "
+              f"stream {results['stream_seconds']:.3f}s / "
+              f"{results['stream_peak_bytes'] / 1e6:.1f}MB, "
+              f"matching: {results['matches']}")
@@ -0,0 +1,121 @@
+'''Test file for the python file anomaly_real'''
+
+from unittest.mock import MagicMock, patch
+import unittest
+
+import numpy as np
+
+from anomaly_real import (
+    detect_batch_anomalies,
+    detect_station_anomalies,
+    get_excluded_reasons,
+    group_medians,
+    record_anomalies
+)
+from transform_real import ServiceRecord, normalise_stations
+
+
+def make_service(uid: str, arrival: str, actual: str, **fields) -> ServiceRecord:
+    '''Creates a service on 21 July 2024 booked and actually arriving at the given times'''
+    return ServiceRecord(run_date="2024-07-21", service_uid=uid, atoc_code="GW",
+                         booked_arrival=arrival, realtime_arrival=actual, **fields)
+
+
+def make_station(crs: str, services: list[ServiceRecord]) -> dict:
+    '''Creates a station with twenty five punctual services followed by the given ones'''
+    punctual = [make_service(f"P{index}", f"{10 + index // 6:02}{index % 6 * 10:02}",
+                             f"{10 + index // 6:02}{index % 6 * 10 + index % 3:02}")
+                for index in range(25)]
+    return {"location": {"name": crs, "crs": crs}, "services": punctual + services}
+
+
+class TestGroupMedians(unittest.TestCase):
+    '''Class for testing the function group_medians'''
+
+    def test_group_medians(self):
+        '''Tests odd, even, missing and empty groups in one call'''
+        values = np.array([5, 1, 3, np.nan, 4, 2, np.nan])
+        groups = np.array([0, 0, 0, 1, 1, 1, 2])
+
+        medians = group_medians(values, groups, 4)
+
+        self.assertEqual(medians[:2].tolist(), [3.0, 3.0])
+        self.assertTrue(np.isnan(medians[2:]).all())
+
+
+class TestDetectAnomalies(unittest.TestCase):
+    '''Class for testing the detection of anomalies'''
+
+    def setUp(self):
+        '''Set up a station with an impossible time, a next day error and an outlier'''
+        self.station = make_station("BTH", [
+            make_service("EARLY", "1500", "1100"),
+            make_service("NEXTDAY", "2350", "2355", realtime_arrival_next_day=True),
+            make_service("LATE", "0900", "1400"),
+            make_service("DWELL", "1200", "1200", booked_departure="1202",
+                         realtime_departure="1100")
+        ])
+
+    def test_impossible_times_are_excluded(self):
+        '''Tests that impossible times are excluded and outliers only flagged by default'''
+        station, entries = detect_station_anomalies(self.station)
+
+        reasons = {entry["service_uid"]: entry["reasons"] for entry in entries}
+        self.assertEqual(reasons, {"EARLY": ["early_by_hours", "arrival_delay_outlier"],
+                                   "NEXTDAY": ["next_day_error", "arrival_delay_outlier"],
+                                   "LATE": ["arrival_delay_outlier"],
+                                   "DWELL": ["departure_before_arrival"]})
+        kept = [service.service_uid for service in station["services"]]
+        self.assertEqual(len(kept), 26)
+        self.assertIn("LATE", kept)
+        self.assertEqual(entries[2]["arrival_delay"], 300.0)
+        self.assertEqual([entry["excluded"] for entry in entries], [True, True, False, True])
+
+    @patch.dict('os.environ', {'ANOMALY_MODE': 'flag'})
+    def test_flag_mode(self):
+        '''Tests that nothing is excluded in flag mode'''
+        station, entries = detect_station_anomalies(self.station)
+
+        self.assertEqual(len(station["services"]), 29)
+        self.assertFalse(any(entry["excluded"] for entry in entries))
+
+    def test_strict_mode(self):
+        '''Tests that strict mode also excludes outliers'''
+        self.assertEqual(get_excluded_reasons("strict"),
+                         {"departure_before_arrival", "early_by_hours", "next_day_error",
+                          "arrival_delay_outlier", "departure_delay_outlier"})
+
+    def test_small_stations_have_no_outliers(self):
+        '''Tests that a station with few services is only checked against fixed limits'''
+        _, entries = detect_station_anomalies(
+            {"location": {"name": "Tiny", "crs": "TNY"},
+             "services": [make_service("A", "1000", "1000"), make_service("B", "0900", "1400")]})
+
+        self.assertEqual(entries, [])
+
+    def test_batch_compares_within_stations(self):
+        '''Tests that a batch finds outliers against each service's own station'''
+        late = make_station("YRK", [])
+        for service in late["services"]:
+            service.realtime_arrival = str(int(service.booked_arrival) + 500)
+        batch = normalise_stations([self.station, late])
+
+        kept, entries = detect_batch_anomalies(batch)
+
+        self.assertEqual({entry["station_crs"] for entry in entries}, {"BTH"})
+        self.assertEqual(len(kept.facts), 51)
+        self.assertNotIn("EARLY", [fact.service_uid for fact in kept.facts])
+
+    def test_record_anomalies(self):
+        '''Tests that anomalies are stored with missing delays as NULL'''
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        _, entries = detect_station_anomalies(self.station)
+
+        record_anomalies(conn, entries)
+
+        self.assertEqual(cur.execute.call_count, 4)
+        self.assertEqual(cur.execute.call_args_list[0][0][1],
+                         ("BTH", "EARLY", "2024-07-21", ["early_by_hours", "arrival_delay_outlier"],
+                          -240.0, None, True))
+        conn.commit.assert_called_once()
@@ -0,0 +1,89 @@
+'''Test file for the python file api_quota'''
+
+from unittest.mock import MagicMock, patch
+import unittest
+
+from api_quota import (
+    get_remaining_calls,
+    get_station_weights,
+    prioritise_stations,
+    plan_stations,
+    record_calls
+)
+
+
+class TestQuota(unittest.TestCase):
+    '''Class for testing the API call ledger'''
+
+    def setUp(self):
+        '''Set up a mock connection for every test'''
+        self.conn = MagicMock()
+
+    @patch.dict('api_quota.ENV', {}, clear=True)
+    def test_no_quota(self):
+        '''Tests that there is no limit without RTT_DAILY_QUOTA'''
+        self.assertIsNone(get_remaining_calls(self.conn))
+
+    @patch.dict('api_quota.ENV', {'RTT_DAILY_QUOTA': '1000', 'RTT_QUOTA_RESERVE': '100'})
+    @patch('api_quota.get_calls_today')
+    def test_remaining_calls(self, mock_get_calls_today):
+        '''Tests that the reserve and today's calls are taken off the quota'''
+        mock_get_calls_today.return_value = 850
+        self.assertEqual(get_remaining_calls(self.conn), 50)
+
+        mock_get_calls_today.return_value = 990
+        self.assertEqual(get_remaining_calls(self.conn), 0)
+        self.assertEqual(get_remaining_calls(self.conn, reserve=False), 10)
+
+    @patch('api_quota.get_cursor')
+    def test_record_calls(self, mock_get_cursor):
+        '''Tests that calls are added to today's row'''
+        cur = mock_get_cursor.return_value.__enter__.return_value
+
+        record_calls(self.conn, 12)
+
+        self.assertIn('ON CONFLICT', cur.execute.call_args.args[0])
+        self.assertEqual(cur.execute.call_args.args[1], (12,))
+        self.conn.commit.assert_called_once()
+
+    @patch.dict('api_quota.ENV', {'STATION_WEIGHTS': 'kgx:5, EDB:2,bad'})
+    def test_get_station_weights(self):
+        '''Tests that weights are parsed and malformed entries ignored'''
+        self.assertEqual(get_station_weights(), {'KGX': 5.0, 'EDB': 2.0})
+
+
+class TestPrioritisation(unittest.TestCase):
+    '''Class for testing the station prioritisation'''
+
+    def test_prioritise_stations(self):
+        '''Tests that weight comes before delays and ties keep their order'''
+        ordered = prioritise_stations(['BTH', 'EDB', 'KGX', 'YRK', 'LDS'],
+                                      {'KGX': 5},
+                                      {'YRK': 40, 'EDB': 3})
+
+        self.assertEqual(ordered, ['KGX', 'YRK', 'EDB', 'BTH', 'LDS'])
+
+    @patch.dict('api_quota.ENV', {'STATION_WEIGHTS': 'LDS:2'})
+    @patch('api_quota.get_delay_activity')
+    @patch('api_quota.get_remaining_calls')
+    def test_plan_stations_when_tight(self, mock_get_remaining_calls, mock_get_delay_activity):
+        '''Tests that only the highest priority stations fit a tight quota'''
+        mock_get_remaining_calls.return_value = 2
+        mock_get_delay_activity.return_value = {'YRK': 10}
+
+        selected, skipped, remaining = plan_stations(
+            MagicMock(), ['BTH', 'LDS', 'YRK', 'EDB'])
+
+        self.assertEqual(selected, ['LDS', 'YRK'])
+        self.assertEqual(skipped, ['BTH', 'EDB'])
+        self.assertEqual(remaining, 2)
+
+    @patch('api_quota.get_delay_activity')
+    @patch('api_quota.get_remaining_calls')
+    def test_plan_stations_within_quota(self, mock_get_remaining_calls, mock_get_delay_activity):
+        '''Tests that every station is kept in order when the quota is enough'''
+        mock_get_remaining_calls.return_value = 10
+
+        self.assertEqual(plan_stations(MagicMock(), ['YRK', 'BTH']),
+                         (['YRK', 'BTH'], [], 10))
+        mock_get_delay_activity.assert_not_called()
@@ -0,0 +1,133 @@
+'''Test file for the python file backfill_real'''
+
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+import unittest
+
+import pytest
+
+from backfill_real import (
+    WORKER,
+    backfill_unit,
+    get_date_range,
+    get_units,
+    init_worker,
+    read_checkpoint,
+    run_backfill
+)
+
+
+class TestGetDateRange(unittest.TestCase):
+    '''Class for testing the function get_date_range'''
+
+    def test_get_date_range(self):
+        '''Tests that the range includes both ends and crosses months'''
+        self.assertEqual(get_date_range('2024-06-29', '2024-07-01'),
+                         ['2024-06-29', '2024-06-30', '2024-07-01'])
+
+    def test_get_date_range_reversed(self):
+        '''Tests that an end date before the start date is rejected'''
+        with pytest.raises(ValueError):
+            get_date_range('2024-07-02', '2024-07-01')
+
+
+class TestRunBackfill(unittest.TestCase):
+    '''Class for testing the function run_backfill'''
+
+    def setUp(self):
+        '''Set up a temporary checkpoint file for every test'''
+        self.temp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.checkpoint_path = path.join(self.temp_dir.name, 'checkpoint.csv')
+        self.stations = ['BTH', 'YRK']
+        self.run_dates = ['2024-07-20', '2024-07-21']
+
+    def tearDown(self):
+        '''Remove the temporary checkpoint file'''
+        self.temp_dir.cleanup()
+
+    def test_get_units(self):
+        '''Tests that every station is paired with every date'''
+        self.assertEqual(len(get_units(self.stations, self.run_dates)), 4)
+
+    @patch('backfill_real.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('backfill_real.init_worker')
+    @patch('backfill_real.backfill_unit')
+    def test_run_backfill_writes_checkpoint(self, mock_backfill_unit, _mock_init_worker):
+        '''Tests that only successful units are checkpointed'''
+        mock_backfill_unit.side_effect = lambda unit: (unit, unit[0] == 'BTH')
+
+        stats = run_backfill(self.stations, self.run_dates,
+                             2, self.checkpoint_path)
+
+        self.assertEqual(stats['loaded'], 2)
+        self.assertEqual(stats['failed'], 2)
+        self.assertEqual(read_checkpoint(self.checkpoint_path),
+                         {('BTH', '2024-07-20'), ('BTH', '2024-07-21')})
+
+    @patch('backfill_real.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('backfill_real.init_worker')
+    @patch('backfill_real.backfill_unit')
+    def test_run_backfill_resumes(self, mock_backfill_unit, _mock_init_worker):
+        '''Tests that checkpointed units are not run again'''
+        with open(self.checkpoint_path, 'w', encoding='utf-8') as file:
+            file.write('BTH,2024-07-20\nBTH,2024-07-21\n')
+        mock_backfill_unit.side_effect = lambda unit: (unit, True)
+
+        run_backfill(self.stations, self.run_dates, 2, self.checkpoint_path)
+
+        self.assertEqual({call.args[0] for call in mock_backfill_unit.call_args_list},
+                         {('YRK', '2024-07-20'), ('YRK', '2024-07-21')})
+        self.assertEqual(len(read_checkpoint(self.checkpoint_path)), 4)
+
+
+class TestInitWorker(unittest.TestCase):
+    '''Class for testing the function init_worker'''
+
+    @patch('backfill_real.atexit.register')
+    @patch('backfill_real.get_cursor')
+    @patch('backfill_real.get_connection')
+    @patch('backfill_real.get_session')
+    def test_limiter_is_capped_at_share(self, *_mocks):
+        '''Tests that a worker's limiter never grows past its share and has no deadline'''
+        init_worker(1.25, 40)
+
+        limiter = WORKER['limiter']
+        self.assertEqual(limiter.max_rate, 1.25)
+        self.assertEqual(limiter.max_requests, 40)
+        self.assertIsNone(limiter.deadline)
+
+
+class TestBackfillUnit(unittest.TestCase):
+    '''Class for testing the function backfill_unit'''
+
+    def setUp(self):
+        '''Set up the worker state used by backfill_unit'''
+        WORKER.update({"session": MagicMock(), "limiter": MagicMock(),
+                       "conn": MagicMock(), "cur": MagicMock()})
+
+    @patch('backfill_real.record_calls')
+    @patch('backfill_real.fetch_station')
+    def test_unit_calls_are_recorded(self, mock_fetch_station, mock_record_calls):
+        '''Tests that the API calls a unit made are added to the quota ledger'''
+        WORKER["limiter"].report.side_effect = [{"requests": 5}, {"requests": 8}]
+        mock_fetch_station.return_value = {"data": None}
+
+        self.assertEqual(backfill_unit(("BTH", "2026-10-01")), (("BTH", "2026-10-01"), False))
+        mock_record_calls.assert_called_once_with(WORKER["conn"], 3)
+
+    @patch('backfill_real.record_calls')
+    @patch('backfill_real.fetch_station', return_value={"data": {"location": {}}})
+    @patch('backfill_real.import_payload')
+    def test_unit_with_failed_rows_is_not_complete(self, mock_import_payload, *_mocks):
+        '''Tests that a unit with rows that failed to load is not reported as complete,
+        so it stays out of the checkpoint and is retried'''
+        mock_import_payload.return_value = "failed"
+        self.assertEqual(backfill_unit(("BTH", "2026-10-01")), (("BTH", "2026-10-01"), False))
+
+        mock_import_payload.return_value = "loaded"
+        self.assertEqual(backfill_unit(("BTH", "2026-10-01")), (("BTH", "2026-10-01"), True))
+
+        mock_import_payload.return_value = "skipped"
+        self.assertEqual(backfill_unit(("BTH", "2026-10-01")), (("BTH", "2026-10-01"), True))
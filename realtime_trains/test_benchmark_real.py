@@ -0,0 +1,58 @@
+'''Test file for the python file benchmark_real'''
+
+import unittest
+
+from benchmark_real import (
+    get_synthetic_crs,
+    make_synthetic_day,
+    compare_columnar_memory,
+    compare_service_memory,
+    remove_keys
+)
+from transform_real import process_station
+
+
+class TestSyntheticDay(unittest.TestCase):
+    '''Class for testing the synthetic RTT responses'''
+
+    def test_synthetic_crs_are_unique(self):
+        '''Tests that every station of a large day has its own code'''
+        codes = [get_synthetic_crs(index) for index in range(1000)]
+
+        self.assertEqual(len(set(codes)), 1000)
+        self.assertTrue(all(len(code) == 3 and code.isalpha() for code in codes))
+
+    def test_synthetic_day_transforms(self):
+        '''Tests that synthetic stations are transformed like API responses'''
+        day = make_synthetic_day(3, 80, "2024-07-21")
+        station = process_station(day[1])
+
+        self.assertEqual(station["location"], {"name": "AAB Station", "crs": "AAB"})
+        self.assertEqual(len(station["services"]), 78)
+        self.assertTrue(any(service.is_cancelled() for service in station["services"]))
+
+    def test_compare_service_memory(self):
+        '''Tests that records hold the same services in less memory'''
+        memory = compare_service_memory(200)
+
+        self.assertTrue(memory["matches"])
+        self.assertLess(memory["record_bytes"], memory["dict_bytes"])
+
+    def test_remove_keys_keeps_unused_fields(self):
+        '''Tests that the baseline keeps the fields the old transform did not remove'''
+        service = make_synthetic_day(1, 1, "2024-07-21")[0]["services"][0]
+
+        baseline = remove_keys(service)
+
+        self.assertNotIn("trainIdentity", baseline)
+        self.assertNotIn("origin", baseline["locationDetail"])
+        self.assertEqual(baseline["locationDetail"]["description"], "Bath Spa")
+        self.assertEqual(baseline["locationDetail"]["displayAs"], "CALL")
+        self.assertIn("origin", service["locationDetail"])
+
+    def test_compare_columnar_memory(self):
+        '''Tests that a columnar batch holds a day in less memory than records'''
+        memory = compare_columnar_memory(5, 100)
+
+        self.assertEqual(memory["services"], 5 * 97)
+        self.assertLess(memory["batch_bytes"], memory["record_bytes"])
@@ -0,0 +1,52 @@
+'''Test file for the python file bulk_load_real'''
+
+from unittest.mock import MagicMock
+import unittest
+
+from benchmark_real import make_synthetic_day
+from bulk_load_real import CREATE_STAGING, MERGE_QUERIES, STAGING_COLUMNS, bulk_load
+from columnar_real import stations_to_batch
+from transform_real import process_all_stations
+
+
+class TestBulkLoad(unittest.TestCase):
+    '''Class for testing the staging table loader'''
+
+    def setUp(self):
+        '''Set up a columnar day and a connection with a mock cursor'''
+        self.batch = stations_to_batch(process_all_stations(make_synthetic_day(2, 50)))
+        self.conn = MagicMock()
+        self.cur = self.conn.cursor.return_value.__enter__.return_value
+        self.cur.rowcount = 7
+
+    def test_bulk_load(self):
+        '''Tests that the day is copied into staging then merged in one transaction'''
+        stats = bulk_load(self.batch, self.conn)
+
+        queries = [call[0][0] for call in self.cur.execute.call_args_list]
+        self.assertEqual(queries, [CREATE_STAGING, *MERGE_QUERIES.values()])
+        copy_query, buffer = self.cur.copy_expert.call_args[0]
+        self.assertEqual(copy_query, f"COPY waypoint_staging ({', '.join(STAGING_COLUMNS)}) "
+                                     "FROM STDIN")
+        self.assertEqual(len(buffer.read().splitlines()), len(self.batch))
+        self.conn.commit.assert_called_once()
+        self.assertEqual(stats["rows"], len(self.batch))
+        self.assertEqual(stats["inserted"]["waypoint"], 7)
+
+    def test_bulk_load_rolls_back(self):
+        '''Tests that nothing is committed when a merge fails'''
+        self.cur.execute.side_effect = [None, Exception("duplicate key")]
+
+        with self.assertRaises(Exception):
+            bulk_load(self.batch, self.conn)
+
+        self.conn.rollback.assert_called_once()
+        self.conn.commit.assert_not_called()
+
+    def test_staging_columns_are_in_batch(self):
+        '''Tests that every staged column is held in a columnar batch'''
+        self.assertTrue(set(STAGING_COLUMNS) <= set(self.batch.dtype.names))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+'''Test file for the python file columnar_real'''
+
+from io import StringIO
+from unittest.mock import MagicMock
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmark_real import make_synthetic_day
+from columnar_real import (
+    batch_to_stations,
+    copy_batch,
+    facts_to_batch,
+    format_column,
+    load_batch,
+    save_batch,
+    stations_to_batch,
+    write_copy
+)
+from transform_real import ServiceRecord, process_all_stations
+
+
+class TestStationsToBatch(unittest.TestCase):
+    '''Class for testing the conversion between stations and batches'''
+
+    def setUp(self):
+        '''Set up a transformed day with cancelled and next day services'''
+        self.stations = process_all_stations(make_synthetic_day(3, 120, "2024-07-21"))
+
+    def test_round_trip(self):
+        '''Tests that a batch converts back into the same stations and records'''
+        batch = stations_to_batch(self.stations)
+
+        self.assertEqual(len(batch), sum(len(station["services"])
+                                         for station in self.stations))
+        self.assertEqual(batch_to_stations(batch), self.stations)
+
+    def test_columns(self):
+        '''Tests that times, delays and text are held as typed columns'''
+        batch = stations_to_batch(self.stations)
+
+        self.assertEqual(batch.dtype["booked_arrival"], np.dtype("datetime64[m]"))
+        self.assertEqual(batch.dtype["arrival_delay"], np.dtype(np.float64))
+        self.assertEqual(set(batch["station_crs"].tolist()), {"AAA", "AAB", "AAC"})
+        self.assertIn("M8", batch["cancel_code"].tolist())
+
+    def test_facts_to_batch(self):
+        '''Tests that a normalised batch converts into the same rows as its stations'''
+        normalised = process_all_stations(make_synthetic_day(3, 120, "2024-07-21"),
+                                          normalise=True)
+
+        batch = facts_to_batch(normalised)
+
+        self.assertEqual(batch_to_stations(batch), self.stations)
+
+    def test_malformed_services_are_left_out(self):
+        '''Tests that services the loader would reject are not in the batch'''
+        stations = [{"location": {"name": "Bath Spa", "crs": "BTH"}, "services": [
+            ServiceRecord(run_date="2024-07-21", service_uid="W1", booked_arrival="1200"),
+            ServiceRecord(run_date="2024-07-21", service_uid="W2", booked_arrival="12a0")]}]
+
+        batch = stations_to_batch(stations)
+
+        self.assertEqual(batch["service_uid"].tolist(), ["W1"])
+
+    def test_empty_day(self):
+        '''Tests that a day without services gives an empty batch'''
+        batch = stations_to_batch([{"location": {"name": "Bath Spa", "crs": "BTH"},
+                                    "services": []}])
+
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch_to_stations(batch), [])
+
+
+class TestWriters(unittest.TestCase):
+    '''Class for testing the COPY and file writers'''
+
+    def setUp(self):
+        '''Set up a batch of one cancelled service'''
+        self.batch = stations_to_batch([{
+            "location": {"name": "Bath Spa", "crs": "BTH"},
+            "services": [ServiceRecord(run_date="2024-07-21", service_uid="W1",
+                                       atoc_code="GW", booked_arrival="2359",
+                                       cancel_code="M8", cancel_reason="a\tfault")]}])
+
+    def test_format_column(self):
+        '''Tests that missing values are written as \\N and text is escaped'''
+        self.assertEqual(format_column(self.batch["actual_arrival"]).tolist(), [r"\N"])
+        self.assertEqual(format_column(self.batch["arrival_delay"]).tolist(), [r"\N"])
+        self.assertEqual(format_column(self.batch["cancel_reason"]).tolist(), ["a\\tfault"])
+        self.assertEqual(format_column(self.batch["atoc_name"]).tolist(), [r"\N"])
+
+    def test_write_copy(self):
+        '''Tests that each row is written as a tab separated line'''
+        buffer = StringIO()
+
+        rows = write_copy(self.batch, buffer, ["service_uid", "booked_arrival", "cancel_code"])
+
+        self.assertEqual(rows, 1)
+        self.assertEqual(buffer.getvalue(), "W1\t2024-07-21T23:59\tM8\n")
+
+    def test_copy_batch(self):
+        '''Tests that a batch is copied into a table with the named columns'''
+        cur = MagicMock()
+
+        rows = copy_batch(self.batch, cur, "staging", ["service_uid", "cancel_code"])
+
+        self.assertEqual(rows, 1)
+        query, buffer = cur.copy_expert.call_args[0]
+        self.assertEqual(query, "COPY staging (service_uid, cancel_code) FROM STDIN")
+        self.assertEqual(buffer.read(), "W1\tM8\n")
+
+    def test_save_and_load(self):
+        '''Tests that a batch saved to a file loads unchanged'''
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "day.npy")
+            save_batch(self.batch, filename)
+
+            loaded = load_batch(filename)
+
+        self.assertEqual(loaded.dtype, self.batch.dtype)
+        self.assertEqual(batch_to_stations(loaded), batch_to_stations(self.batch))
@@ -0,0 +1,102 @@
+'''Test file for the python file dimension_cache'''
+
+from unittest.mock import MagicMock, patch
+import unittest
+
+from dimension_cache import (
+    cache_id,
+    clear_cache,
+    get_cached_id,
+    preload_dimensions,
+    CACHE
+)
+from load_real import insert_or_get_operator_by_code, insert_or_get_service_by_uid
+
+
+class TestDimensionCache(unittest.TestCase):
+    '''Class for testing the dimension cache'''
+
+    def setUp(self):
+        '''Set up an empty cache and a mock connection for every test'''
+        clear_cache()
+        self.conn = MagicMock()
+        self.cur = self.conn.cursor.return_value.__enter__.return_value
+        self.cur.fetchall.side_effect = [[(1, 'GW'), (2, 'XC')],
+                                         [(3, 'M8')],
+                                         [(4, 'W101  ')]]
+
+    def tearDown(self):
+        '''Empty the cache for other tests'''
+        clear_cache()
+
+    @patch('dimension_cache.refresh')
+    def test_preload(self, mock_refresh):
+        '''Tests operators, cancel codes and services are each loaded in one query'''
+        preload_dimensions(self.conn, ['W101', 'W102'])
+
+        mock_refresh.assert_called_once_with(self.conn)
+        self.assertEqual(self.cur.execute.call_count, 3)
+        self.assertEqual(self.cur.execute.call_args[0][1], (['W101', 'W102'],))
+        self.assertEqual(get_cached_id('operator', 'XC'), 2)
+        self.assertEqual(get_cached_id('cancel_code', 'M8'), 3)
+        self.assertEqual(get_cached_id('service', 'W101'), 4)
+        self.assertIsNone(get_cached_id('service', 'W102'))
+        self.assertEqual((CACHE['hits'], CACHE['misses']), (3, 1))
+
+    @patch('dimension_cache.refresh')
+    def test_preload_only_loads_missing_services(self, _mock_refresh):
+        '''Tests the seed tables are loaded once and cached services are not queried'''
+        preload_dimensions(self.conn, ['W101'])
+        self.cur.fetchall.side_effect = [[]]
+
+        preload_dimensions(self.conn, ['W101', 'W103', None])
+
+        self.assertEqual(self.cur.execute.call_count, 4)
+        self.assertEqual(self.cur.execute.call_args[0][1], (['W103'],))
+
+
+class TestCachedInserts(unittest.TestCase):
+    '''Class for testing the loader's lookups through the dimension cache'''
+
+    def setUp(self):
+        '''Set up an empty cache for every test'''
+        clear_cache()
+        self.conn = MagicMock()
+        self.cur = MagicMock()
+
+    def tearDown(self):
+        '''Empty the cache for other tests'''
+        clear_cache()
+
+    @patch('load_real.insert_or_get_entry')
+    def test_hit_skips_database(self, mock_insert_or_get_entry):
+        '''Tests a cached operator is returned without querying the database'''
+        cache_id('operator', 'GW', 7)
+
+        self.assertEqual(insert_or_get_operator_by_code('GW', 'GWR', self.conn, self.cur), 7)
+        mock_insert_or_get_entry.assert_not_called()
+
+    @patch('load_real.insert_or_get_entry')
+    def test_miss_is_inserted_and_cached(self, mock_insert_or_get_entry):
+        '''Tests a missing service is inserted once, then answered by the cache'''
+        mock_insert_or_get_entry.return_value = 9
+
+        first = insert_or_get_service_by_uid('W101', 1, self.conn, self.cur)
+        second = insert_or_get_service_by_uid('W101', 1, self.conn, self.cur)
+
+        self.assertEqual((first, second), (9, 9))
+        mock_insert_or_get_entry.assert_called_once()
+
+    @patch('load_real.insert_or_get_entry')
+    def test_failed_insert_is_not_cached(self, mock_insert_or_get_entry):
+        '''Tests a failed insert is retried on the next lookup'''
+        mock_insert_or_get_entry.return_value = None
+
+        insert_or_get_service_by_uid('W101', 1, self.conn, self.cur)
+        insert_or_get_service_by_uid('W101', 1, self.conn, self.cur)
+
+        self.assertEqual(mock_insert_or_get_entry.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,11 +7,14 @@ from requests.exceptions import RequestException
 from requests.auth import HTTPBasicAuth
 from requests import Response
 
+from station_registry import clear
 from extract_real import (
     get_data_from_api,
     get_yesterday_data_of_station,
     get_all_stations_crs,
-    get_api_data_of_all_stations
+    get_api_data_of_all_stations,
+    get_station_results,
+    fetch_station
 )
 
 
@@ -90,35 +93,114 @@ class TestAPIFunctions(unittest.TestCase):
         self.assertIsNone(result)
 
     @patch('extract_real.get_connection')
-    @patch('extract_real.get_cursor')
-    def test_get_all_stations_crs(self, mock_get_cursor, mock_get_connection):
-        '''Tests if the query matches the expected query'''
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_cursor.fetchall.return_value = [('STN1',), ('STN2',)]
-
-        mock_get_connection.return_value = mock_conn
-        mock_get_cursor.return_value.__enter__.return_value = mock_cursor
+    def test_get_all_stations_crs(self, mock_get_connection):
+        '''Tests that stations are loaded once into the registry and reused'''
+        clear()
+        mock_cursor = mock_get_connection.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchall.return_value = [(1, 'STN1', 'Station 1'),
+                                             (2, 'STN2', 'Station 2')]
 
         result = get_all_stations_crs()
+        second_result = get_all_stations_crs()
 
         mock_get_connection.assert_called_once()
-        mock_cursor.execute.assert_called_once_with(
-            "SELECT station_crs FROM station")
+        mock_get_connection.return_value.close.assert_called_once()
         self.assertEqual(result, ['STN1', 'STN2'])
+        self.assertEqual(second_result, ['STN1', 'STN2'])
+        clear()
 
     @patch('extract_real.get_all_stations_crs')
-    @patch('extract_real.get_yesterday_data_of_station')
+    @patch('extract_real.get_data_of_station')
     def test_get_api_data_of_all_stations(self,
-                                          mock_get_yesterday_data_of_station,
+                                          mock_get_data_of_station,
                                           mock_get_all_stations_crs):
         '''Tests if the function calls functions an appropriate number of times'''
         mock_get_all_stations_crs.return_value = ['STN1', 'STN2']
-        mock_get_yesterday_data_of_station.side_effect = [
-            {'data': 'data1'}, {'data': 'data2'}]
+        station_data = {'STN1': {'data': 'data1'}, 'STN2': {'data': 'data2'}}
+        mock_get_data_of_station.side_effect = \
+            lambda crs, _run_date, _session, _limiter: station_data[crs]
 
         result = get_api_data_of_all_stations()
 
         mock_get_all_stations_crs.assert_called_once()
-        self.assertEqual(mock_get_yesterday_data_of_station.call_count, 2)
+        self.assertEqual(mock_get_data_of_station.call_count, 2)
         self.assertEqual(result, [{'data': 'data1'}, {'data': 'data2'}])
+
+    @patch('extract_real.get')
+    def test_get_data_from_api_with_session(self, mock_get):
+        '''Test that a shared session is used instead of a fresh request'''
+        mock_session = MagicMock()
+        mock_session.get.return_value.json.return_value = {'key': 'value'}
+
+        result = get_data_from_api(
+            "http://example.com", "user", "pass", mock_session)
+
+        self.assertEqual(result, {'key': 'value'})
+        mock_session.get.assert_called_once_with(
+            "http://example.com", timeout=10)
+        mock_get.assert_not_called()
+
+    @patch('extract_real.get_data_of_station')
+    def test_get_station_results_keeps_order(self, mock_get_data_of_station):
+        '''Tests that concurrent fetching keeps the station order and records failures'''
+        crs_list = [f'S{i:02}' for i in range(20)]
+        mock_get_data_of_station.side_effect = \
+            lambda crs, _run_date, _session, _limiter: None if crs == 'S05' else {'crs': crs}
+
+        results = get_station_results(crs_list, max_workers=4)
+
+        self.assertEqual([result['crs'] for result in results], crs_list)
+        self.assertIsNone(results[5]['data'])
+        self.assertEqual(results[6]['data'], {'crs': 'S06'})
+        self.assertTrue(all(result['latency'] >= 0 for result in results))
+
+    @patch('extract_real.save_response')
+    @patch('extract_real.load_response')
+    @patch('extract_real.get_data_of_station')
+    def test_fetch_station_uses_cache(self,
+                                      mock_get_data_of_station,
+                                      mock_load_response,
+                                      mock_save_response):
+        '''Tests that a cached payload is used instead of the API'''
+        mock_load_response.return_value = {'data': 'cached'}
+
+        result = fetch_station('STN')
+
+        self.assertEqual(result['data'], {'data': 'cached'})
+        self.assertTrue(result['cached'])
+        mock_get_data_of_station.assert_not_called()
+        mock_save_response.assert_not_called()
+
+    @patch('extract_real.save_response')
+    @patch('extract_real.load_response')
+    @patch('extract_real.get_data_of_station')
+    def test_fetch_station_saves_to_cache(self,
+                                          mock_get_data_of_station,
+                                          mock_load_response,
+                                          mock_save_response):
+        '''Tests that a fetched payload is written to the cache'''
+        mock_load_response.return_value = None
+        mock_get_data_of_station.return_value = {'data': 'fresh'}
+
+        result = fetch_station('STN')
+
+        self.assertEqual(result['data'], {'data': 'fresh'})
+        self.assertFalse(result['cached'])
+        mock_save_response.assert_called_once()
+
+    @patch.dict('os.environ', {'RTT_STREAM_PARSE': 'true'})
+    @patch('extract_real.save_response')
+    @patch('extract_real.load_response')
+    @patch('extract_real.get_data_of_station')
+    def test_fetch_station_skips_cache_when_streaming(self,
+                                                      mock_get_data_of_station,
+                                                      mock_load_response,
+                                                      mock_save_response):
+        '''Tests that a streamed payload, holding only the loaded fields, is not cached'''
+        mock_load_response.return_value = None
+        mock_get_data_of_station.return_value = {'data': 'streamed'}
+
+        result = fetch_station('STN')
+
+        self.assertEqual(result['data'], {'data': 'streamed'})
+        mock_save_response.assert_not_called()
@@ -0,0 +1,199 @@
+'''Test file for the python file incremental_real'''
+
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+import unittest
+
+from incremental_real import (
+    get_changed_services,
+    get_window_start,
+    keep_actual_times,
+    poll_once,
+    record_services,
+    screen_services,
+    upsert_services,
+    write_changed_services
+)
+from transform_real import ServiceRecord
+
+
+def make_service(uid: str, realtime_arrival: str | None,
+                 actual: bool = True) -> ServiceRecord:
+    '''Creates a transformed service arriving at the given realtime'''
+    return ServiceRecord(service_uid=uid, run_date="2024-07-21",
+                         atoc_code="GW", atoc_name="GWR",
+                         booked_arrival="1200",
+                         realtime_arrival=realtime_arrival,
+                         realtime_arrival_actual=actual)
+
+
+class TestGetChangedServices(unittest.TestCase):
+    '''Class for testing the diff between polls'''
+
+    def setUp(self):
+        '''Set up a station and an empty snapshot for every test'''
+        self.station = {"location": {"crs": "BTH", "name": "Bath"},
+                        "services": [make_service("A1", "1201"),
+                                     make_service("B2", "1215")]}
+        self.snapshot = {"run_date": "2024-07-21", "services": {}}
+
+    def test_new_services_are_changed(self):
+        '''Tests that every service is new on the first poll'''
+        self.assertEqual(len(get_changed_services(
+            self.station, self.snapshot)), 2)
+
+    def test_unchanged_services_are_skipped(self):
+        '''Tests that recorded services are not written again'''
+        record_services(self.station, self.station["services"], self.snapshot)
+        self.station["services"][1].realtime_arrival = "1217"
+
+        changed = get_changed_services(self.station, self.snapshot)
+
+        self.assertEqual([service.service_uid
+                         for service in changed], ["B2"])
+
+    def test_services_that_have_not_run_are_skipped(self):
+        '''Tests that estimated times are not treated as actual times'''
+        self.station["services"] = [make_service("C3", "1230", actual=False),
+                                    make_service("D4", None)]
+
+        self.assertEqual(get_changed_services(self.station, self.snapshot), [])
+
+    def test_cancelled_services_without_actual_times_are_skipped(self):
+        '''Tests that a service cancelled before reaching the station, which cannot be
+        stored as a waypoint, is not written on every poll'''
+        service = make_service("E5", None)
+        service.cancel_code, service.cancel_reason = "AA", "A reason"
+        self.station["services"] = [service]
+
+        self.assertEqual(get_changed_services(self.station, self.snapshot), [])
+
+    def test_keep_actual_times(self):
+        '''Tests that only estimated realtime fields are removed'''
+        service = ServiceRecord(realtime_arrival="1230", realtime_arrival_next_day=True,
+                                realtime_arrival_actual=False,
+                                realtime_departure="1231", realtime_departure_actual=True)
+
+        keep_actual_times(service)
+
+        self.assertIsNone(service.realtime_arrival)
+        self.assertIsNone(service.realtime_arrival_next_day)
+        self.assertEqual(service.realtime_departure, "1231")
+
+
+class TestGetWindowStart(unittest.TestCase):
+    '''Class for testing the function get_window_start'''
+
+    def test_get_window_start(self):
+        '''Tests the window starts the lookback before now'''
+        self.assertEqual(get_window_start(
+            datetime(2024, 7, 21, 14, 30), 120), "1230")
+
+    def test_get_window_start_after_midnight(self):
+        '''Tests the whole day is searched when the lookback crosses midnight'''
+        self.assertIsNone(get_window_start(datetime(2024, 7, 21, 0, 30), 120))
+
+
+class TestUpsertServices(unittest.TestCase):
+    '''Class for testing the function upsert_services'''
+
+    @patch('incremental_real.insert_or_get_station', return_value=1)
+    @patch('incremental_real.insert_or_get_operator', return_value=2)
+    @patch('incremental_real.insert_or_get_service', return_value=3)
+    @patch('incremental_real.upsert_waypoint')
+    def test_upsert_services_returns_written(self, mock_upsert_waypoint, *_mocks):
+        '''Tests that failed upserts are not reported as written'''
+        station = {"location": {"crs": "BTH", "name": "Bath"}}
+        services = [make_service("A1", "1201"), make_service("B2", "1215")]
+        mock_upsert_waypoint.side_effect = [10, None]
+
+        written = upsert_services(station, services, MagicMock(), MagicMock())
+
+        self.assertEqual(written, services[:1])
+        self.assertEqual(mock_upsert_waypoint.call_count, 2)
+
+
+class TestScreenServices(unittest.TestCase):
+    '''Class for testing the function screen_services'''
+
+    @patch('incremental_real.record_anomalies')
+    @patch('incremental_real.quarantine_services')
+    def test_screen_services_quarantines_invalid(self, mock_quarantine_services,
+                                                 mock_record_anomalies):
+        '''Tests that invalid services are quarantined and not returned to be written'''
+        station = {"location": {"crs": "BTH", "name": "Bath"}}
+        services = [make_service("A1", "1201"), make_service("B2", "12:15")]
+        conn = MagicMock()
+
+        valid = screen_services(station, services, conn)
+
+        self.assertEqual(valid, services[:1])
+        entries = mock_quarantine_services.call_args.args[1]
+        self.assertEqual([entry["service_uid"] for entry in entries], ["B2"])
+        mock_record_anomalies.assert_called_once_with(conn, [])
+
+
+class TestWriteChangedServices(unittest.TestCase):
+    '''Class for testing the function write_changed_services'''
+
+    @patch('incremental_real.upsert_services')
+    @patch('incremental_real.screen_services')
+    def test_set_aside_services_are_recorded(self, mock_screen_services,
+                                             mock_upsert_services):
+        '''Tests that set aside services are recorded, so they are not quarantined on
+        every poll, while services that failed to write are retried'''
+        station = {"location": {"crs": "BTH", "name": "Bath"}}
+        services = [make_service(uid, "1201") for uid in ("A1", "B2", "C3")]
+        mock_screen_services.return_value = services[:2]
+        mock_upsert_services.return_value = services[:1]
+        snapshot = {"run_date": "2024-07-21", "services": {}}
+
+        written, set_aside = write_changed_services(station, services, snapshot,
+                                                    MagicMock(), MagicMock())
+
+        self.assertEqual((written, set_aside), (1, 1))
+        self.assertEqual(sorted(snapshot["services"]),
+                         ["A1:BTH:2024-07-21", "C3:BTH:2024-07-21"])
+
+
+class TestPollOnce(unittest.TestCase):
+    '''Class for testing the function poll_once'''
+
+    @patch('incremental_real.get_session')
+    @patch('incremental_real.get_connection')
+    @patch('incremental_real.record_limiter_calls')
+    @patch('incremental_real.get_limiter')
+    @patch('incremental_real.get_remaining_quota', return_value=2)
+    @patch('incremental_real.poll_station', return_value=None)
+    def test_poll_once_stops_when_quota_spent(self, mock_poll_station, _mock_get_remaining_quota,
+                                              mock_get_limiter, mock_record_limiter_calls,
+                                              *_mocks):
+        '''Tests that a poll is capped at the remaining quota and records its calls'''
+        limiter = mock_get_limiter.return_value
+        limiter.quota_spent.side_effect = [False, False, True]
+
+        poll_once(["BTH", "BRI", "SWI", "RDG"], {"services": {}})
+
+        mock_get_limiter.assert_called_once_with(1, 2)
+        self.assertEqual(mock_poll_station.call_count, 2)
+        mock_record_limiter_calls.assert_called_once_with(limiter)
+
+    @patch('incremental_real.get_session')
+    @patch('incremental_real.get_connection')
+    @patch('incremental_real.record_limiter_calls')
+    @patch('incremental_real.get_limiter')
+    @patch('incremental_real.get_remaining_quota', return_value=None)
+    @patch('incremental_real.poll_station', side_effect=Exception("API error"))
+    def test_poll_once_records_calls_on_error(self, _mock_poll_station,
+                                              _mock_get_remaining_quota, mock_get_limiter,
+                                              mock_record_limiter_calls, mock_get_connection,
+                                              _mock_get_session):
+        '''Tests that the calls of a poll that fails are still recorded'''
+        limiter = mock_get_limiter.return_value
+        limiter.quota_spent.return_value = False
+
+        with self.assertRaises(Exception):
+            poll_once(["BTH"], {"services": {}})
+
+        mock_record_limiter_calls.assert_called_once_with(limiter)
+        mock_get_connection.return_value.close.assert_called_once()
@@ -1,14 +1,22 @@
 '''Test file for the python file load'''
 
-from unittest.mock import MagicMock, patch
+from collections import Counter
+from datetime import datetime
+from unittest.mock import MagicMock, call, patch
 import unittest
 
 from load_real import (
     get_id_if_exists,
+    group_station_facts,
     insert_or_get_waypoint,
     insert_or_get_entry,
-    import_to_database
+    import_station,
+    import_to_database,
+    parallel_import_batch,
+    partition_stations,
+    upsert_waypoint
 )
+from transform_real import ServiceRecord, normalise_stations
 
 
 class TestGetIdIfExists(unittest.TestCase):
@@ -91,14 +99,17 @@ class TestInsertOrGetEntry(unittest.TestCase):
         INSERT INTO {self.table_name} ({expected_columns})
         VALUES
         ({expected_num_of_values})
+        ON CONFLICT (name) DO NOTHING
         RETURNING {self.table_name}_id
         '''
         expected_values = ('TestName', 'active')
 
         assert result == 2
-        self.cur.execute.assert_called_once_with(
-            expected_query, expected_values)
-        assert self.conn.commit.call_count == 1
+        assert self.cur.execute.call_args_list == [
+            call('SAVEPOINT load_row'),
+            call(expected_query, expected_values),
+            call('RELEASE SAVEPOINT load_row')]
+        assert self.conn.commit.call_count == 0
         assert self.conn.rollback.call_count == 0
 
     @patch('load_real.get_id_if_exists')
@@ -106,7 +117,7 @@ class TestInsertOrGetEntry(unittest.TestCase):
         '''Test for case where the query is incorrect'''
         mock_get_id_if_exists.return_value = None
 
-        self.cur.execute.side_effect = Exception("Database error")
+        self.cur.execute.side_effect = [None, Exception("Database error"), None]
 
         result = insert_or_get_entry(
             self.table_name,
@@ -123,15 +134,57 @@ class TestInsertOrGetEntry(unittest.TestCase):
         INSERT INTO {self.table_name} ({expected_columns})
         VALUES
         ({expected_num_of_values})
+        ON CONFLICT (name) DO NOTHING
         RETURNING {self.table_name}_id
         '''
         expected_values = ('TestName', 'active')
 
         assert result is None
-        self.cur.execute.assert_called_once_with(
-            expected_query, expected_values)
+        assert self.cur.execute.call_args_list == [
+            call('SAVEPOINT load_row'),
+            call(expected_query, expected_values),
+            call('ROLLBACK TO SAVEPOINT load_row')]
         assert self.conn.commit.call_count == 0
-        assert self.conn.rollback.call_count == 1
+        assert self.conn.rollback.call_count == 0
+
+
+    @patch('load_real.get_id_if_exists')
+    def test_insert_or_get_entry_conflict(self, mock_get_id_if_exists):
+        '''Test for case where another loader inserts the same entry first'''
+        mock_get_id_if_exists.side_effect = [None, 5]
+        self.cur.fetchone.return_value = None
+
+        result = insert_or_get_entry(
+            self.table_name,
+            self.insert_values,
+            self.unique_data_conditions,
+            self.entry_name,
+            self.conn,
+            self.cur
+        )
+
+        assert result == 5
+        assert mock_get_id_if_exists.call_count == 2
+        self.cur.execute.assert_called_with('RELEASE SAVEPOINT load_row')
+
+    @patch('load_real.get_id_if_exists')
+    def test_insert_or_get_entry_conflict_missing(self, mock_get_id_if_exists):
+        '''Test for case where the insert conflicts but the entry is not found again'''
+        mock_get_id_if_exists.side_effect = [None, None]
+        self.cur.fetchone.return_value = None
+
+        with self.assertLogs(level='ERROR') as logs:
+            result = insert_or_get_entry(
+                self.table_name,
+                self.insert_values,
+                self.unique_data_conditions,
+                self.entry_name,
+                self.conn,
+                self.cur
+            )
+
+        assert result is None
+        assert 'conflicted but was not found' in logs.output[0]
 
 
 class TestImportToDatabase(unittest.TestCase):
@@ -139,26 +192,22 @@ class TestImportToDatabase(unittest.TestCase):
 
     def setUp(self):
         '''Set up variables to be used for every tests'''
-        self.stations = [
-            {
-                'location': {'crs': 'STN1', 'name': 'Station 1'},
-                'services': [
-                    {
-                        'id': 101,
-                        'operator': 'Op1',
-                        'locationDetail': {'detail': 'A', 'cancelReasonCode': 'C1'}
-                    }
-                ]
-            }
-        ]
+        self.service = ServiceRecord(service_uid='W101', run_date='2024-07-21',
+                                     atoc_code='GW', atoc_name='Operator',
+                                     booked_arrival='1200', realtime_arrival='1201',
+                                     cancel_code='C1', cancel_reason='a')
+        self.batch = normalise_stations([
+            {'location': {'crs': 'STN1', 'name': 'Station 1'}, 'services': [self.service]},
+            {'location': {'crs': 'STN2', 'name': 'Station 2'}, 'services': [self.service]}
+        ])
 
     @patch('load_real.get_connection')
     @patch('load_real.get_cursor')
     @patch('load_real.insert_or_get_station')
-    @patch('load_real.insert_or_get_operator')
-    @patch('load_real.insert_or_get_service')
+    @patch('load_real.insert_or_get_operator_by_code')
+    @patch('load_real.insert_or_get_service_by_uid')
     @patch('load_real.insert_or_get_waypoint')
-    @patch('load_real.insert_or_get_cancel_code')
+    @patch('load_real.insert_or_get_cancel_code_by_code')
     @patch('load_real.insert_or_get_cancellation')
     def test_import_to_database(self,
                                 mock_insert_or_get_cancellation,
@@ -169,39 +218,62 @@ class TestImportToDatabase(unittest.TestCase):
                                 mock_insert_or_get_station,
                                 mock_get_cursor,
                                 mock_get_connection):
-        '''Checks for base case with the functions called the expected amount of times'''
+        '''Checks each dimension is resolved once while every waypoint is loaded'''
         mock_conn = MagicMock()
         mock_cur = MagicMock()
 
         mock_get_connection.return_value = mock_conn
         mock_get_cursor.return_value = mock_cur
-        mock_insert_or_get_station.return_value = 1
+        mock_insert_or_get_station.side_effect = [1, 6]
         mock_insert_or_get_operator.return_value = 2
         mock_insert_or_get_service.return_value = 3
         mock_insert_or_get_waypoint.return_value = 4
         mock_insert_or_get_cancel_code.return_value = 5
         mock_insert_or_get_cancellation.return_value = None
 
-        import_to_database(self.stations)
+        import_to_database(self.batch)
 
         mock_get_connection.assert_called_once()
         mock_get_cursor.assert_called_once_with(mock_conn)
-        mock_insert_or_get_station.assert_called_once_with(
-            self.stations[0]['location'], mock_conn, mock_cur)
+        self.assertEqual(mock_insert_or_get_station.call_count, 2)
         mock_insert_or_get_operator.assert_called_once_with(
-            self.stations[0]['services'][0], mock_conn, mock_cur)
+            'GW', 'Operator', mock_conn, mock_cur)
         mock_insert_or_get_service.assert_called_once_with(
-            self.stations[0]['services'][0], 2, mock_conn, mock_cur)
-        mock_insert_or_get_waypoint.assert_called_once_with(
-            1, 3, self.stations[0]['services'][0], mock_conn, mock_cur)
+            'W101', 2, mock_conn, mock_cur)
         mock_insert_or_get_cancel_code.assert_called_once_with(
-            self.stations[0]['services'][0]['locationDetail'], mock_conn, mock_cur)
-        mock_insert_or_get_cancellation.assert_called_once_with(
+            'C1', 'a', mock_conn, mock_cur)
+        mock_insert_or_get_waypoint.assert_any_call(
+            1, 3, self.service, mock_conn, mock_cur)
+        mock_insert_or_get_waypoint.assert_any_call(
+            6, 3, self.service, mock_conn, mock_cur)
+        self.assertEqual(mock_insert_or_get_cancellation.call_count, 2)
+        mock_insert_or_get_cancellation.assert_called_with(
             5, 4, mock_conn, mock_cur)
 
         mock_cur.close.assert_called_once()
         mock_conn.close.assert_called_once()
 
+    @patch.dict('os.environ', {'LOAD_MODE': 'bulk'})
+    @patch('load_real.get_connection')
+    @patch('load_real.get_cursor')
+    @patch('load_real.bulk_load')
+    @patch('load_real.insert_or_get_waypoint')
+    def test_import_to_database_bulk(self, mock_insert_or_get_waypoint,
+                                     mock_bulk_load, mock_get_cursor, mock_get_connection):
+        '''Checks the bulk mode copies the whole batch instead of loading row by row'''
+        mock_conn = MagicMock()
+        mock_get_connection.return_value = mock_conn
+        mock_bulk_load.return_value = {'rows': 2, 'inserted': {}, 'seconds': 0.5}
+
+        import_to_database(self.batch)
+
+        batch, conn = mock_bulk_load.call_args[0]
+        self.assertEqual(conn, mock_conn)
+        self.assertEqual(batch['station_crs'].tolist(), ['STN1', 'STN2'])
+        mock_get_cursor.assert_called_once_with(mock_conn)
+        mock_insert_or_get_waypoint.assert_not_called()
+        mock_conn.close.assert_called_once()
+
 
 class TestInsertOrGetWaypoint(unittest.TestCase):
     '''Class for testing the function insert_or_get_waypoint'''
@@ -211,77 +283,236 @@ class TestInsertOrGetWaypoint(unittest.TestCase):
 
         self.station_id = 1
         self.service_id = 2
-        self.service_dict = {
-            "locationDetail": {
-                "gbttBookedArrival": "1230",
-                "realtimeArrival": "1235",
-                "gbttBookedDeparture": "1300",
-                "realtimeDeparture": "1305",
-                "gbttBookedArrivalNextDay": False,
-                "realtimeArrivalNextDay": False,
-                "gbttBookedDepartureNextDay": False,
-                "realtimeDepartureNextDay": False
-            },
-            "runDate": "2024-07-21"
-        }
+        self.service = ServiceRecord(
+            booked_arrival="1230",
+            realtime_arrival="1235",
+            booked_departure="1300",
+            realtime_departure="1305",
+            booked_arrival_next_day=False,
+            realtime_arrival_next_day=False,
+            booked_departure_next_day=False,
+            realtime_departure_next_day=False,
+            run_date="2024-07-21"
+        )
         self.conn = MagicMock()
         self.cur = MagicMock()
 
-    @patch('load_real.get_id_if_exists')
-    def test_insert_or_get_waypoint_existing(self, mock_get_id_if_exists):
+    def test_insert_or_get_waypoint_existing(self):
         '''Test for case if there exists a waypoint entry in the database'''
 
-        mock_get_id_if_exists.return_value = 1
+        self.cur.fetchone.return_value = (1,)
 
         result = insert_or_get_waypoint(
             self.station_id,
             self.service_id,
-            self.service_dict,
+            self.service,
             self.conn,
             self.cur
         )
 
         self.assertEqual(result, 1)
-        self.cur.execute.assert_not_called()
+        self.assertEqual(self.cur.execute.call_count, 3)
+        self.assertIn("ON CONFLICT (service_id, station_id, run_date) DO UPDATE",
+                      self.cur.execute.call_args_list[1].args[0])
         self.conn.commit.assert_not_called()
         self.conn.rollback.assert_not_called()
 
-    @patch('load_real.get_id_if_exists')
-    def test_insert_or_get_waypoint_insert(self, mock_get_id_if_exists):
+    def test_insert_or_get_waypoint_insert(self):
         '''Test for case if there is no same existing waypoint entry in the database'''
 
-        mock_get_id_if_exists.return_value = None
-
         self.cur.fetchone.return_value = (2,)
 
         result = insert_or_get_waypoint(
             self.station_id,
             self.service_id,
-            self.service_dict,
+            self.service,
             self.conn,
             self.cur
         )
 
         self.assertEqual(result, 2)
-        self.conn.commit.assert_called_once()
+        self.assertEqual(self.cur.execute.call_args_list[1].args[1],
+                         (datetime(2024, 7, 21), datetime(2024, 7, 21, 12, 30),
+                          datetime(2024, 7, 21, 12, 35), datetime(2024, 7, 21, 13, 0),
+                          datetime(2024, 7, 21, 13, 5), 2, 1))
+        self.cur.execute.assert_called_with('RELEASE SAVEPOINT load_row')
         self.conn.rollback.assert_not_called()
 
-    @patch('load_real.get_id_if_exists')
-    def test_insert_or_get_waypoint_error(self, mock_get_id_if_exists):
+    def test_insert_or_get_waypoint_error(self):
         '''Test for case if there is an exception when executing the query'''
-        mock_get_id_if_exists.return_value = None
-
-        self.cur.execute.side_effect = Exception
+        self.cur.execute.side_effect = [None, Exception, None]
 
         result = insert_or_get_waypoint(
             self.station_id,
             self.service_id,
-            self.service_dict,
+            self.service,
             self.conn,
             self.cur
         )
 
         self.assertIsNone(result)
 
+        self.cur.execute.assert_called_with('ROLLBACK TO SAVEPOINT load_row')
         self.conn.commit.assert_not_called()
-        self.conn.rollback.assert_called_once()
+        self.conn.rollback.assert_not_called()
+
+
+class TestUpsertWaypoint(unittest.TestCase):
+    '''Class for testing the function upsert_waypoint'''
+
+    def setUp(self):
+        '''Set up variables to be used for every tests'''
+        self.service = ServiceRecord(
+            booked_arrival="2355",
+            realtime_arrival="0005",
+            realtime_arrival_next_day=True,
+            run_date="2024-07-21"
+        )
+        self.conn = MagicMock()
+        self.cur = MagicMock()
+
+    def test_upsert_waypoint_updates_existing(self):
+        '''Test for case where the waypoint exists and its times are updated'''
+        self.cur.fetchone.return_value = (7,)
+
+        result = upsert_waypoint(1, 2, self.service, self.conn, self.cur)
+
+        self.assertEqual(result, 7)
+        self.assertEqual(self.cur.execute.call_count, 3)
+        values = self.cur.execute.call_args_list[1].args[1]
+        self.assertEqual(values[2], datetime(2024, 7, 22, 0, 5))
+
+    def test_upsert_waypoint_single_statement(self):
+        '''Test for case where one statement inserts or refreshes the waypoint'''
+        self.cur.fetchone.return_value = (8,)
+
+        result = upsert_waypoint(1, 2, self.service, self.conn, self.cur)
+
+        self.assertEqual(result, 8)
+        query = self.cur.execute.call_args_list[1].args[0]
+        self.assertIn("ON CONFLICT (service_id, station_id, run_date) DO UPDATE", query)
+        self.assertIn("RETURNING waypoint_id", query)
+        self.conn.commit.assert_not_called()
+
+
+class TestCommitCadence(unittest.TestCase):
+    '''Class for testing how often the loader commits'''
+
+    def setUp(self):
+        '''Set up a station of five valid services and a mock connection'''
+        self.station = {'location': {'crs': 'BTH', 'name': 'Bath Spa'}, 'services': [
+            ServiceRecord(service_uid=f'W10{index}', run_date='2024-07-21',
+                          atoc_code='GW', atoc_name='Operator',
+                          booked_arrival='1200', realtime_arrival='1201')
+            for index in range(5)]}
+        self.conn = MagicMock()
+        self.cur = MagicMock()
+
+    @patch('load_real.preload_dimensions')
+    @patch('load_real.insert_or_get_station', return_value=1)
+    @patch('load_real.insert_or_get_operator', return_value=2)
+    @patch('load_real.insert_or_get_service', return_value=3)
+    @patch('load_real.insert_or_get_waypoint', return_value=4)
+    def test_commit_once_per_station(self, *_mocks):
+        '''Tests a station is committed once by default'''
+        import_station(self.station, self.conn, self.cur)
+
+        self.conn.commit.assert_called_once()
+
+    @patch.dict('os.environ', {'LOAD_COMMIT_ROWS': '2'})
+    @patch('load_real.preload_dimensions')
+    @patch('load_real.insert_or_get_station', return_value=1)
+    @patch('load_real.insert_or_get_operator', return_value=2)
+    @patch('load_real.insert_or_get_service', return_value=3)
+    @patch('load_real.insert_or_get_waypoint', return_value=4)
+    def test_commit_every_n_rows(self, *_mocks):
+        '''Tests a station is committed every LOAD_COMMIT_ROWS waypoints and at its end'''
+        import_station(self.station, self.conn, self.cur)
+
+        self.assertEqual(self.conn.commit.call_count, 3)
+
+    @patch('load_real.preload_dimensions')
+    @patch('load_real.insert_or_get_station', return_value=1)
+    @patch('load_real.insert_or_get_operator', return_value=2)
+    @patch('load_real.insert_or_get_service', return_value=3)
+    @patch('load_real.insert_or_get_waypoint', side_effect=[4, None, 5, None, 6])
+    def test_import_station_counts_failures(self, *_mocks):
+        '''Tests the waypoints that failed to load are counted and the rest committed'''
+        _, failures = import_station(self.station, self.conn, self.cur)
+
+        self.assertEqual(failures, 2)
+        self.conn.commit.assert_called_once()
+
+
+class TestParallelLoad(unittest.TestCase):
+    '''Class for testing the parallel station loader'''
+
+    def setUp(self):
+        '''Set up a batch of three stations with 3, 2 and 1 services'''
+        self.batch = normalise_stations([
+            {'location': {'crs': crs, 'name': crs}, 'services': [
+                ServiceRecord(service_uid=f'{crs}{index}', run_date='2024-07-21',
+                              atoc_code='GW', atoc_name='Operator',
+                              booked_arrival='1200', realtime_arrival='1201')
+                for index in range(services)]}
+            for crs, services in [('AAA', 3), ('BBB', 2), ('CCC', 1)]])
+
+    def test_partition_stations(self):
+        '''Tests stations are split so workers get about the same waypoints'''
+        stations = group_station_facts(self.batch.facts)
+
+        partitions = partition_stations(stations, 2)
+
+        self.assertEqual([[len(facts) for facts in partition] for partition in partitions],
+                         [[3], [2, 1]])
+        self.assertEqual(len(partition_stations(stations, 5)), 3)
+
+    @patch('load_real.prepare_batch')
+    @patch('load_real.resolve_batch')
+    @patch('load_real.get_connection_pool')
+    @patch('load_real.insert_or_get_waypoint', return_value=4)
+    def test_parallel_import_batch(self, mock_insert_or_get_waypoint,
+                                   mock_get_connection_pool, mock_resolve_batch,
+                                   mock_prepare_batch):
+        '''Tests each worker loads its stations over its own pooled connection'''
+        mock_prepare_batch.return_value = (self.batch, Counter({'early_by_hours': 1}))
+        mock_resolve_batch.return_value = {
+            'stations': {'AAA': 1, 'BBB': 2, 'CCC': 3},
+            'services': dict.fromkeys(self.batch.services, 7),
+            'cancel_codes': {}}
+        pool = mock_get_connection_pool.return_value
+        pool.getconn.side_effect = [MagicMock(), MagicMock()]
+
+        counts, failed = parallel_import_batch(self.batch, MagicMock(), MagicMock(),
+                                               workers=2)
+
+        self.assertEqual(counts, Counter({'early_by_hours': 1}))
+        self.assertEqual(failed, set())
+        mock_get_connection_pool.assert_called_once_with(2)
+        self.assertEqual(pool.getconn.call_count, 2)
+        self.assertEqual(pool.putconn.call_count, 2)
+        pool.closeall.assert_called_once()
+        self.assertEqual(mock_insert_or_get_waypoint.call_count, 6)
+        self.assertEqual({call_args.args[0] for call_args
+                          in mock_insert_or_get_waypoint.call_args_list}, {1, 2, 3})
+
+    @patch('load_real.prepare_batch')
+    @patch('load_real.resolve_batch')
+    @patch('load_real.get_connection_pool')
+    @patch('load_real.insert_or_get_waypoint')
+    def test_parallel_import_batch_failed_stations(self, mock_insert_or_get_waypoint,
+                                                   mock_get_connection_pool,
+                                                   mock_resolve_batch, mock_prepare_batch):
+        '''Tests the stations with waypoints that failed to load are returned'''
+        mock_prepare_batch.return_value = (self.batch, Counter())
+        mock_resolve_batch.return_value = {
+            'stations': {'AAA': 1, 'BBB': 2, 'CCC': 3},
+            'services': dict.fromkeys(self.batch.services, 7),
+            'cancel_codes': {}}
+        mock_insert_or_get_waypoint.side_effect = lambda station_id, *_args: (
+            None if station_id == 2 else 4)
+        mock_get_connection_pool.return_value.getconn.side_effect = [MagicMock(), MagicMock()]
+
+        _, failed = parallel_import_batch(self.batch, MagicMock(), MagicMock(), workers=2)
+
+        self.assertEqual(failed, {'BBB'})
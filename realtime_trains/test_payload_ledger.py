@@ -0,0 +1,123 @@
+'''Test file for the python file payload_ledger'''
+
+from collections import Counter
+from unittest.mock import MagicMock, patch
+import unittest
+
+from load_real import import_payload, skip_loaded_payloads
+from payload_ledger import (
+    get_loaded_payloads,
+    get_payload_hash,
+    get_payload_key,
+    read_ledger,
+    record_payloads
+)
+from transform_real import ServiceRecord, normalise_stations, process_all_stations
+
+STATION = {'location': {'name': 'Bath Spa', 'crs': 'BTH'},
+           'services': [{'serviceUid': 'W1', 'serviceType': 'train', 'runDate': '2024-07-21',
+                         'locationDetail': {'realtimeArrival': '1200'}}]}
+
+
+class TestPayloadHash(unittest.TestCase):
+    '''Class for testing the payload hash'''
+
+    def test_hash_ignores_key_order(self):
+        '''Tests that the same content hashes the same however its keys are ordered'''
+        reordered = {'services': STATION['services'], 'location': {'crs': 'BTH',
+                                                                   'name': 'Bath Spa'}}
+
+        self.assertEqual(get_payload_hash(reordered), get_payload_hash(STATION))
+        self.assertEqual(get_payload_key(STATION), ('BTH', get_payload_hash(STATION)))
+
+    def test_hash_changes_with_content(self):
+        '''Tests that a changed time changes the hash'''
+        changed = {**STATION, 'services': [{**STATION['services'][0],
+                                            'locationDetail': {'realtimeArrival': '1201'}}]}
+
+        self.assertNotEqual(get_payload_hash(changed), get_payload_hash(STATION))
+
+
+class TestLedger(unittest.TestCase):
+    '''Class for testing reading and writing the ledger'''
+
+    def test_get_loaded_payloads(self):
+        '''Tests that loaded payloads are returned as (CRS, hash) keys'''
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.fetchall.return_value = [('BTH', 'abc')]
+
+        self.assertEqual(get_loaded_payloads(conn, 7), {('BTH', 'abc')})
+        self.assertEqual(cur.execute.call_args[0][1], (7,))
+
+    def test_read_ledger_failure(self):
+        '''Tests that every station is loaded when the ledger cannot be read'''
+        conn = MagicMock()
+        conn.cursor.side_effect = Exception("Database error")
+
+        self.assertEqual(read_ledger(conn), set())
+        conn.rollback.assert_called_once()
+
+    def test_record_payloads(self):
+        '''Tests that each payload is upserted and committed'''
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+
+        record_payloads(conn, [('BTH', 'abc'), ('BRI', 'def')])
+
+        self.assertEqual(cur.execute.call_count, 2)
+        conn.commit.assert_called_once()
+
+
+class TestSkipLoaded(unittest.TestCase):
+    '''Class for testing that transform and load skip loaded payloads'''
+
+    def test_process_all_stations_skips_loaded(self):
+        '''Tests that loaded payloads are not transformed and the rest keep their hash'''
+        other = {**STATION, 'location': {'name': 'Bristol', 'crs': 'BRI'}}
+
+        result = process_all_stations([STATION, other], loaded={get_payload_key(STATION)})
+
+        self.assertEqual([station['location']['crs'] for station in result], ['BRI'])
+        self.assertEqual(result[0]['payload_hash'], get_payload_hash(other))
+
+    def test_skip_loaded_payloads(self):
+        '''Tests that a batch drops the stations, facts and payloads already loaded'''
+        batch = process_all_stations([STATION], normalise=True, loaded=set())
+
+        self.assertEqual(skip_loaded_payloads(batch, set()), batch)
+        skipped = skip_loaded_payloads(batch, {get_payload_key(STATION)})
+        self.assertEqual((skipped.stations, skipped.facts, skipped.payloads), ({}, [], {}))
+
+    def test_batch_without_payloads(self):
+        '''Tests that a batch normalised from stations without hashes has no payloads'''
+        batch = normalise_stations([{'location': STATION['location'],
+                                     'services': [ServiceRecord(service_uid='W1')]}])
+
+        self.assertEqual(batch.payloads, {})
+
+    @patch('load_real.record_payloads')
+    @patch('load_real.import_station')
+    @patch('load_real.is_payload_loaded')
+    def test_import_payload(self, mock_is_payload_loaded, mock_import_station,
+                            mock_record_payloads):
+        '''Tests that a payload is only imported and recorded when it was not loaded before'''
+        conn, cur = MagicMock(), MagicMock()
+        mock_is_payload_loaded.side_effect = [True, False]
+
+        self.assertEqual(import_payload(STATION, conn, cur), "skipped")
+        mock_import_station.assert_not_called()
+
+        mock_import_station.return_value = (Counter(), 0)
+        self.assertEqual(import_payload(STATION, conn, cur), "loaded")
+        mock_import_station.assert_called_once()
+        mock_record_payloads.assert_called_once_with(conn, [get_payload_key(STATION)])
+
+    @patch('load_real.record_payloads')
+    @patch('load_real.import_station', return_value=(Counter(), 1))
+    @patch('load_real.is_payload_loaded', return_value=False)
+    def test_import_payload_with_failures(self, _mock_is_payload_loaded,
+                                          _mock_import_station, mock_record_payloads):
+        '''Tests that a payload with rows that failed to load is not recorded'''
+        self.assertEqual(import_payload(STATION, MagicMock(), MagicMock()), "failed")
+        mock_record_payloads.assert_not_called()
@@ -0,0 +1,205 @@
+'''Test file for the python file pipeline_real'''
+
+from collections import Counter
+from threading import Lock
+from time import sleep
+from unittest.mock import MagicMock, patch
+import unittest
+
+from payload_ledger import get_payload_key
+from pipeline_real import run_pipeline
+
+
+def make_station(crs: str) -> dict:
+    '''Creates a minimal raw station payload'''
+    return {'location': {'crs': crs, 'name': crs}, 'services': []}
+
+
+class TestRunPipeline(unittest.TestCase):
+    '''Class for testing the function run_pipeline'''
+
+    def setUp(self):
+        '''Set up a list of stations for every test'''
+        self.list_of_crs = [f'S{i:02}' for i in range(30)]
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_run_pipeline_loads_every_station(self, mock_import_station, mock_get_connection):
+        '''Tests that every fetched station is transformed and loaded on one connection,
+        after the ledger is read on another'''
+        stats = run_pipeline(self.list_of_crs, make_station,
+                             queue_depth=2, workers=4)
+
+        loaded = {call.args[0]['location']['crs']
+                  for call in mock_import_station.call_args_list}
+        self.assertEqual(loaded, set(self.list_of_crs))
+        self.assertEqual(stats['loaded'], 30)
+        self.assertEqual(mock_get_connection.call_count, 2)
+        self.assertEqual(mock_get_connection.return_value.close.call_count, 2)
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_run_pipeline_bounds_payloads_in_flight(self, mock_import_station,
+                                                    _mock_get_connection):
+        '''Tests that a slow load stage applies backpressure to the extract stage'''
+        lock = Lock()
+        counts = {'in_flight': 0, 'peak': 0}
+
+        def fetch(crs):
+            with lock:
+                counts['in_flight'] += 1
+                counts['peak'] = max(counts['peak'], counts['in_flight'])
+            return make_station(crs)
+
+        def slow_import(*_args):
+            sleep(0.005)
+            with lock:
+                counts['in_flight'] -= 1
+            return Counter(), 0
+
+        mock_import_station.side_effect = slow_import
+
+        run_pipeline(self.list_of_crs, fetch, queue_depth=2, workers=2)
+
+        self.assertLessEqual(counts['peak'], 2 + 2 * 2 + 2)
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_run_pipeline_counts_failures(self, mock_import_station, _mock_get_connection):
+        '''Tests that failed fetches and malformed stations are skipped'''
+        def fetch(crs):
+            if crs == 'S00':
+                return None
+            if crs == 'S01':
+                return {'services': []}
+            return make_station(crs)
+
+        stats = run_pipeline(self.list_of_crs, fetch,
+                             queue_depth=2, workers=2)
+
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(mock_import_station.call_count, 28)
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_run_pipeline_stops_when_load_fails(self, mock_import_station, _mock_get_connection):
+        '''Tests that a database failure stops the pipeline instead of deadlocking'''
+        mock_import_station.side_effect = Exception("Database error")
+        fetch = MagicMock(side_effect=make_station)
+
+        with self.assertRaises(Exception):
+            run_pipeline(self.list_of_crs, fetch, queue_depth=1, workers=1)
+
+        self.assertLess(fetch.call_count, len(self.list_of_crs))
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station')
+    @patch('pipeline_real.import_normalised_batch')
+    @patch('pipeline_real.get_load_mode', return_value='bulk')
+    def test_run_pipeline_loads_a_normalised_batch(self, _mock_get_load_mode,
+                                                   mock_import_normalised_batch,
+                                                   mock_import_station, _mock_get_connection):
+        '''Tests that with LOAD_MODE=bulk the stations are loaded as one normalised batch,
+        and stations with rows that failed to load are returned to be retried'''
+        mock_import_normalised_batch.return_value = (Counter({'missing times': 1}), {'S03'})
+
+        stats = run_pipeline(self.list_of_crs, make_station, queue_depth=2, workers=4)
+
+        mock_import_station.assert_not_called()
+        batch = mock_import_normalised_batch.call_args.args[0]
+        self.assertEqual(set(batch.stations), set(self.list_of_crs))
+        self.assertEqual(set(batch.payloads), set(self.list_of_crs))
+        self.assertEqual(stats['loaded'], 30)
+        self.assertEqual(stats['load_failed'], 1)
+        self.assertEqual(stats['failed_crs'], ['S03'])
+        self.assertEqual(stats['quarantined'], Counter({'missing times': 1}))
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    @patch('pipeline_real.process_station')
+    def test_run_pipeline_raises_when_transform_fails(self, mock_process_station,
+                                                      mock_import_station, _mock_get_connection):
+        '''Tests that an unexpected transform error is raised by run_pipeline'''
+        mock_process_station.side_effect = RuntimeError("Transform error")
+        fetch = MagicMock(side_effect=make_station)
+
+        with self.assertRaisesRegex(RuntimeError, "Transform error"):
+            run_pipeline(self.list_of_crs, fetch, queue_depth=1, workers=1)
+
+        mock_import_station.assert_not_called()
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_run_pipeline_raises_when_extract_fails(self, mock_import_station,
+                                                    _mock_get_connection):
+        '''Tests that an unexpected extract error is raised by run_pipeline'''
+        fetch = MagicMock(side_effect=RuntimeError("Extract error"))
+
+        with self.assertRaisesRegex(RuntimeError, "Extract error"):
+            run_pipeline(self.list_of_crs, fetch, queue_depth=1, workers=1)
+
+        mock_import_station.assert_not_called()
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    @patch('pipeline_real.get_api_fetch')
+    @patch('pipeline_real.plan_api_stations')
+    def test_run_pipeline_skips_stations_over_quota(self,
+                                                    mock_plan_api_stations,
+                                                    mock_get_api_fetch,
+                                                    mock_import_station,
+                                                    _mock_get_connection):
+        '''Tests that only planned stations are fetched, within the remaining calls'''
+        mock_plan_api_stations.return_value = (self.list_of_crs[:5], self.list_of_crs[5:], 5)
+        mock_get_api_fetch.return_value = (make_station, MagicMock())
+
+        stats = run_pipeline(self.list_of_crs, workers=2)
+
+        mock_get_api_fetch.assert_called_once_with(2, 5)
+        self.assertEqual(mock_import_station.call_count, 5)
+        self.assertEqual(stats['skipped_crs'], self.list_of_crs[5:])
+
+
+class TestPayloadLedger(unittest.TestCase):
+    '''Class for testing that unchanged stations are skipped'''
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.record_payloads')
+    @patch('pipeline_real.read_ledger')
+    @patch('pipeline_real.import_station', return_value=(Counter(), 0))
+    def test_unchanged_stations_are_skipped(self, mock_import_station, mock_read_ledger,
+                                            mock_record_payloads, _mock_get_connection):
+        '''Tests that stations with a loaded payload are neither transformed nor loaded,
+        and the payloads of loaded stations are recorded'''
+        list_of_crs = ['BTH', 'BRI', 'YRK']
+        mock_read_ledger.return_value = {get_payload_key(make_station('BRI'))}
+
+        stats = run_pipeline(list_of_crs, make_station, workers=1)
+
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(stats['loaded'], 2)
+        self.assertEqual([call.args[0]['location']['crs']
+                          for call in mock_import_station.call_args_list], ['BTH', 'YRK'])
+        self.assertEqual([call.args[1] for call in mock_record_payloads.call_args_list],
+                         [[get_payload_key(make_station('BTH'))],
+                          [get_payload_key(make_station('YRK'))]])
+
+    @patch('pipeline_real.get_connection')
+    @patch('pipeline_real.record_payloads')
+    @patch('pipeline_real.import_station')
+    def test_stations_with_failed_rows_are_not_recorded(self, mock_import_station,
+                                                        mock_record_payloads,
+                                                        _mock_get_connection):
+        '''Tests that the payload of a station with rows that failed to load is not
+        recorded, and the station is counted with the failed stations'''
+        mock_import_station.side_effect = lambda station, *_args: (
+            Counter(), 2 if station['location']['crs'] == 'BRI' else 0)
+
+        stats = run_pipeline(['BTH', 'BRI'], make_station, workers=1)
+
+        self.assertEqual(stats['loaded'], 2)
+        self.assertEqual(stats['load_failed'], 1)
+        self.assertEqual(stats['failed_crs'], ['BRI'])
+        self.assertEqual([call.args[1] for call in mock_record_payloads.call_args_list],
+                         [[get_payload_key(make_station('BTH'))]])
@@ -0,0 +1,185 @@
+'''Test file for the python file rate_limiter'''
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from unittest.mock import MagicMock, patch
+import unittest
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+from rate_limiter import MAX_BACKOFF, AdaptiveLimiter, RetryBudgetExceeded, TokenBucket
+
+
+def make_response(status_code: int, headers: dict | None = None) -> MagicMock:
+    '''Creates a mock response with the given status code'''
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+class TestTokenBucket(unittest.TestCase):
+    '''Class for testing the TokenBucket'''
+
+    def test_acquire_within_capacity(self):
+        '''Tests that tokens up to the capacity are handed out immediately'''
+        bucket = TokenBucket(rate=5)
+
+        self.assertTrue(all(bucket.acquire() for _ in range(5)))
+
+    def test_acquire_past_deadline(self):
+        '''Tests that acquire gives up when the deadline passes before a refill'''
+        bucket = TokenBucket(rate=0.1)
+        bucket.acquire()
+
+        self.assertFalse(bucket.acquire(deadline=monotonic() + 0.01))
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    '''Class for testing the AdaptiveLimiter'''
+
+    def setUp(self):
+        '''Set up a limiter with short backoffs for every test'''
+        self.limiter = AdaptiveLimiter(rate=1000, max_concurrency=4,
+                                       time_budget=5, base_backoff=0.001)
+
+    def test_call_retries_throttled_request(self):
+        '''Tests that a 429 is retried and counted as a throttle event'''
+        request = MagicMock(
+            side_effect=[make_response(429), make_response(200)])
+
+        response = self.limiter.call(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.call_count, 2)
+        report = self.limiter.report()
+        self.assertEqual(report["retries"], 1)
+        self.assertEqual(report["throttle_events"], 1)
+        self.assertEqual(report["requests"], 2)
+        self.assertEqual(report["final_concurrency"], 2)
+
+    def test_call_returns_last_response_after_max_retries(self):
+        '''Tests that the last server error is returned once retries run out'''
+        request = MagicMock(return_value=make_response(503))
+
+        response = self.limiter.call(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(request.call_count, 4)
+        self.assertEqual(self.limiter.report()["failures"], 1)
+
+    def test_call_raises_connection_errors(self):
+        '''Tests that the last connection error is raised once retries run out'''
+        request = MagicMock(side_effect=RequestsConnectionError("down"))
+
+        with self.assertRaises(RequestsConnectionError):
+            self.limiter.call(request)
+
+        self.assertEqual(request.call_count, 4)
+
+    def test_client_errors_are_not_retried(self):
+        '''Tests that a 404 is returned straight away'''
+        request = MagicMock(return_value=make_response(404))
+
+        response = self.limiter.call(request)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(request.call_count, 1)
+
+    def test_concurrency_grows_on_fast_successes(self):
+        '''Tests that concurrency recovers after a back off'''
+        self.limiter.call(MagicMock(
+            side_effect=[make_response(500), make_response(200)]))
+        self.assertEqual(self.limiter.concurrency, 2)
+
+        for _ in range(2):
+            self.limiter.call(MagicMock(return_value=make_response(200)))
+
+        self.assertEqual(self.limiter.concurrency, 3)
+
+    def test_call_stops_at_max_requests(self):
+        '''Tests that no request is made once the call quota is spent'''
+        limiter = AdaptiveLimiter(rate=1000, max_requests=2, base_backoff=0.001)
+        request = MagicMock(return_value=make_response(200))
+
+        limiter.call(request)
+        limiter.call(request)
+        with self.assertRaises(RetryBudgetExceeded):
+            limiter.call(request)
+
+        self.assertEqual(request.call_count, 2)
+
+    def test_slow_responses_back_off_gently_once_a_window(self):
+        '''Tests that a burst of slow successes takes one request off the concurrency
+        and leaves the rate alone'''
+        limiter = AdaptiveLimiter(rate=5, max_concurrency=8)
+
+        for _ in range(3):
+            limiter._on_success(2.5)  # pylint: disable=protected-access
+
+        report = limiter.report()
+        self.assertEqual(report["final_concurrency"], 7)
+        self.assertEqual(report["final_rate"], 5)
+        self.assertEqual(report["slow_events"], 1)
+        self.assertEqual(report["throttle_events"], 0)
+
+    def test_throttles_back_off_once_a_window(self):
+        '''Tests that a burst of 429s only halves the rate and concurrency once'''
+        limiter = AdaptiveLimiter(rate=8, max_concurrency=8)
+
+        for _ in range(3):
+            limiter._on_throttle()  # pylint: disable=protected-access
+
+        self.assertEqual(limiter.concurrency, 4)
+        self.assertEqual(limiter.bucket.rate, 4)
+        self.assertEqual(limiter.report()["throttle_events"], 1)
+
+    def test_first_attempt_made_after_budget(self):
+        '''Tests that the time budget stops retries but not first attempts'''
+        limiter = AdaptiveLimiter(rate=1000, time_budget=0, base_backoff=0.001)
+        request = MagicMock(side_effect=[make_response(200), make_response(503)])
+
+        self.assertEqual(limiter.call(request).status_code, 200)
+        self.assertEqual(limiter.call(request).status_code, 503)
+        self.assertEqual(request.call_count, 2)
+
+    def test_rate_never_grows_past_max_rate(self):
+        '''Tests that fast successes stop raising the rate at max_rate'''
+        limiter = AdaptiveLimiter(rate=2, max_concurrency=1, max_rate=2)
+
+        for _ in range(20):
+            limiter._on_success(0.1)  # pylint: disable=protected-access
+
+        self.assertEqual(limiter.bucket.rate, 2)
+
+    def test_concurrent_calls_stay_within_max_requests(self):
+        '''Tests that requests in flight together cannot all pass the quota check'''
+        limiter = AdaptiveLimiter(rate=1000, max_concurrency=8, max_requests=2)
+
+        def slow_request():
+            sleep(0.05)
+            return make_response(200)
+
+        request = MagicMock(side_effect=slow_request)
+
+        def call():
+            try:
+                limiter.call(request)
+            except RetryBudgetExceeded:
+                pass
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: call(), range(8)))
+
+        self.assertEqual(request.call_count, 2)
+        self.assertTrue(limiter.quota_spent())
+
+    @patch('rate_limiter.sleep')
+    def test_retry_after_is_capped(self, mock_sleep):
+        '''Tests that a long Retry-After header waits no longer than MAX_BACKOFF'''
+        limiter = AdaptiveLimiter(rate=1000, time_budget=None, max_retries=1)
+        request = MagicMock(side_effect=[make_response(429, {"Retry-After": "3600"}),
+                                         make_response(200)])
+
+        self.assertEqual(limiter.call(request).status_code, 200)
+        mock_sleep.assert_called_once_with(MAX_BACKOFF)
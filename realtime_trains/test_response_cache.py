@@ -0,0 +1,72 @@
+'''Test file for the python file response_cache'''
+
+from tempfile import TemporaryDirectory
+from os import path
+from unittest.mock import patch
+import unittest
+
+from response_cache import (
+    save_response,
+    load_response,
+    get_cached_crs,
+    load_cached_stations,
+    get_object_path
+)
+
+
+class TestResponseCache(unittest.TestCase):
+    '''Class for testing the response cache'''
+
+    def setUp(self):
+        '''Set up a temporary cache directory for every test'''
+        self.temp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache_dir = self.temp_dir.name
+        self.station = {'location': {'crs': 'BTH'}, 'services': [{'a': 1}]}
+
+    def tearDown(self):
+        '''Remove the temporary cache directory'''
+        self.temp_dir.cleanup()
+
+    def test_save_and_load_response(self):
+        '''Tests a saved payload is loaded back unchanged'''
+        digest = save_response('BTH', '2024-07-21',
+                               self.station, self.cache_dir)
+
+        self.assertTrue(path.exists(get_object_path(self.cache_dir, digest)))
+        self.assertEqual(load_response('BTH', '2024-07-21', self.cache_dir),
+                         self.station)
+
+    def test_identical_payloads_share_an_object(self):
+        '''Tests that the cache is content addressed'''
+        first = save_response('BTH', '2024-07-21',
+                              self.station, self.cache_dir)
+        second = save_response('YRK', '2024-07-22',
+                               dict(reversed(self.station.items())), self.cache_dir)
+
+        self.assertEqual(first, second)
+
+    def test_load_missing_response(self):
+        '''Tests that a missing station or date returns None'''
+        save_response('BTH', '2024-07-21', self.station, self.cache_dir)
+
+        self.assertIsNone(load_response(
+            'BTH', '2024-07-22', self.cache_dir))
+        self.assertIsNone(load_response(
+            'YRK', '2024-07-21', self.cache_dir))
+
+    def test_load_cached_stations(self):
+        '''Tests that a run date is replayed in CRS order'''
+        save_response('YRK', '2024-07-21', {'crs': 'YRK'}, self.cache_dir)
+        save_response('BTH', '2024-07-21', {'crs': 'BTH'}, self.cache_dir)
+
+        self.assertEqual(get_cached_crs('2024-07-21', self.cache_dir),
+                         ['BTH', 'YRK'])
+        self.assertEqual(load_cached_stations('2024-07-21', self.cache_dir),
+                         [{'crs': 'BTH'}, {'crs': 'YRK'}])
+
+    def test_cache_disabled(self):
+        '''Tests that nothing is cached without a cache directory'''
+        with patch.dict('response_cache.ENV', {}, clear=True):
+            self.assertIsNone(save_response('BTH', '2024-07-21', self.station))
+            self.assertIsNone(load_response('BTH', '2024-07-21'))
+            self.assertEqual(load_cached_stations('2024-07-21'), [])
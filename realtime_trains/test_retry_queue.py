@@ -0,0 +1,152 @@
+'''Test file for the python file retry_queue'''
+
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+import unittest
+
+from retry_queue import (
+    enqueue_failures,
+    get_due_retries,
+    log_queue_age,
+    drain_retry_queue
+)
+
+
+class TestRetryQueue(unittest.TestCase):
+    '''Class for testing the retry queue queries'''
+
+    def setUp(self):
+        '''Set up a mock connection and cursor for every test'''
+        self.conn = MagicMock()
+        self.cur = MagicMock()
+
+    @patch('retry_queue.get_cursor')
+    def test_enqueue_failures(self, mock_get_cursor):
+        '''Tests that every unit is upserted in one transaction'''
+        mock_get_cursor.return_value.__enter__.return_value = self.cur
+
+        enqueue_failures(self.conn, [('BTH', '2024-07-21'),
+                                     ('YRK', '2024-07-21')])
+
+        self.assertEqual(self.cur.execute.call_count, 2)
+        self.assertIn('ON CONFLICT', self.cur.execute.call_args.args[0])
+        self.conn.commit.assert_called_once()
+
+    @patch('retry_queue.get_cursor')
+    def test_enqueue_no_failures(self, mock_get_cursor):
+        '''Tests that nothing is written when there are no failures'''
+        enqueue_failures(self.conn, [])
+
+        mock_get_cursor.assert_not_called()
+        self.conn.commit.assert_not_called()
+
+    @patch('retry_queue.get_cursor')
+    def test_get_due_retries(self, mock_get_cursor):
+        '''Tests that due units are returned with ISO dates'''
+        mock_get_cursor.return_value.__enter__.return_value = self.cur
+        self.cur.fetchall.return_value = [('BTH', date(2024, 7, 21))]
+
+        self.assertEqual(get_due_retries(self.conn),
+                         [('BTH', '2024-07-21')])
+
+    @patch('retry_queue.get_oldest_retry_age')
+    def test_log_queue_age_alerts(self, mock_get_oldest_retry_age):
+        '''Tests that an old queue item is logged as an error'''
+        mock_get_oldest_retry_age.return_value = timedelta(hours=72)
+
+        with self.assertLogs(level='ERROR'):
+            log_queue_age(self.conn)
+
+
+class TestDrainRetryQueue(unittest.TestCase):
+    '''Class for testing the function drain_retry_queue'''
+
+    @patch('retry_queue.get_connection')
+    @patch('retry_queue.get_cursor')
+    @patch('retry_queue.get_session')
+    @patch('retry_queue.log_queue_age')
+    @patch('retry_queue.record_limiter_calls')
+    @patch('retry_queue.get_due_retries')
+    @patch('retry_queue.fetch_station')
+    @patch('retry_queue.import_payload', return_value='loaded')
+    @patch('retry_queue.remove_retry')
+    @patch('retry_queue.enqueue_failures')
+    def test_drain_retry_queue(self,
+                               mock_enqueue_failures,
+                               mock_remove_retry,
+                               mock_import_payload,
+                               mock_fetch_station,
+                               mock_get_due_retries,
+                               *_mocks):
+        '''Tests that recovered units are removed and failed units backed off'''
+        mock_get_due_retries.return_value = [('BTH', '2024-07-20'),
+                                             ('YRK', '2024-07-20')]
+        mock_fetch_station.side_effect = [{'data': {'location': {}}},
+                                          {'data': None}]
+
+        stats = drain_retry_queue()
+
+        self.assertEqual(stats, {'retried': 2, 'recovered': 1})
+        mock_import_payload.assert_called_once()
+        mock_remove_retry.assert_called_once()
+        self.assertEqual(mock_remove_retry.call_args.args[1],
+                         ('BTH', '2024-07-20'))
+        self.assertEqual(mock_enqueue_failures.call_args.args[1],
+                         [('YRK', '2024-07-20')])
+
+    @patch('retry_queue.get_connection')
+    @patch('retry_queue.get_cursor')
+    @patch('retry_queue.get_session')
+    @patch('retry_queue.log_queue_age')
+    @patch('retry_queue.record_limiter_calls')
+    @patch('retry_queue.get_due_retries', return_value=[('BTH', '2024-07-20')])
+    @patch('retry_queue.fetch_station', return_value={'data': {'location': {}}})
+    @patch('retry_queue.import_payload', return_value='failed')
+    @patch('retry_queue.remove_retry')
+    @patch('retry_queue.enqueue_failures')
+    def test_failed_rows_stay_queued(self, mock_enqueue_failures, mock_remove_retry, *_mocks):
+        '''Tests that a station with rows that failed to load is backed off, not removed'''
+        stats = drain_retry_queue()
+
+        self.assertEqual(stats, {'retried': 1, 'recovered': 0})
+        mock_remove_retry.assert_not_called()
+        self.assertEqual(mock_enqueue_failures.call_args.args[1], [('BTH', '2024-07-20')])
+
+    @patch('retry_queue.get_connection')
+    @patch('retry_queue.get_cursor')
+    @patch('retry_queue.get_session')
+    @patch('retry_queue.log_queue_age')
+    @patch('retry_queue.record_limiter_calls')
+    @patch('retry_queue.get_limiter')
+    @patch('retry_queue.get_due_retries')
+    @patch('retry_queue.fetch_station', return_value={'data': None})
+    @patch('retry_queue.enqueue_failures')
+    def test_drain_stops_when_quota_spent(self, mock_enqueue_failures, mock_fetch_station,
+                                          mock_get_due_retries, mock_get_limiter, *_mocks):
+        '''Tests that no attempts are used up once the quota is spent'''
+        mock_get_due_retries.return_value = [('BTH', '2024-07-20'), ('YRK', '2024-07-20')]
+        mock_get_limiter.return_value.quota_spent.side_effect = [False, True]
+
+        stats = drain_retry_queue()
+
+        self.assertEqual(stats, {'retried': 0, 'recovered': 0})
+        mock_fetch_station.assert_called_once()
+        mock_enqueue_failures.assert_not_called()
+
+    @patch('retry_queue.get_connection')
+    @patch('retry_queue.get_cursor')
+    @patch('retry_queue.get_session')
+    @patch('retry_queue.record_limiter_calls')
+    @patch('retry_queue.get_limiter')
+    @patch('retry_queue.get_due_retries', return_value=[('BTH', '2024-07-20')])
+    @patch('retry_queue.fetch_station', side_effect=Exception('Database error'))
+    def test_calls_recorded_when_drain_fails(self, _mock_fetch_station, _mock_get_due_retries,
+                                             mock_get_limiter, mock_record_limiter_calls,
+                                             *_mocks):
+        '''Tests that the calls made are recorded even when an error escapes the drain'''
+        mock_get_limiter.return_value.quota_spent.return_value = False
+
+        with self.assertRaises(Exception):
+            drain_retry_queue()
+
+        mock_record_limiter_calls.assert_called_once_with(mock_get_limiter.return_value)
@@ -0,0 +1,52 @@
+'''Test file for the python file snapshot_real'''
+
+from os import path
+from tempfile import TemporaryDirectory
+import gzip
+import json
+import unittest
+
+from snapshot_real import (
+    write_snapshot,
+    read_index,
+    iter_snapshot,
+    read_station
+)
+
+
+def make_station(crs: str) -> dict:
+    '''Creates a station payload with a few services'''
+    return {'location': {'crs': crs, 'name': f'{crs} Station'},
+            'services': [{'serviceUid': f'{crs}{i}'} for i in range(3)]}
+
+
+class TestSnapshot(unittest.TestCase):
+    '''Class for testing the NDJSON snapshot format'''
+
+    def setUp(self):
+        '''Write a snapshot of three stations for every test'''
+        self.temp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.filename = path.join(self.temp_dir.name, 'data.ndjson.gz')
+        self.stations = [make_station(crs) for crs in ['BTH', 'EDB', 'YRK']]
+        write_snapshot(iter(self.stations), self.filename)
+
+    def tearDown(self):
+        '''Remove the temporary snapshot'''
+        self.temp_dir.cleanup()
+
+    def test_snapshot_is_gzipped_ndjson(self):
+        '''Tests the whole file reads as one gzip stream of JSON lines'''
+        with gzip.open(self.filename, 'rt', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], self.stations)
+
+    def test_iter_snapshot(self):
+        '''Tests that stations stream back in order'''
+        self.assertEqual(list(iter_snapshot(self.filename)), self.stations)
+
+    def test_read_station(self):
+        '''Tests that a single station is read through the index'''
+        self.assertEqual(list(read_index(self.filename)), ['BTH', 'EDB', 'YRK'])
+        self.assertEqual(read_station(self.filename, 'EDB'), self.stations[1])
+        self.assertIsNone(read_station(self.filename, 'LDS'))
@@ -0,0 +1,72 @@
+'''Test file for the python file station_registry'''
+
+from unittest.mock import MagicMock, patch
+import unittest
+
+from station_registry import (
+    refresh,
+    add_station,
+    get_station_id,
+    get_station_by_id,
+    get_all_crs,
+    clear
+)
+
+
+class TestStationRegistry(unittest.TestCase):
+    '''Class for testing the station registry'''
+
+    def setUp(self):
+        '''Set up an empty registry and a mock connection for every test'''
+        clear()
+        self.conn = MagicMock()
+        self.cur = self.conn.cursor.return_value.__enter__.return_value
+        self.cur.fetchall.return_value = [(1, 'BTH', 'Bath Spa'),
+                                          (2, 'YRK', 'York')]
+
+    def tearDown(self):
+        '''Empty the registry for other tests'''
+        clear()
+
+    def test_lookups(self):
+        '''Tests stations can be looked up by CRS and by id'''
+        refresh(self.conn)
+
+        self.assertEqual(get_station_id('YRK'), 2)
+        self.assertEqual(get_station_by_id(1)['station_crs'], 'BTH')
+        self.assertIsNone(get_station_id('LDS'))
+        self.assertEqual(get_all_crs(), ['BTH', 'YRK'])
+
+    def test_refresh_within_ttl(self):
+        '''Tests the database is only queried once within the TTL'''
+        refresh(self.conn)
+        refresh(self.conn)
+
+        self.cur.execute.assert_called_once()
+
+    @patch('station_registry.get_ttl', return_value=0)
+    def test_refresh_unchanged_version(self, _mock_get_ttl):
+        '''Tests an expired registry is kept when the station table has not changed'''
+        refresh(self.conn)
+        self.cur.fetchone.return_value = (2, 2)
+
+        refresh(self.conn)
+
+        self.assertEqual(self.cur.fetchall.call_count, 1)
+
+    @patch('station_registry.get_ttl', return_value=0)
+    def test_refresh_changed_version(self, _mock_get_ttl):
+        '''Tests an expired registry is reloaded when stations were added'''
+        refresh(self.conn)
+        self.cur.fetchone.return_value = (3, 3)
+
+        refresh(self.conn)
+
+        self.assertEqual(self.cur.fetchall.call_count, 2)
+
+    def test_add_station(self):
+        '''Tests an inserted station can be looked up straight away'''
+        add_station(5, 'LDS', 'Leeds')
+
+        self.assertEqual(get_station_id('LDS'), 5)
+        self.assertEqual(get_station_by_id(5)['station_name'], 'Leeds')
@@ -0,0 +1,112 @@
+'''Test file for the python file stream_real'''
+
+from unittest.mock import MagicMock, patch
+import json
+import unittest
+
+from extract_real import get_data_from_api
+from stream_real import (
+    iter_events,
+    project_service,
+    parse_station_stream,
+    compare_parsers
+)
+
+STATION = {
+    'location': {'name': 'Bath Spa', 'crs': 'BTH', 'tiploc': 'BTHSPA'},
+    'filter': None,
+    'services': [
+        {'serviceUid': 'W12345', 'runDate': '2024-07-21', 'atocCode': 'GW',
+         'atocName': 'Great Western Railway', 'serviceType': 'train',
+         'trainIdentity': '1A23', 'isPassenger': True,
+         'locationDetail': {'gbttBookedArrival': '0930', 'realtimeArrival': '0932',
+                            'realtimeArrivalActual': True, 'platform': '2',
+                            'origin': [{'description': 'Bristol Temple Meads'}]}},
+        {'serviceUid': 'B67890', 'runDate': '2024-07-21', 'serviceType': 'bus',
+         'locationDetail': {'gbttBookedDeparture': '1015',
+                            'cancelReasonLongText': 'a fault — on the train'}}
+    ]
+}
+
+
+def to_chunks(body: bytes, size: int) -> list[bytes]:
+    '''Splits a body into chunks of the given size'''
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class TestStreamParse(unittest.TestCase):
+    '''Class for testing the incremental parser'''
+
+    def setUp(self):
+        '''Encode the station response for every test'''
+        self.body = json.dumps(STATION, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def test_matches_full_parse(self):
+        '''Tests that any chunk size gives the projection of a full parse'''
+        expected = {'location': {'name': 'Bath Spa', 'crs': 'BTH'},
+                    'services': [project_service(service)
+                                 for service in STATION['services']]}
+
+        for size in [1, 3, 7, 64, len(self.body)]:
+            self.assertEqual(parse_station_stream(to_chunks(self.body, size)), expected)
+
+    def test_projection_drops_unused_fields(self):
+        '''Tests that only the loaded fields of a service are kept'''
+        service = project_service(STATION['services'][0])
+
+        self.assertNotIn('trainIdentity', service)
+        self.assertNotIn('platform', service['locationDetail'])
+        self.assertEqual(service['locationDetail']['realtimeArrival'], '0932')
+
+    def test_no_services(self):
+        '''Tests a station whose services are null'''
+        body = b'{"location": {"name": "Bath Spa", "crs": "BTH"}, "services": null}'
+
+        self.assertEqual(parse_station_stream(to_chunks(body, 5)),
+                         {'location': {'name': 'Bath Spa', 'crs': 'BTH'},
+                          'services': []})
+
+    def test_empty_object(self):
+        '''Tests that a response without a location gives no station'''
+        self.assertEqual(list(iter_events([b' { } '])), [])
+        self.assertIsNone(parse_station_stream([b'{}']))
+
+    def test_truncated_body(self):
+        '''Tests that a truncated response raises a ValueError'''
+        with self.assertRaises(ValueError):
+            parse_station_stream(to_chunks(self.body[:-40], 16))
+
+    def test_numbers_across_chunks(self):
+        '''Tests that a number split across chunks is not cut short'''
+        self.assertEqual(list(iter_events([b'{"a": 12', b'34}'])),
+                         [('field', 'a', 1234)])
+
+    def test_compare_parsers(self):
+        '''Tests that the benchmark counts services for both parsers'''
+        results = compare_parsers(self.body)
+
+        self.assertEqual(results['services'], 2)
+        self.assertTrue(results['matches'])
+
+
+class TestStreamedRequest(unittest.TestCase):
+    '''Class for testing the streamed path of get_data_from_api'''
+
+    @patch('extract_real.get')
+    def test_get_data_from_api_stream(self, mock_get):
+        '''Tests that a streamed request is parsed from its content chunks'''
+        body = json.dumps(STATION).encode('utf-8')
+        mock_session = MagicMock()
+        response = mock_session.get.return_value
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter(to_chunks(body, 100))
+
+        result = get_data_from_api("http://example.com", "user", "pass",
+                                   mock_session, stream=True)
+
+        mock_session.get.assert_called_once_with(
+            "http://example.com", timeout=10, stream=True)
+        response.json.assert_not_called()
+        mock_get.assert_not_called()
+        self.assertEqual(len(result['services']), 2)
+        self.assertEqual(result['location'], {'name': 'Bath Spa', 'crs': 'BTH'})
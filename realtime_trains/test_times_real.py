@@ -0,0 +1,81 @@
+'''Test file for the python file times_real'''
+
+from datetime import datetime
+import unittest
+
+from load_real import get_waypoint_times
+from times_real import parse_hhmm, resolve_times
+from transform_real import ServiceRecord
+
+
+def make_service(**fields) -> ServiceRecord:
+    '''Creates a service on 21 July 2024 with the given fields'''
+    return ServiceRecord(run_date="2024-07-21", service_uid="W1", **fields)
+
+
+class TestParseHHMM(unittest.TestCase):
+    '''Class for testing the function parse_hhmm'''
+
+    def test_parse_hhmm(self):
+        '''Tests that times are converted and bad times are flagged'''
+        minutes, missing, malformed = parse_hhmm(
+            ["0000", "2359", None, "", "123", "12a4", "2460", "12345"])
+
+        self.assertEqual(minutes[:2].tolist(), [0, 1439])
+        self.assertEqual(missing.tolist(),
+                         [False, False, True, True, False, False, False, False])
+        self.assertEqual(malformed.tolist(),
+                         [False, False, False, False, True, True, True, True])
+
+
+class TestResolveTimes(unittest.TestCase):
+    '''Class for testing the function resolve_times'''
+
+    def setUp(self):
+        '''Set up services covering next day, missing and cancelled times'''
+        self.services = [
+            make_service(booked_arrival="2355", realtime_arrival="0005",
+                         realtime_arrival_next_day=True,
+                         booked_departure="2357", realtime_departure="0007",
+                         realtime_departure_next_day=True),
+            make_service(booked_departure="0600", realtime_departure="0558"),
+            make_service(booked_arrival="1200", cancel_code="M8"),
+            make_service(booked_arrival="0100", booked_arrival_next_day=True,
+                         realtime_arrival="0104", realtime_arrival_next_day=True)
+        ]
+
+    def test_matches_row_by_row(self):
+        '''Tests that batch timestamps equal those parsed row by row in the loader'''
+        expected = [get_waypoint_times(service) for service in self.services]
+
+        resolve_times(self.services)
+
+        self.assertTrue(all(service.times is not None for service in self.services))
+        self.assertEqual([get_waypoint_times(service) for service in self.services],
+                         expected)
+
+    def test_delays(self):
+        '''Tests that delays are in minutes, and None when a time is missing'''
+        resolve_times(self.services)
+
+        self.assertEqual(self.services[0].times.arrival_delay, 10)
+        self.assertEqual(self.services[1].times.departure_delay, -2)
+        self.assertIsNone(self.services[1].times.arrival_delay)
+        self.assertIsNone(self.services[2].times.actual_arrival)
+        self.assertEqual(self.services[3].times.actual_arrival, datetime(2024, 7, 22, 1, 4))
+
+    def test_malformed_services_are_left_unresolved(self):
+        '''Tests that services with bad times fall back to the row by row path'''
+        services = [make_service(booked_arrival="12:3"),
+                    ServiceRecord(run_date="21/07/2024", booked_arrival="1200"),
+                    make_service(booked_arrival="1200")]
+
+        resolve_times(services)
+
+        self.assertIsNone(services[0].times)
+        self.assertIsNone(services[1].times)
+        self.assertEqual(services[2].times.run_date, datetime(2024, 7, 21))
+
+    def test_empty_batch(self):
+        '''Tests that an empty batch is a no-op'''
+        resolve_times([])
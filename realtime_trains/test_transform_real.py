@@ -2,59 +2,97 @@
 
 '''Test file for the python file transform'''
 
+from datetime import datetime
+import pickle
 from unittest.mock import patch
 
 import pytest
 from transform_real import (
-    filter_keys,
+    LOCATION_DETAIL_RECORD_FIELDS,
+    SERVICE_RECORD_FIELDS,
+    ServiceRecord,
+    get_transform_workers,
+    normalise_stations,
+    project,
     service_matches_criteria,
     process_station,
-    process_all_stations
+    process_all_stations,
+    process_stations_in_parallel,
+    station_to_rtt
 )
 
-
-class TestFilterKeys:
-    '''Class for testing the function filter_keys'''
+RTT_SERVICE = {
+    'serviceUid': 'W12345',
+    'runDate': '2024-07-21',
+    'atocCode': 'GW',
+    'atocName': 'Great Western Railway',
+    'serviceType': 'train',
+    'isPassenger': 'remove',
+    'locationDetail': {
+        'gbttBookedArrival': '2359',
+        'realtimeArrival': '0002',
+        'realtimeArrivalNextDay': True,
+        'realtimeArrivalActual': True,
+        'cancelReasonCode': 'M8',
+        'cancelReasonLongText': 'a fault on this train',
+        'origin': 'remove'}
+}
+
+
+class TestProject:
+    '''Class for testing the function project'''
     test_dict = {
         "a": 1,
         "b": 2,
-        "c": 3,
-        "d": 4,
-        "e": 5
+        "c": 3
     }
 
-    @pytest.mark.parametrize("keys, expected", [
-        (["a"], {
-            "b": 2,
-            "c": 3,
-            "d": 4,
-            "e": 5
-        }),
-        (["b", "c"], {
-            "a": 1,
-            "d": 4,
-            "e": 5
-        }),
-        ([], {
-            "a": 1,
-            "b": 2,
-            "c": 3,
-            "d": 4,
-            "e": 5
-        }),
-        (["adsadasdasdsasda", "adsadsadas"], {
-            "a": 1,
-            "b": 2,
-            "c": 3,
-            "d": 4,
-            "e": 5
-        })
+    @pytest.mark.parametrize("fields, expected", [
+        (["a"], {"a": 1}),
+        (["b", "c"], {"b": 2, "c": 3}),
+        ([], {}),
+        (["a", "adsadasdasdsasda"], {"a": 1})
     ])
-    def test_filters_keys(self, keys, expected):
-        '''Test filtering dictionary function with expected output'''
-        assert filter_keys(keys, self.test_dict.copy()) == expected
+    def test_project(self, fields, expected):
+        '''Test projecting a dictionary onto fields with expected output'''
+        assert project(self.test_dict, fields) == expected
         with pytest.raises(TypeError):
-            filter_keys(keys, [])
+            project([], fields)
+
+
+class TestServiceRecord:
+    '''Class for testing the ServiceRecord'''
+
+    def test_from_rtt(self):
+        '''Tests that only the loaded fields are kept'''
+        record = ServiceRecord.from_rtt(RTT_SERVICE)
+
+        assert record.service_uid == 'W12345'
+        assert record.atoc_code == 'GW'
+        assert record.realtime_arrival == '0002'
+        assert record.realtime_arrival_next_day is True
+        assert record.booked_departure is None
+        assert record.cancel_reason == 'a fault on this train'
+        assert record.is_cancelled()
+        assert not hasattr(record, '__dict__')
+
+    def test_to_rtt_round_trip(self):
+        '''Tests that a record converts back to the loaded fields of the service'''
+        service = ServiceRecord.from_rtt(RTT_SERVICE).to_rtt()
+
+        assert 'isPassenger' not in service
+        assert 'origin' not in service['locationDetail']
+        assert ServiceRecord.from_rtt(service) == ServiceRecord.from_rtt(RTT_SERVICE)
+
+    def test_fields_match_slots(self):
+        '''Tests that every RTT field mapping has a slot to go to'''
+        assert set(ServiceRecord.__slots__) == {*SERVICE_RECORD_FIELDS,
+                                                *LOCATION_DETAIL_RECORD_FIELDS, 'times'}
+
+    def test_from_rtt_wrong_type(self):
+        '''Tests that a service that is not a dictionary is rejected'''
+        with pytest.raises(TypeError):
+            ServiceRecord.from_rtt([])
 
 
 class TestServiceMatchesCriteria:
@@ -88,61 +126,56 @@ class TestProcessStation():
         '''Tests base case for processing station'''
         station_input = {
             'location': {'name': 'Test Station',
-                         'code': 'TS',
+                         'crs': 'TST',
                          'tiploc': 'remove',
                          'country': 'remove'},
+            'filter': None,
             'services': [
-                {'id': 1,
-                 'serviceType': 'train',
-                 'isPassenger': 'remove',
-                 'locationDetail': {
-                     'detail1': 'value1', 'origin': 'remove'}},
-                {'id': 2,
-                 'serviceType': 'bus',
-                 'isPassenger': 'remove',
-                 'locationDetail': {
-                     'detail2': 'value2', 'origin': 'remove'}}
+                RTT_SERVICE,
+                {**RTT_SERVICE, 'serviceUid': 'B1', 'serviceType': 'bus'}
             ]
         }
 
         processed_station = {
-            'location': {'name': 'Test Station', 'code': 'TS'},
-            'services': [
-                {'id': 1,
-                 'serviceType': 'train',
-                 'locationDetail': {
-                     'detail1': 'value1'}}
-            ]
+            'location': {'name': 'Test Station', 'crs': 'TST'},
+            'services': [ServiceRecord.from_rtt(RTT_SERVICE)]
         }
 
-        result = process_station(station_input)
+        result = process_station(station_input, resolve=False)
 
         assert result == processed_station
 
+    def test_process_station_resolves_times(self):
+        '''Tests that timestamps are resolved, with next day arrivals on the following day'''
+        station_input = {'location': {'name': 'Test Station', 'crs': 'TST'},
+                         'services': [RTT_SERVICE]}
+
+        times = process_station(station_input)['services'][0].times
+
+        assert times.booked_arrival == datetime(2024, 7, 21, 23, 59)
+        assert times.actual_arrival == datetime(2024, 7, 22, 0, 2)
+        assert times.arrival_delay == 3
+
     def test_process_station_no_services_match(self):
         '''Tests case for when no services matches criteria'''
 
         station_input = {
             'location': {'name': 'Test Station',
-                         'code': 'TS',
+                         'crs': 'TST',
                          'tiploc': 'remove',
                          'country': 'remove'},
             'services': [
-                {'id': 1,
+                {'serviceUid': 'B1',
                  'serviceType': 'bus',
-                 'isPassenger': 'remove',
-                 'locationDetail': {
-                     'detail1': 'value1', 'origin': 'remove'}},
-                {'id': 2,
+                 'locationDetail': {'gbttBookedArrival': '1000'}},
+                {'serviceUid': 'B2',
                  'serviceType': 'bus',
-                 'isPassenger': 'remove',
-                 'locationDetail': {
-                     'detail2': 'value2', 'origin': 'remove'}}
+                 'locationDetail': {'gbttBookedArrival': '1100'}}
             ]
         }
 
         processed_station = {
-            'location': {'name': 'Test Station', 'code': 'TS'},
+            'location': {'name': 'Test Station', 'crs': 'TST'},
             'services': [
             ]
         }
@@ -156,15 +189,14 @@ class TestProcessStation():
 
         station_input = {
             'location': {'name': 'Test Station',
-                         'code': 'TS',
+                         'crs': 'TST',
                          'tiploc': 'remove',
                          'country': 'remove'},
-            'services': [
-            ]
+            'services': None
         }
 
         processed_station = {
-            'location': {'name': 'Test Station', 'code': 'TS'},
+            'location': {'name': 'Test Station', 'crs': 'TST'},
             'services': [
             ]
         }
@@ -173,6 +205,13 @@ class TestProcessStation():
 
         assert result == processed_station
 
+    def test_station_to_rtt(self):
+        '''Tests that a processed station can be written as JSON and processed again'''
+        station = process_station({'location': {'name': 'Test Station', 'crs': 'TST'},
+                                   'services': [RTT_SERVICE]})
+
+        assert process_station(station_to_rtt(station)) == station
+
 
 class TestProcessAllStations():
     '''Class for testing the function process_all_stations'''
@@ -189,7 +228,7 @@ class TestProcessAllStations():
             {'location': {'name': 'Station 2'}, 'services': []}
         ]
 
-        mock_process_station.side_effect = lambda station: station
+        mock_process_station.side_effect = lambda station, resolve=True: station
 
         result = process_all_stations(stations_data)
 
@@ -207,3 +246,78 @@ class TestProcessAllStations():
             process_all_stations(stations_data)
 
         assert mock_process_station.call_count == 0
+
+
+class TestParallelTransform():
+    '''Class for testing the process pool transform'''
+
+    stations = [{'location': {'name': f'Station {index}', 'crs': f'S{index:02}'},
+                 'services': [RTT_SERVICE, {**RTT_SERVICE, 'serviceUid': f'X{index}'}]}
+                for index in range(6)]
+
+    def test_transform_workers_default(self, monkeypatch):
+        '''Tests that the transform is serial unless TRANSFORM_WORKERS is set'''
+        monkeypatch.delenv('TRANSFORM_WORKERS', raising=False)
+        assert get_transform_workers() == 1
+
+        monkeypatch.setenv('TRANSFORM_WORKERS', '4')
+        assert get_transform_workers() == 4
+
+    def test_parallel_matches_serial(self):
+        '''Tests that the process pool returns the same stations in the same order'''
+        serial = process_all_stations(self.stations, workers=1)
+
+        assert process_stations_in_parallel(self.stations, 2) == serial
+        assert serial[0]['services'][0].times is not None
+
+    @patch('transform_real.PARALLEL_MIN_STATIONS', 4)
+    @patch('transform_real.process_stations_in_parallel')
+    def test_parallel_above_threshold(self, mock_parallel):
+        '''Tests that only days with enough stations use the process pool'''
+        mock_parallel.return_value = []
+
+        process_all_stations(self.stations[:3], workers=2)
+        assert mock_parallel.call_count == 0
+
+        process_all_stations(self.stations, workers=2)
+        mock_parallel.assert_called_once_with(self.stations, 2)
+
+    def test_record_pickles_as_values(self):
+        '''Tests that a record survives pickling through its tuple of values'''
+        record = ServiceRecord.from_rtt(RTT_SERVICE)
+
+        assert pickle.loads(pickle.dumps(record)) == record
+        assert ServiceRecord.from_values(record.to_values()) == record
+
+
+class TestNormaliseStations():
+    '''Class for testing the function normalise_stations'''
+
+    def test_dimensions_are_deduplicated(self):
+        '''Tests that repeated operators, services and cancel codes are held once'''
+        late = {**RTT_SERVICE, 'serviceUid': 'W99999', 'locationDetail': {}}
+        stations = process_all_stations([
+            {'location': {'name': 'Bath Spa', 'crs': 'BTH'}, 'services': [RTT_SERVICE, late]},
+            {'location': {'name': 'Bristol', 'crs': 'BRI'}, 'services': [RTT_SERVICE]}
+        ])
+
+        batch = normalise_stations(stations)
+
+        assert batch.stations == {'BTH': {'name': 'Bath Spa', 'crs': 'BTH'},
+                                  'BRI': {'name': 'Bristol', 'crs': 'BRI'}}
+        assert batch.operators == {'GW': 'Great Western Railway'}
+        assert batch.services == {'W12345': 'GW', 'W99999': 'GW'}
+        assert batch.cancel_codes == {'M8': 'a fault on this train'}
+        assert [(fact.station_crs, fact.service_uid, fact.cancel_code)
+                for fact in batch.facts] == [('BTH', 'W12345', 'M8'),
+                                             ('BTH', 'W99999', None),
+                                             ('BRI', 'W12345', 'M8')]
+        assert batch.facts[1].service is stations[0]['services'][1]
+
+    def test_process_all_stations_normalise(self):
+        '''Tests that process_all_stations can return a normalised batch'''
+        stations = [{'location': {'name': 'Bath Spa', 'crs': 'BTH'}, 'services': [RTT_SERVICE]}]
+
+        batch = process_all_stations(stations, normalise=True)
+
+        assert batch == normalise_stations(process_all_stations(stations))
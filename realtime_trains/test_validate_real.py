@@ -0,0 +1,125 @@
+'''Test file for the python file validate_real'''
+
+from unittest.mock import MagicMock, patch
+import unittest
+
+from load_real import import_station
+from transform_real import ServiceRecord, normalise_stations
+from validate_real import (
+    compile_schema,
+    get_reason_counts,
+    quarantine_services,
+    split_invalid,
+    validate_batch,
+    validate_station
+)
+
+
+def make_service(**fields) -> ServiceRecord:
+    '''Creates a valid service, with any fields replaced by those given'''
+    return ServiceRecord(**{"run_date": "2024-07-21", "service_uid": "W1",
+                            "atoc_code": "GW", "atoc_name": "Great Western Railway",
+                            "booked_arrival": "1200", "realtime_arrival": "1202",
+                            **fields})
+
+
+class TestSplitInvalid(unittest.TestCase):
+    '''Class for testing the compiled checks'''
+
+    def test_every_reason_is_found(self):
+        '''Tests that each invalid service is paired with all the checks it fails'''
+        services = [
+            make_service(),
+            make_service(booked_arrival="12a0"),
+            make_service(run_date="2024-13-40", atoc_code="G"),
+            make_service(realtime_arrival=None),
+            make_service(cancel_code="M8"),
+            make_service(service_uid=None, atoc_name=None)
+        ]
+
+        valid, quarantined = split_invalid(services)
+
+        self.assertEqual(valid, [0])
+        self.assertEqual(quarantined, [
+            (1, ["booked_arrival_malformed"]),
+            (2, ["run_date_malformed", "atoc_code_length"]),
+            (3, ["no_actual_time"]),
+            (4, ["cancel_reason_missing"]),
+            (5, ["service_uid_missing", "atoc_name_missing"])
+        ])
+
+    def test_custom_schema(self):
+        '''Tests that a schema is compiled into checks named after its fields'''
+        checks = compile_schema({"service_uid": {"type": "text", "length": 5}}, {})
+
+        valid, quarantined = split_invalid([make_service(), make_service(service_uid="W1234")],
+                                           checks)
+
+        self.assertEqual(valid, [1])
+        self.assertEqual(quarantined, [(0, ["service_uid_length"])])
+
+    def test_no_services(self):
+        '''Tests that an empty batch has nothing to quarantine'''
+        self.assertEqual(split_invalid([]), ([], []))
+
+
+class TestValidate(unittest.TestCase):
+    '''Class for testing validation of stations and batches'''
+
+    def setUp(self):
+        '''Set up a station with one valid and one invalid service'''
+        self.station = {"location": {"name": "Bath Spa", "crs": "BTH"},
+                        "services": [make_service(),
+                                     make_service(service_uid="W2", atoc_code="XC",
+                                                  realtime_arrival="2500")]}
+
+    def test_validate_station(self):
+        '''Tests that invalid services are removed and given quarantine entries'''
+        station, entries = validate_station(self.station)
+
+        self.assertEqual(station["services"], [self.station["services"][0]])
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["station_crs"], "BTH")
+        self.assertEqual(entries[0]["service_uid"], "W2")
+        self.assertEqual(entries[0]["reasons"], ["realtime_arrival_malformed"])
+        self.assertEqual(entries[0]["record"]["locationDetail"]["realtimeArrival"], "2500")
+
+    def test_validate_batch(self):
+        '''Tests that dimensions only used by invalid services are dropped from a batch'''
+        batch, entries = validate_batch(normalise_stations([self.station]))
+
+        self.assertEqual([fact.service_uid for fact in batch.facts], ["W1"])
+        self.assertEqual(batch.operators, {"GW": "Great Western Railway"})
+        self.assertEqual(batch.services, {"W1": "GW"})
+        self.assertEqual(get_reason_counts(entries), {"realtime_arrival_malformed": 1})
+
+    def test_quarantine_services(self):
+        '''Tests that each entry is inserted into the quarantine table'''
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        _, entries = validate_station(self.station)
+
+        quarantine_services(conn, entries)
+
+        self.assertEqual(cur.execute.call_count, 1)
+        self.assertEqual(cur.execute.call_args[0][1][:4],
+                         ("BTH", "W2", "2024-07-21", ["realtime_arrival_malformed"]))
+        conn.commit.assert_called_once()
+
+    @patch('load_real.insert_or_get_cancellation')
+    @patch('load_real.insert_or_get_waypoint')
+    @patch('load_real.insert_or_get_service')
+    @patch('load_real.insert_or_get_operator')
+    @patch('load_real.insert_or_get_station')
+    def test_import_station_skips_invalid(self, mock_station, mock_operator, mock_service,
+                                          mock_waypoint, mock_cancellation):
+        '''Tests that the loader only sees valid services and returns the reason counts'''
+        counts, failures = import_station(self.station, MagicMock(), MagicMock())
+
+        self.assertEqual(counts, {"realtime_arrival_malformed": 1})
+        self.assertEqual(failures, 0)
+        mock_station.assert_called_once()
+        mock_operator.assert_called_once()
+        mock_service.assert_called_once()
+        self.assertEqual(mock_waypoint.call_args[0][2], self.station["services"][0])
+        mock_cancellation.assert_not_called()
@@ -1,47 +1,132 @@
 '''Transforms and cleans data from RealTime Trains API'''
 
+from os import environ as ENV
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import NamedTuple
 import logging
 from dotenv import load_dotenv
 
-from extract_real import (save_data_to_file,
-                          get_api_data_of_all_stations)
-
-LOCATION_REMOVE_KEYS = [
-    'tiploc',
-    'country',
-    'system'
-]
-SERVICE_REMOVE_KEYS = [
-    "trainIdentity",
-    "runningIdentity",
-    "isPassenger"
-]
-SERVICE_LOC_DETAILS_REMOVE_KEYS = [
-    'realtimeActivated',
-    'origin',
-    'destination',
-    'isCall',
-    'isPublicCall',
-    'platform',
-    'platformConfirmed',
-    'platformChanged'
-]
+from extract_real import get_cached_or_api_data
+from snapshot_real import write_snapshot
+from times_real import resolve_times
+from payload_ledger import get_payload_key
+from stream_real import (LOCATION_DETAIL_RECORD_FIELDS, LOCATION_FIELDS,
+                         SERVICE_RECORD_FIELDS, project)
+
 SERVICE_CRITERIA = {
     "serviceType": "train"
 }
+TRANSFORM_WORKERS = 1
+PARALLEL_MIN_STATIONS = 200
+SHARDS_PER_WORKER = 4
+FORKED_STATIONS = []
+
+
+class WaypointFact(NamedTuple):
+    '''A service calling at a station, referring to the batch's dimension tables by key'''
+    station_crs: str
+    service_uid: str
+    cancel_code: str | None
+    service: "ServiceRecord"
+
+
+class NormalisedBatch(NamedTuple):
+    '''A transformed day with each station, operator, service and cancel code held once.
+    Stations map CRS to location, operators ATOC code to name, services UID to ATOC code
+    and cancel codes to their reason. The first value seen for a key is kept.
+    Payloads map CRS to the hash of the raw payload each station came from, if known.'''
+    stations: dict[str, dict]
+    operators: dict[str | None, str | None]
+    services: dict[str, str | None]
+    cancel_codes: dict[str, str | None]
+    facts: list[WaypointFact]
+    payloads: dict[str, str]
+
+
+class ServiceRecord:  # pylint: disable=too-many-instance-attributes
+    '''A service calling at a station, holding only the fields the loader reads.
+    Fields RTT does not send are None. The times slot holds the WaypointTimes resolved
+    by resolve_times, or None before they are resolved.'''
+    __slots__ = ("run_date", "service_uid", "atoc_code", "atoc_name",
+                 "booked_arrival", "booked_arrival_next_day",
+                 "realtime_arrival", "realtime_arrival_next_day", "realtime_arrival_actual",
+                 "booked_departure", "booked_departure_next_day",
+                 "realtime_departure", "realtime_departure_next_day",
+                 "realtime_departure_actual",
+                 "cancel_code", "cancel_reason", "times")
+
+    def __init__(self, **fields):
+        self.run_date = fields.get("run_date")
+        self.service_uid = fields.get("service_uid")
+        self.atoc_code = fields.get("atoc_code")
+        self.atoc_name = fields.get("atoc_name")
+        self.booked_arrival = fields.get("booked_arrival")
+        self.booked_arrival_next_day = fields.get("booked_arrival_next_day")
+        self.realtime_arrival = fields.get("realtime_arrival")
+        self.realtime_arrival_next_day = fields.get("realtime_arrival_next_day")
+        self.realtime_arrival_actual = fields.get("realtime_arrival_actual")
+        self.booked_departure = fields.get("booked_departure")
+        self.booked_departure_next_day = fields.get("booked_departure_next_day")
+        self.realtime_departure = fields.get("realtime_departure")
+        self.realtime_departure_next_day = fields.get("realtime_departure_next_day")
+        self.realtime_departure_actual = fields.get("realtime_departure_actual")
+        self.cancel_code = fields.get("cancel_code")
+        self.cancel_reason = fields.get("cancel_reason")
+        self.times = fields.get("times")
+
+    @classmethod
+    def from_rtt(cls, service: dict) -> "ServiceRecord":
+        '''Projects a service from the RTT API onto a record'''
+        if not isinstance(service, dict):
+            raise TypeError(
+                f"Transform: Expected dictionary item but got {type(service)}")
 
+        location_detail = service.get("locationDetail") or {}
+        return cls(**{field: service.get(key)
+                      for field, key in SERVICE_RECORD_FIELDS.items()},
+                   **{field: location_detail.get(key)
+                      for field, key in LOCATION_DETAIL_RECORD_FIELDS.items()})
 
-def filter_keys(keys_to_remove: list, a_dict: dict) -> dict:
-    '''Removes keys that can exist in a dictionary'''
+    def to_rtt(self) -> dict:
+        '''Returns the record in the shape of an RTT service, such as for a JSON snapshot.
+        Records are only made for services that match SERVICE_CRITERIA, so it is restored.'''
+        service = {**SERVICE_CRITERIA,
+                   **{key: getattr(self, field)
+                      for field, key in SERVICE_RECORD_FIELDS.items()
+                      if getattr(self, field) is not None}}
+        service["locationDetail"] = {key: getattr(self, field)
+                                     for field, key in LOCATION_DETAIL_RECORD_FIELDS.items()
+                                     if getattr(self, field) is not None}
+        return service
 
-    if not isinstance(a_dict, dict):
-        raise TypeError(
-            f"Transform: Expected dictionary item but got {type(a_dict)}")
+    def to_values(self) -> tuple:
+        '''Returns the record's fields as a tuple in slot order'''
+        return tuple(getattr(self, field) for field in self.__slots__)
 
-    for key in keys_to_remove:
-        a_dict.pop(key, None)
+    @classmethod
+    def from_values(cls, values: tuple) -> "ServiceRecord":
+        '''Rebuilds a record from the tuple returned by to_values'''
+        record = cls.__new__(cls)
+        for field, value in zip(cls.__slots__, values):
+            setattr(record, field, value)
+        return record
 
-    return a_dict
+    def __reduce__(self):
+        return ServiceRecord.from_values, (self.to_values(),)
+
+    def is_cancelled(self) -> bool:
+        '''Returns whether the service was cancelled at the station'''
+        return self.cancel_code is not None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ServiceRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field)
+                   for field in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"ServiceRecord({self.service_uid!r}, {self.run_date!r})"
 
 
 def service_matches_criteria(service: dict, criteria: dict) -> bool:
@@ -52,23 +137,18 @@ def service_matches_criteria(service: dict, criteria: dict) -> bool:
     return True
 
 
-def process_station(station: dict) -> dict:
-    '''Processes a single station by removing specified keys and 
-    filtering services based on multiple criteria.'''
-
-    station = filter_keys(["filter"], station)
-    station["location"] = filter_keys(
-        LOCATION_REMOVE_KEYS, station["location"])
+def process_station(station: dict, resolve: bool = True) -> dict:
+    '''Processes a single station by keeping only its name and CRS, and
+    projecting the services that match the criteria onto records.
+    Their timestamps are resolved as one batch unless resolve is False.'''
 
-    processed_services = []
-    for service in station["services"]:
-        if service_matches_criteria(service, SERVICE_CRITERIA):
-            service = filter_keys(SERVICE_REMOVE_KEYS, service)
-            service["locationDetail"] = filter_keys(
-                SERVICE_LOC_DETAILS_REMOVE_KEYS, service["locationDetail"])
-            processed_services.append(service)
-
-    station["services"] = processed_services
+    services = [ServiceRecord.from_rtt(service)
+                for service in station["services"] or []
+                if service_matches_criteria(service, SERVICE_CRITERIA)]
+    if resolve:
+        resolve_times(services)
+    station = {"location": project(station["location"], LOCATION_FIELDS),
+               "services": services}
 
     logging.info("Transformation finished for station: %s",
                  station['location']['name'])
@@ -76,24 +156,137 @@ def process_station(station: dict) -> dict:
     return station
 
 
-def process_all_stations(stations_data: list[dict]) -> list[dict]:
-    '''Processes all station by filtering services and unnecessary keys'''
+def station_to_rtt(station: dict) -> dict:
+    '''Returns a transformed station with its records in the shape of RTT services'''
+    return {"location": station["location"],
+            "services": [service.to_rtt() for service in station["services"]]}
+
+
+def get_transform_workers() -> int:
+    '''Returns the number of processes used to transform a day, set with TRANSFORM_WORKERS'''
+    return max(1, int(ENV.get("TRANSFORM_WORKERS", TRANSFORM_WORKERS)))
+
+
+def process_shard(stations_data: list[dict]) -> list[dict]:
+    '''Processes a contiguous shard of stations and resolves their timestamps together'''
+    processed = [process_station(station, resolve=False) for station in stations_data]
+    resolve_times([service for station in processed for service in station["services"]])
+    return processed
+
+
+def process_forked_shard(bounds: tuple[int, int]) -> list[dict]:
+    '''Processes the stations between two indexes of the list inherited from the parent'''
+    start, end = bounds
+    return process_shard(FORKED_STATIONS[start:end])
+
+
+def process_stations_in_parallel(stations_data: list[dict], workers: int) -> list[dict]:
+    '''Transforms stations across a process pool in contiguous shards, keeping their order.
+    Forked workers read the stations from the parent's memory instead of having them
+    pickled, and records are sent back as plain tuples.'''
+    size = -(-len(stations_data) // (workers * SHARDS_PER_WORKER))
+    bounds = [(start, min(start + size, len(stations_data)))
+              for start in range(0, len(stations_data), size)]
+
+    if "fork" not in get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shards = executor.map(process_shard,
+                                  [stations_data[start:end] for start, end in bounds])
+            return [station for shard in shards for station in shard]
+
+    FORKED_STATIONS[:] = stations_data
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=get_context("fork")) as executor:
+            shards = executor.map(process_forked_shard, bounds)
+            return [station for shard in shards for station in shard]
+    finally:
+        FORKED_STATIONS.clear()
+
+
+def normalise_facts(stations: dict[str, dict], facts: list[WaypointFact],
+                    payloads: dict[str, str] | None = None) -> NormalisedBatch:
+    '''Builds the deduplicated operator, service and cancel code tables of a list of facts'''
+    batch = NormalisedBatch(stations, {}, {}, {}, facts, payloads or {})
+    for fact in facts:
+        service = fact.service
+        batch.operators.setdefault(service.atoc_code, service.atoc_name)
+        batch.services.setdefault(service.service_uid, service.atoc_code)
+        if service.is_cancelled():
+            batch.cancel_codes.setdefault(service.cancel_code, service.cancel_reason)
+    return batch
+
+
+def normalise_stations(stations: list[dict]) -> NormalisedBatch:
+    '''Splits transformed stations into deduplicated dimension tables and a list of facts'''
+    locations = {}
+    facts = []
+    payloads = {}
+    for station in stations:
+        crs = station["location"]["crs"]
+        locations.setdefault(crs, station["location"])
+        facts.extend(WaypointFact(crs, service.service_uid, service.cancel_code, service)
+                     for service in station["services"])
+        if "payload_hash" in station:
+            payloads[crs] = station["payload_hash"]
+    return normalise_facts(locations, facts, payloads)
+
+
+def skip_loaded_stations(stations_data: list[dict],
+                         loaded: set[tuple[str, str]]) -> tuple[list[dict], list[str]]:
+    '''Returns the stations whose payload is not in the set of loaded payloads,
+    with the hash of each'''
+    keys = [get_payload_key(station) for station in stations_data]
+    pending = [(station, key[1]) for station, key in zip(stations_data, keys)
+               if key not in loaded]
+    logging.info("Transform: Skipped %s stations whose payload was already loaded.",
+                 len(stations_data) - len(pending))
+    return [station for station, _ in pending], [payload_hash for _, payload_hash in pending]
+
+
+def process_all_stations(stations_data: list[dict], workers: int | None = None,
+                         normalise: bool = False,
+                         loaded: set[tuple[str, str]] | None = None
+                         ) -> list[dict] | NormalisedBatch:
+    '''Processes all stations by filtering services and projecting them onto records,
+    then resolves the timestamps of the whole day's services at once.
+    With more than one worker, days of at least PARALLEL_MIN_STATIONS stations are
+    transformed across a process pool, each shard's timestamps resolved together.
+    With normalise set, returns a NormalisedBatch instead of a list of stations.
+    Given the (CRS, hash) keys of loaded payloads, stations whose payload is among them
+    are skipped, and the others keep their payload hash for the loader to record.'''
     logging.info("Transforming data...")
 
     if not isinstance(stations_data, list):
         raise TypeError(f"Transform: Expected list item but got {
                         type(stations_data)}")
 
-    for station in stations_data:
-        station = process_station(station)
+    payload_hashes = None
+    if loaded is not None:
+        stations_data, payload_hashes = skip_loaded_stations(stations_data, loaded)
+
+    workers = workers or get_transform_workers()
+    if workers > 1 and len(stations_data) >= PARALLEL_MIN_STATIONS:
+        processed = process_stations_in_parallel(stations_data, workers)
+    else:
+        processed = process_shard(stations_data)
+    if payload_hashes is not None:
+        for station, payload_hash in zip(processed, payload_hashes):
+            station["payload_hash"] = payload_hash
     logging.info("Transformation finished.")
-    return stations_data
+    if normalise:
+        batch = normalise_stations(processed)
+        logging.info("Transform: Normalised %s waypoints into %s stations, %s operators, "
+                     "%s services and %s cancel codes.", len(batch.facts), len(batch.stations),
+                     len(batch.operators), len(batch.services), len(batch.cancel_codes))
+        return batch
+    return processed
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s - %(levelname)s - %(message)s")
     load_dotenv()
-    data = get_api_data_of_all_stations()
+    data = get_cached_or_api_data()
     modified_data = process_all_stations(data)
-    save_data_to_file(modified_data, "modifiedv5.json")
+    write_snapshot(map(station_to_rtt, modified_data), "modified.ndjson.gz")
@@ -0,0 +1,157 @@
+'''Validates transformed services in bulk against a declarative schema before load,
+quarantining the services the database would reject with the reasons why'''
+
+from collections import Counter
+from operator import attrgetter
+from typing import Callable
+import json
+import logging
+
+import numpy as np
+from psycopg2.extensions import connection as DBConnection
+
+from times_real import parse_hhmm, parse_run_dates
+from transform_real import NormalisedBatch, ServiceRecord, normalise_facts
+
+VALIDATION_SCHEMA = {
+    "service_uid": {"type": "text", "required": True},
+    "run_date": {"type": "date", "required": True},
+    "atoc_code": {"type": "text", "required": True, "length": 2},
+    "atoc_name": {"type": "text", "required": True},
+    "booked_arrival": {"type": "hhmm"},
+    "realtime_arrival": {"type": "hhmm"},
+    "booked_departure": {"type": "hhmm"},
+    "realtime_departure": {"type": "hhmm"},
+    "cancel_code": {"type": "text", "length": 2}
+}
+RECORD_RULES = {
+    "no_actual_time": {"any_of": ["realtime_arrival", "realtime_departure"]},
+    "cancel_reason_missing": {"requires": ["cancel_code", "cancel_reason"]}
+}
+
+Check = Callable[[dict[str, np.ndarray]], np.ndarray]
+
+
+def compile_field(field: str, rules: dict) -> list[tuple[str, Check]]:
+    '''Returns the checks of a field as (reason, check) pairs. Each check takes the text
+    columns of a batch and returns a mask of the services that fail it.'''
+    checks = []
+    if rules.get("required"):
+        checks.append((f"{field}_missing", lambda columns: columns[field] == ""))
+    if "length" in rules:
+        checks.append((f"{field}_length", lambda columns: (columns[field] != "") & (
+            np.char.str_len(columns[field]) != rules["length"])))
+    if rules.get("type") == "hhmm":
+        checks.append((f"{field}_malformed",
+                       lambda columns: parse_hhmm(columns[field])[2]))
+    if rules.get("type") == "date":
+        checks.append((f"{field}_malformed", lambda columns: (columns[field] != "") & np.isnat(
+            parse_run_dates(np.where(columns[field] == "", "NaT", columns[field])))))
+    return checks
+
+
+def compile_rule(reason: str, rule: dict) -> tuple[str, Check]:
+    '''Returns the check of a rule across fields: "any_of" needs one of the fields to be
+    present, and "requires" needs the second field whenever the first is present'''
+    if "any_of" in rule:
+        return reason, lambda columns: np.logical_and.reduce(
+            [columns[field] == "" for field in rule["any_of"]])
+    present, required = rule["requires"]
+    return reason, lambda columns: (columns[present] != "") & (columns[required] == "")
+
+
+def compile_schema(schema: dict = None, record_rules: dict = None) -> list[tuple[str, Check]]:
+    '''Compiles a schema of field rules and rules across fields into a list of checks'''
+    schema = VALIDATION_SCHEMA if schema is None else schema
+    record_rules = RECORD_RULES if record_rules is None else record_rules
+    checks = [check for field, rules in schema.items()
+              for check in compile_field(field, rules)]
+    return checks + [compile_rule(reason, rule) for reason, rule in record_rules.items()]
+
+
+CHECKS = compile_schema()
+
+
+def get_text_columns(services: list[ServiceRecord]) -> dict[str, np.ndarray]:
+    '''Returns each field of the services as a string column, empty where it is missing'''
+    return {field: np.array([value or "" for value in map(attrgetter(field), services)],
+                            dtype=str)
+            for field in ServiceRecord.__slots__ if field != "times"}
+
+
+def split_invalid(services: list[ServiceRecord],
+                  checks: list[tuple[str, Check]] = None) -> tuple[list[int], list[tuple]]:
+    '''Runs every check over a batch of services at once. Returns the indexes of the valid
+    services, and the index of each invalid one paired with the reasons it failed.'''
+    checks = CHECKS if checks is None else checks
+    if not services:
+        return [], []
+
+    columns = get_text_columns(services)
+    failures = np.array([check(columns) for _, check in checks], dtype=bool)
+    invalid = failures.any(axis=0)
+    valid = np.flatnonzero(~invalid).tolist()
+    quarantined = [(index, [reason for (reason, _), failed in zip(checks, failures[:, index])
+                            if failed])
+                   for index in np.flatnonzero(invalid).tolist()]
+    return valid, quarantined
+
+
+def get_entry(crs: str, service: ServiceRecord, reasons: list[str]) -> dict:
+    '''Returns the quarantine entry of an invalid service'''
+    return {"station_crs": crs,
+            "service_uid": service.service_uid,
+            "run_date": service.run_date,
+            "reasons": reasons,
+            "record": service.to_rtt()}
+
+
+def validate_station(station: dict) -> tuple[dict, list[dict]]:
+    '''Returns the station with only its valid services, and a quarantine entry
+    for each invalid one'''
+    services = station["services"]
+    valid, quarantined = split_invalid(services)
+    entries = [get_entry(station["location"]["crs"], services[index], reasons)
+               for index, reasons in quarantined]
+    return {"location": station["location"],
+            "services": [services[index] for index in valid]}, entries
+
+
+def validate_batch(batch: NormalisedBatch) -> tuple[NormalisedBatch, list[dict]]:
+    '''Validates every fact of a normalised batch at once. Returns the batch rebuilt from
+    the valid facts, so no dimension is loaded for invalid services alone, and a
+    quarantine entry for each invalid fact.'''
+    valid, quarantined = split_invalid([fact.service for fact in batch.facts])
+    entries = [get_entry(batch.facts[index].station_crs, batch.facts[index].service, reasons)
+               for index, reasons in quarantined]
+    return normalise_facts(batch.stations, [batch.facts[index] for index in valid],
+                           batch.payloads), entries
+
+
+def get_reason_counts(entries: list[dict]) -> Counter:
+    '''Counts how many quarantined services failed each check'''
+    return Counter(reason for entry in entries for reason in entry["reasons"])
+
+
+def quarantine_services(conn: DBConnection, entries: list[dict]) -> None:
+    '''Stores quarantined services and their reasons in the quarantine table'''
+    if not entries:
+        return
+
+    query = '''
+        INSERT INTO quarantine (station_crs, service_uid, run_date, reasons, record)
+        VALUES (%s, %s, %s, %s, %s)
+    '''
+    try:
+        with conn.cursor() as cur:
+            for entry in entries:
+                cur.execute(query, (entry["station_crs"], entry["service_uid"],
+                                    entry["run_date"], entry["reasons"],
+                                    json.dumps(entry["record"])))
+        conn.commit()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        conn.rollback()
+        logging.error("Validate: Error occurred quarantining %s services: %s",
+                      len(entries), e)
+    logging.warning("Validate: Quarantined %s services: %s",
+                    len(entries), dict(get_reason_counts(entries)))
@@ -304,7 +304,10 @@ resource "aws_iam_role_policy" "c11-railway-tracker-realtime-scheduler_execution
       {
         Action   = "lambda:InvokeFunction"
         Effect   = "Allow"
-        Resource = aws_lambda_function.c11-railway-tracker-realtime-etl-lambda-function-new-tf.arn
+        Resource = [
+          aws_lambda_function.c11-railway-tracker-realtime-etl-lambda-function-new-tf.arn,
+          aws_lambda_function.c11-railway-tracker-realtime-incremental-lambda-function-tf.arn
+        ]
       }
     ]
   })
@@ -326,6 +329,60 @@ resource "aws_scheduler_schedule" "c11-railway-tracker-realtime-schedule-new-tf"
   }
 }
 
+# REALTIME INTRADAY POLLING LAMBDA:
+# Runs incremental_real.handler from the realtime image
+resource "aws_lambda_function" "c11-railway-tracker-realtime-incremental-lambda-function-tf" {
+  role          = aws_iam_role.c11-railway-tracker-realtime-lambda_execution_role-new-tf.arn
+  function_name = "c11-railway-tracker-realtime-incremental-lambda-function-tf"
+  package_type  = "Image"
+  architectures = ["x86_64"]
+  image_uri     = "129033205317.dkr.ecr.eu-west-2.amazonaws.com/c11-trainwreck-realtime:latest"
+
+  timeout       = 300
+  depends_on    = [aws_cloudwatch_log_group.lambda_log_group]
+
+  image_config {
+    command = ["incremental_real.handler"]
+  }
+
+  environment {
+    variables = {
+      ACCESS_KEY_ID     = var.AWS_ACCESS_KEY,
+      SECRET_ACCESS_KEY = var.AWS_SECRET_KEY,
+      DB_IP             = var.DB_IP,
+      DB_NAME           = var.DB_NAME,
+      DB_USERNAME       = var.DB_USERNAME,
+      DB_PASSWORD       = var.DB_PASSWORD,
+      DB_PORT           = var.DB_PORT,
+      REALTIME_USERNAME = var.REALTIME_USERNAME,
+      REALTIME_PASSWORD = var.REALTIME_PASSWORD
+    }
+  }
+    logging_config {
+    log_format = "Text"
+    log_group  = "/aws/lambda/c11-railway-tracker-realtime-incremental-lambda-function-tf"
+  }
+
+  tracing_config {
+    mode = "PassThrough"
+  }
+}
+
+resource "aws_scheduler_schedule" "c11-railway-tracker-realtime-incremental-schedule-tf" {
+  name                         = "c11-railway-tracker-realtime-incremental-schedule-tf"
+  schedule_expression          = "cron(*/5 * * * ? *)"
+  schedule_expression_timezone = "Europe/London"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  target {
+    arn      = aws_lambda_function.c11-railway-tracker-realtime-incremental-lambda-function-tf.arn
+    role_arn = aws_iam_role.c11-railway-tracker-realtime-scheduler_execution_role-tf.arn
+  }
+}
+
 
 
 # --------------- S3 REPORT BUCKET: